@@ -0,0 +1,98 @@
+import streamlit as st
+
+from aero_analysis import season_trend
+from render_cache import render_image, get_render_cache
+from instrumentation import span, start_run, finish_run, sidebar_panel
+
+start_run("aero_trend")
+
+#Streamlit display components
+st.header("Formula 1 Aerodynamic trend over the season")
+
+st.text("This analysis follows the aerodynamic map of each team over every event of one or more seasons.\n")
+st.text("For each event, the mean speed and top speed of each team's best lap are compared to the average of the field.\n")
+st.text("A team above zero on the mean speed chart is quicker than the field, above zero on the top speed chart it runs less drag.\n")
+st.caption("Events are computed once and saved, so only new events are processed when this page is opened again\n")
+
+years = st.multiselect(
+    'Select the seasons', (2022, 2023, 2024, 2025, 2026), default=[2025]
+)
+
+sess = st.selectbox(
+    'Select the session', ('FP1', 'FP2', 'FP3', 'Qualifying', 'Sprint Qualifying'), index=3
+)
+
+with st.spinner("Computing the events not processed yet..."):
+    with span("season_trend"):
+        trend = season_trend(years, sess)
+
+if trend.empty:
+    st.warning("No event of the selected seasons has been processed yet.")
+    st.stop()
+
+#Gap of every team to the field average of the event
+by_event = trend.groupby(['Year', 'Round'])
+trend['Mean speed gap (km/h)'] = trend['Mean speed (km/h)'] - by_event['Mean speed (km/h)'].transform('mean')
+trend['Top speed gap (km/h)'] = trend['Top speed (km/h)'] - by_event['Top speed (km/h)'].transform('mean')
+
+#One position on the x axis per event, in calendar order over all seasons
+events = trend[['Year', 'Round', 'Event']].drop_duplicates().reset_index(drop=True)
+events['x'] = events.index
+trend = trend.merge(events, on=['Year', 'Round', 'Event'])
+
+team_palette = trend.groupby('Team')['Color'].last().to_dict()
+
+def render_trend():
+    from matplotlib import pyplot as plt
+
+    fig, (ax1, ax2) = plt.subplots(2, 1, figsize=(12, 9), sharex=True)
+
+    for team, df in trend.groupby('Team'):
+        color = team_palette.get(team, "black")
+        ax1.plot(df['x'], df['Mean speed gap (km/h)'], color=color, marker='o', markersize=4, linewidth=1.2, label=team)
+        ax2.plot(df['x'], df['Top speed gap (km/h)'], color=color, marker='o', markersize=4, linewidth=1.2, label=team)
+
+    # ----- STYLE -----
+    for ax in (ax1, ax2):
+        ax.axhline(0, color='gray', linestyle='--', linewidth=1)
+        ax.grid(linestyle='-.', color='#CCCCCC')
+
+    ax1.set_ylabel("Mean speed gap to field (km/h)")
+    ax2.set_ylabel("Top speed gap to field (km/h)")
+
+    ax2.set_xticks(events['x'])
+    ax2.set_xticklabels(
+        [f"{year} {event.replace(' Grand Prix', '')}" for year, event in zip(events['Year'], events['Event'])],
+        rotation=60, ha='right', fontsize=8
+    )
+
+    ax1.legend(loc='upper left', bbox_to_anchor=(1.01, 1), fontsize=8)
+
+    ax1.set_title(
+        f"{', '.join(str(year) for year in sorted(years))} - {sess}\n"
+        "Aero Performance Trend (Fastest Laps)"
+    )
+
+    plt.tight_layout()
+
+    return fig
+
+#The number of events is part of the key, new events render a new chart
+with span("render.aero_trend", cache=get_render_cache()):
+    st.image(
+        render_image(("aero_trend", tuple(sorted(years)), sess, len(events)), render_trend),
+        width="stretch"
+    )
+
+#Table of the season, one row per team and event
+st.subheader("Team speeds per event")
+
+st.dataframe(
+    trend[['Year', 'Round', 'Event', 'Team', 'Mean speed (km/h)', 'Top speed (km/h)',
+           'Mean speed gap (km/h)', 'Top speed gap (km/h)']].round(2),
+    use_container_width=True,
+    hide_index=True
+)
+
+finish_run()
+sidebar_panel()
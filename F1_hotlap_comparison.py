@@ -1,16 +1,17 @@
 import streamlit as st
 
-import fastf1 as ff1
-from fastf1.ergast import Ergast
-import fastf1.plotting
-
 import numpy as np
 import pandas as pd
-import matplotlib.pyplot as plt
-import matplotlib.patches as mpatches
 
-from matplotlib.collections import LineCollection
-from scipy.ndimage import gaussian_filter1d
+from metadata_index import get_metadata_index
+from hotlap_analysis import corner_gain_table, MINI_SECTORS
+from render_cache import render_image, get_render_cache
+from track_map_view import track_map_html
+from instrumentation import span, start_run, finish_run, sidebar_panel
+from prefetch import WEEKEND_ORDER
+from analysis_service import fetch, corner_results, minisector_results, ServiceError
+
+start_run("hotlap")
 
 #Header display and select box
 st.header("Formula 1 Hotlap comparison")
@@ -22,8 +23,10 @@ st.text("The table at the end compares the time gained over every corner, feel f
 year = st.selectbox(
 'Select the year', (2022,2023,2024,2025,2026))
 
-#It would be best to to able to select this schedule and 
-schedule = Ergast().get_race_schedule(season=year)
+#Schedule comes from the local metadata index, no network call on reruns
+with span("schedule"):
+    metadata = get_metadata_index()
+    schedule = metadata.schedule(year)
 
 col1, col2 = st.columns(2)
 
@@ -33,78 +36,28 @@ with col1:
 
 with col2:
     session_type = st.selectbox(
-    'Please only select Sprint for track with sprint qualifying session :', ('FP1','FP2','FP3','Sprint Qualifying','Qualifying')
+    'Please only select Sprint for track with sprint qualifying session :',
+    metadata.session_names(year, event, ('FP1','FP2','FP3','Sprint Qualifying','Qualifying'))
 )
 
-#Load the session
-session = ff1.get_session(year, event, session_type)
-session.load()
-
-#Print out the qualifying result
-
-#fastf1.plotting.setup_mpl(color_scheme='fastf1') #color_scheme='official' or 'fastf1'
-
-all_laps = session.laps.pick_quicklaps()
-all_laps = all_laps.dropna(subset=[
-    'LapTime',
-    'Sector1Time',
-    'Sector2Time',
-    'Sector3Time'
-])
-
-drivers = pd.unique(all_laps['Driver'])
-
-all_laps['LapTime(s)'] = all_laps['LapTime'].dt.total_seconds()
-all_laps['Sector1(s)'] = all_laps['Sector1Time'].dt.total_seconds()
-all_laps['Sector2(s)'] = all_laps['Sector2Time'].dt.total_seconds()
-all_laps['Sector3(s)'] = all_laps['Sector3Time'].dt.total_seconds()
-#drivers = pd.unique(all_laps['Driver']) # all drivers
-#teams = pd.unique(all_laps['Team']) # all teams
-ult = all_laps['Sector1(s)'].min() + all_laps['Sector2(s)'].min() + all_laps['Sector3(s)'].min() # Ultimate lap (combination of best three sector times)
-
-df = []
-for driver in drivers:
-
-    driver_laps = all_laps.pick_drivers(driver)
-
-    s1 = driver_laps['Sector1(s)'].min()
-    s2 = driver_laps['Sector2(s)'].min()
-    s3 = driver_laps['Sector3(s)'].min()
-
-    df.append({
-        'Driver': driver,
-        'S1_delta': s1 - all_laps['Sector1(s)'].min(),
-        'S2_delta': s2 - all_laps['Sector2(s)'].min(),
-        'S3_delta': s3 - all_laps['Sector3(s)'].min(),
-        'Total_delta': (s1 - all_laps['Sector1(s)'].min()) +
-                       (s2 - all_laps['Sector2(s)'].min()) +
-                       (s3 - all_laps['Sector3(s)'].min()),
-        'Gap_PB_ideal':
-            driver_laps.pick_fastest()['LapTime(s)'] -
-            (s1 + s2 + s3)
-    })
-    
-df = pd.DataFrame(df)
-df = df.sort_values(by='Total_delta', ascending=False)
-   
-fig1, ax = plt.subplots(figsize=(8, 8))
-
-ax.set_title(
-    f"{session.event.year} {session.event['EventName']}, {session.name}\nIdeal vs actual laptimes")
-
-plt.barh(y=df['Driver'], width=df['S1_delta'], left=0, color='#FF0000', label='Gap to best-overall S1 time', fill=True)
-plt.barh(y=df['Driver'], width=df['S2_delta'], left=(df['S1_delta']), color='#00A1FF', label='Gap to best-overall S2 time', fill=True)
-plt.barh(y=df['Driver'], width=df['S3_delta'], left=(df['S1_delta'] + df['S2_delta']), color='#FFEA00', label='Gap to best-overall S3 time', fill=True)
-plt.scatter(x=df['Total_delta'], y=df['Driver'], color='#C900FF', label='Ideal PB', zorder=2)
-plt.plot((df['Total_delta']+df['Gap_PB_ideal']), df['Driver'], color='#5EFF00', label='Actual PB', linestyle="--", marker="o", zorder=1)
-plt.legend()
-plt.xlabel(f"Gap (s) from ideal personal-best lap to \"ultimate\" lap ({ult} s)")
-plt.grid(linestyle='--', color='#808080', which='major', axis='x') #major grid lines settings
-plt.minorticks_on() #show minor grid lines
-plt.grid(linestyle='--', color='#404040', which='minor', axis='x', linewidth = 0.5) #minor grid lines settings    
-
-# Display in Streamlit
-st.pyplot(fig1)
+#The analyses run in the analysis service (or in-process through the same pool),
+#identical requests of concurrent users share a single computation
+ideal = fetch("ideal_lap", year=year, event=event, session=session_type)
+
+df = pd.DataFrame(ideal['table'])
+ult = ideal['ultimate'] # Ultimate lap (combination of best three sector times)
+
+#Figures (and matplotlib) are only imported when a chart is not in the render cache
+def render_ideal_lap_chart():
+    from figures import ideal_lap_figure
+    return ideal_lap_figure(df, ult, ideal['title'])
+
+# Display in Streamlit (rendered once per session, then served from the render cache)
+with span("render.ideal_lap", cache=get_render_cache()):
+    st.image(render_image(("ideal_lap", year, event, session_type), render_ideal_lap_chart), width="stretch")
+
+#Only drivers whose fastest lap has telemetry can be compared
+drivers = fetch("drivers", year=year, event=event, session=session_type)['drivers']
 
 #Driver selection
 col1, col2 = st.columns(2)
@@ -117,207 +70,159 @@ with col2:
         remaining_options = [x for x in drivers if x != driver1]
         driver2 = st.selectbox("Second driver", remaining_options)
 
-lap1 = session.laps.pick_driver(driver1).pick_fastest()
-lap2 = session.laps.pick_driver(driver2).pick_fastest()
-
-tel1 = lap1.get_telemetry().add_distance()
-tel2 = lap2.get_telemetry().add_distance()
+#Every driver's fastest lap is interpolated once per session onto a shared
+#distance grid, switching the driver pair only slices the engine arrays
+comparison = fetch("pair", year=year, event=event, session=session_type, driver1=driver1, driver2=driver2)
 
 # ---- DISTANCE AXIS ----
-lap_length = tel1["Distance"].max()
-distance = np.linspace(0, lap_length, 1800)
-
-# ---- INTERPOLATE TIMES ----
-t1 = np.interp(distance, tel1["Distance"], tel1["Time"].dt.total_seconds())
-t2 = np.interp(distance, tel2["Distance"], tel2["Time"].dt.total_seconds())
+distance = np.asarray(comparison['distance'])
 
-delta = t2 - t1
+# ---- SMOOTHED DELTA ----
+delta = np.asarray(comparison['delta'])
 
-# ---- SMOOTH DELTA ----
-sigma = 6
-delta = gaussian_filter1d(delta, sigma)
-
-# ---- INTERPOLATE TRACK ----
-x = np.interp(distance, tel1["Distance"], tel1["X"])
-y = np.interp(distance, tel1["Distance"], tel1["Y"])
-
-# ---- NORMALIZE TRACK ----
-x = x - np.mean(x)
-y = y - np.mean(y)
-
-scale = max(np.max(np.abs(x)), np.max(np.abs(y)))
-x = x / scale
-y = y / scale
-
-
-# ---- BUILD TRACK SEGMENTS ----
-points = np.array([x, y]).T.reshape(-1,1,2)
-segments = np.concatenate([points[:-1], points[1:]], axis=1)
-
-# ---- PLOT ----
-fig, ax = plt.subplots(figsize=(8,8))
-
-norm = plt.Normalize(-abs(delta).max(), abs(delta).max())
+# ---- TRACK (NORMALIZED) ----
+x, y = np.asarray(comparison['x']), np.asarray(comparison['y'])
 
 # ---- CORNER GAINS ----
-circuit_info = session.get_circuit_info()
-
-corner_distances = []
-
-for _, corner in circuit_info.corners.iterrows():
-
-    cx = corner["X"]
-    cy = corner["Y"]
-
-    # Find closest telemetry point
-    dist_idx = np.argmin((tel1["X"] - cx)**2 + (tel1["Y"] - cy)**2)
-
-    corner_distance = tel1["Distance"].iloc[dist_idx]
-
-    corner_distances.append(corner_distance)
-    
-#Compute gains betwwen corners
-corner_distances = np.array(corner_distances)
-
-corner_delta = []
-
-for d in corner_distances:
-    idx = np.argmin(np.abs(distance - d))
-    corner_delta.append(delta[idx])
-
-corner_delta = np.array(corner_delta)
-
-# Gain between corners
-corner_gain = np.diff(corner_delta, prepend=0)
-
-# ---- CORNER LABELS (NUMBER ONLY) ----
-circuit_info = session.get_circuit_info()
-
-offset = 0.06
-
-corner_table = []
-
-for i, corner in circuit_info.corners.iterrows():
-
-    cx = corner["X"]
-    cy = corner["Y"]
-
-    # Normalize coordinates
-    cx = cx - np.mean(tel1["X"])
-    cy = cy - np.mean(tel1["Y"])
-
-    cx = cx / scale
-    cy = cy / scale
+corner_map, corner_numbers, corner_gain = corner_results(comparison['corners'])
 
-    # Find closest telemetry point
-    idx = np.argmin((x - cx)**2 + (y - cy)**2)
-
-    # Track direction
-    dx = x[min(idx+1, len(x)-1)] - x[max(idx-1,0)]
-    dy = y[min(idx+1, len(y)-1)] - y[max(idx-1,0)]
-
-    length = np.sqrt(dx**2 + dy**2)
-    dx /= length
-    dy /= length
-
-    # Perpendicular vector
-    nx = -dy
-    ny = dx
-
-    # Label position
-    lx = cx + nx * offset
-    ly = cy + ny * offset
-
-    # White dot at corner
-    ax.scatter(cx, cy, color="white", s=8, zorder=5)
-
-    gain = corner_gain[i]
-
-    # Color depending on faster driver
-    if gain > 0:
-        color = "red"     # driver 1 faster
-    else:
-        color = "blue"    # driver 2 faster
-
-    # Draw only the corner number
-    ax.text(
-        lx,
-        ly,
-        f"{int(corner['Number'])}",
-        color="white",
-        fontsize=9,
-        ha="center",
-        va="center",
-        bbox=dict(
-            facecolor=color,
-            edgecolor="black",
-            linewidth=0.5,
-            alpha=0.9,
-            pad=1
-        )
+def render_track_map():
+    from figures import track_map_figure
+    return track_map_figure(
+        x, y, delta, corner_map, corner_numbers, corner_gain,
+        f"{year} {event} Qualifying", driver1, driver2
     )
 
-    # Save data for table
-    corner_table.append({
-        "Turn": int(corner["Number"]),
-        "Delta (s)": round(gain, 3)
-    })
-lc = LineCollection(
-    segments,
-    cmap="coolwarm",
-    norm=norm,
-    linewidth=5
-)
-
-lc.set_array(delta)
-ax.add_collection(lc)
-
-# ---- LOCK AXIS LIMITS ----
-ax.set_xlim(-1.1,1.1)
-ax.set_ylim(-1.1,1.1)
-
-ax.set_aspect("equal")
-ax.axis("off")
+#The interactive map gets the simplified track and every driver's times once
+#per session, colouring, hover and zoom then run in the browser
+if st.toggle("Interactive track map", value=False):
+    payload = fetch("track_map", year=year, event=event, session=session_type)['payload']
+    import streamlit.components.v1 as components
+    components.html(track_map_html(payload, driver1, driver2), height=640)
+else:
+    with span("render.track_map", cache=get_render_cache()):
+        st.image(
+            render_image(("track_map", year, event, session_type, driver1, driver2), render_track_map),
+            width="stretch"
+        )
 
-# ---- COLORBAR ----
-cbar = fig.colorbar(lc, ax=ax, shrink=0.75)
-cbar.set_label("Delta (s)")
+# Save data for table
+corner_df = corner_gain_table(corner_numbers, corner_gain, driver1, driver2)
 
-# ---- TITLE ----
-ax.set_title(
-    f"{year} {event} Qualifying\n{driver1} vs {driver2}",
-    color="black"
-)
+st.subheader("Corner Time Gains")
 
-# ---- DRIVER COLOR CAPTION ----
-ax.text(
-    0,
-    -1.25,
-    f"Red = {driver1} faster    |    Blue = {driver2} faster",
-    ha="center",
-    fontsize=10,
-    bbox=dict(facecolor="white", alpha=0.8, edgecolor="none", pad=3)
+st.dataframe(
+    corner_df,
+    use_container_width=True,
+    hide_index=True
 )
 
-st.pyplot(fig)
+# ---- MINI-SECTOR DOMINANCE ----
+st.subheader("Track dominance by mini-sectors")
 
-corner_df = pd.DataFrame(corner_table)
+col1, col2, col3 = st.columns(3)
 
-corner_df["Faster Driver"] = corner_df["Delta (s)"].apply(
-    lambda x: driver1 if x > 0 else driver2
-)
+with col1:
+    n_minisectors = st.slider("Number of mini-sectors", 5, 100, MINI_SECTORS)
 
-corner_df["Gain (s)"] = corner_df["Delta (s)"].abs()
+with col2:
+    dominance_drivers = st.multiselect("Drivers", drivers, default=[driver1, driver2])
+
+with col3:
+    every_lap = st.toggle("Every lap", value=False, help="Best mini-sectors over every timed lap instead of the fastest lap")
+
+if dominance_drivers:
+    #Every driver's mini-sector times come from the same engine arrays (or every lap laid end to end), in one pass
+    minisectors, colors = minisector_results(fetch(
+        "minisectors", year=year, event=event, session=session_type, drivers=dominance_drivers, n=n_minisectors,
+        all_laps=every_lap
+    ))
+
+    def render_dominance_map():
+        from figures import dominance_map_figure
+        return dominance_map_figure(x, y, distance, minisectors, colors, f"{year} {event} {session_type}")
+
+    with span("render.dominance_map", cache=get_render_cache()):
+        st.image(
+            render_image(("dominance", year, event, session_type, tuple(dominance_drivers), n_minisectors, every_lap),
+                         render_dominance_map),
+            width="stretch"
+        )
 
-corner_df = corner_df[["Turn", "Faster Driver", "Gain (s)"]]
+    st.text(f"Theoretical best lap over the selected drivers: {minisectors.theoretical_best:.3f} s")
 
-st.subheader("Corner Time Gains")
+# ---- CROSS-SESSION COMPARISON ----
+st.subheader("Compare with another session")
+st.text("Compare the first driver's lap with a lap of another session or season at the same circuit.\n")
 
-st.dataframe(
-    corner_df,
-    use_container_width=True,
-    hide_index=True
-)
+#Off by default: the other session is only loaded (and registered) on request
+if st.toggle("Compare with another session", value=False):
+    circuit = metadata.circuit_id(year, event)
+    years = (2022,2023,2024,2025,2026)
 
+    col1, col2, col3 = st.columns(3)
 
+    #Defaults to the previous season at the circuit, never to the page's own session
+    with col1:
+        other_year = st.selectbox('Year', years, index=max(years.index(year) - 1, 0), key="other_year")
 
+    other_events = metadata.circuit_events(other_year, circuit)
+    if not other_events:
+        st.info(f"The circuit was not raced in {other_year}.")
+    else:
+        other_event = other_events[0]
+        other_types = metadata.session_names(other_year, other_event, WEEKEND_ORDER)
+
+        with col2:
+            other_type = st.selectbox('Session', other_types,
+                                      index=next((i for i, s in enumerate(other_types)
+                                                  if (other_year, s) != (year, session_type)), 0),
+                                      key="other_session")
+
+        other_drivers = fetch("ideal_lap", year=other_year, event=other_event, session=other_type)['drivers']
+        #In the page's own session, the first driver's lap is only compared with another driver's
+        if (other_year, other_event, other_type) == (year, event, session_type):
+            other_drivers = [x for x in other_drivers if x != driver1]
+
+        with col3:
+            other_driver = st.selectbox('Driver', other_drivers,
+                                        index=other_drivers.index(driver1) if driver1 in other_drivers else 0,
+                                        key="other_driver")
+
+        if other_driver is None:
+            st.info("No other driver set a lap in this session.")
+        else:
+            #Both sessions are registered once onto the circuit's canonical frame,
+            #the laps compared are then aligned with those registrations
+            try:
+                cross = fetch("cross_session", year=year, event=event, session=session_type, driver=driver1,
+                              other_year=other_year, other_session=other_type, other_driver=other_driver)
+            except ServiceError as exc:
+                st.warning(str(exc))
+            else:
+                label1, label2 = cross['labels']
+                cross_map, cross_numbers, cross_gain = corner_results(cross['corners'])
+
+                def render_cross_session_map():
+                    from figures import track_map_figure
+                    return track_map_figure(
+                        np.asarray(cross['x']), np.asarray(cross['y']), np.asarray(cross['delta']),
+                        cross_map, cross_numbers, cross_gain,
+                        f"{event} - {year} {session_type} vs {other_year} {other_type}", label1, label2
+                    )
+
+                with span("render.cross_session_map", cache=get_render_cache()):
+                    st.image(
+                        render_image(("cross_session", year, event, session_type, driver1,
+                                      other_year, other_event, other_type, other_driver), render_cross_session_map),
+                        width="stretch"
+                    )
+
+                st.dataframe(
+                    corner_gain_table(cross_numbers, cross_gain, label1, label2),
+                    use_container_width=True,
+                    hide_index=True
+                )
+
+finish_run()
+sidebar_panel()
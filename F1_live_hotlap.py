@@ -0,0 +1,102 @@
+import os
+from glob import glob
+
+import numpy as np
+import streamlit as st
+
+from hotlap_analysis import CornerIndex, normalize_track, corner_gain_table
+from live_session import LIVE_DIR, LIVE_INTERVAL, get_live_session, get_live_render_cache
+
+#Header display and select box
+st.header("Formula 1 live hotlap comparison")
+st.text("This page follows a qualifying session as it happens: the ideal lap table, the track delta map and the corner gains update as new fastest laps arrive.\n")
+st.text("Only the drivers that set a new lap are recomputed, the views refresh every few seconds.\n")
+st.caption("The live feed is replayed from a recorded session, record one with: python live_session.py <year> <event> <session> <file>\n")
+
+files = sorted(glob(os.path.join(LIVE_DIR, '*.jsonl')))
+if not files:
+    st.warning(f"No recorded session found in {LIVE_DIR}.")
+    st.stop()
+
+col1, col2 = st.columns(2)
+
+with col1:
+    path = st.selectbox('Select the recorded session', files, format_func=os.path.basename)
+
+with col2:
+    speed = st.select_slider('Replay speed', (1, 2, 5, 10, 30, 60), value=10)
+
+#The replay runs in a background thread, shared by every viewer of the file
+live, feed = get_live_session(path, speed)
+
+
+@st.fragment(run_every=LIVE_INTERVAL)
+def live_view():
+    #Copy what is drawn under the lock, the feed keeps updating meanwhile
+    with live.lock:
+        version = live.version
+        header = dict(live.header)
+        engine = live.engine
+        drivers = list(engine.drivers) if engine is not None else []
+        reference = live.reference
+
+    title = f"{header.get('year', '')} {header.get('event', '')} {header.get('session', '')}".strip()
+    st.caption(f"{'Replay finished' if feed.finished else 'Live'} - update {version}")
+
+    if len(drivers) < 2:
+        st.info("Waiting for two drivers to set a lap...")
+        return
+
+    #Every new version is drawn, figures (and matplotlib) are needed from here on
+    from figures import ideal_lap_figure, track_map_figure
+
+    df = live.ideal_lap_table().sort_values(by='Total_delta', ascending=False)
+    ult = live.ultimate_lap()
+    #Live figures go to their own small cache, every version is a new image
+    render_cache = get_live_render_cache()
+    st.image(
+        render_cache.get(("live_ideal_lap", path, speed, version), lambda: ideal_lap_figure(df, ult, title)),
+        width="stretch"
+    )
+
+    col1, col2 = st.columns(2)
+
+    with col1:
+        driver1 = st.selectbox("First driver", drivers, key="live_driver1")
+
+    with col2:
+        driver2 = st.selectbox("Second driver", [d for d in drivers if d != driver1], key="live_driver2")
+
+    with live.lock:
+        version = live.version
+        delta = engine.delta(driver1, driver2)
+        x, y, center, scale = normalize_track(*engine.track(driver1))
+        distance = engine.distance.copy()
+
+    corners = live.corners
+    if corners is None or reference is None:
+        st.info("The recording has no corner table, the track map is not available.")
+        return
+
+    #Corners are located on the fastest lap so far, one lap of work per refresh
+    corner_map = CornerIndex(corners, reference).map(distance, center=center, scale=scale)
+    corner_gain = np.diff(delta[corner_map.grid_idx], prepend=0)
+
+    st.image(
+        render_cache.get(
+            ("live_track_map", path, speed, version, driver1, driver2),
+            lambda: track_map_figure(x, y, delta, corner_map, corners["Number"], corner_gain, title, driver1, driver2)
+        ),
+        width="stretch"
+    )
+
+    st.subheader("Corner Time Gains")
+
+    st.dataframe(
+        corner_gain_table(corners["Number"], corner_gain, driver1, driver2),
+        use_container_width=True,
+        hide_index=True
+    )
+
+
+live_view()
@@ -0,0 +1,315 @@
+"""Computations behind the aero analysis pages."""
+import datetime as dt
+import logging
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+
+import numpy as np
+import pandas as pd
+
+_logger = logging.getLogger(__name__)
+
+#Threads used to slice the car data of the team laps and drivers
+MAX_WORKERS = 8
+
+#Half width in metres of the window around a corner its minimum speed is taken in
+CORNER_WINDOW = 60.0
+
+#Speed band in km/h the straight-line acceleration is measured in
+ACCEL_BAND = (150.0, 280.0)
+
+SESSION_SPEED_COLUMNS = ['Team', 'Laps', 'Mean speed (km/h)', 'Top speed (km/h)', 'Speed trap p50 (km/h)',
+                         'Speed trap p90 (km/h)', 'Corner min speed (km/h)', 'Acceleration (m/s2)']
+
+#Per-event results of the season trend, one CSV per (year, round, session)
+TREND_DIR = os.environ.get(
+    "F1_AERO_TREND_DIR",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "aero_trend")
+)
+
+
+def session_teams(session):
+    """Teams that set a lap in the session, in order of first appearance."""
+    return [team for team in pd.unique(session.laps['Team']) if isinstance(team, str) and team]
+
+
+def team_fastest_laps(session):
+    """Fastest lap of every team of the session (teams without one are left out)."""
+    laps = {team: session.laps.pick_teams(team).pick_fastest() for team in session_teams(session)}
+    return {team: lap for team, lap in laps.items() if lap is not None}
+
+
+def team_car_data(session, lap_car_data, max_workers=MAX_WORKERS):
+    """Fastest lap and its car data for every team, fetched concurrently.
+
+    ``lap_car_data`` returns the car data (with distance) of a lap; it is
+    called from worker threads. Returns two dicts keyed by team name.
+    """
+    laps = team_fastest_laps(session)
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        data = dict(zip(laps, pool.map(lap_car_data, laps.values())))
+    return laps, data
+
+
+def team_speed_table(team_laps, team_data, track_length=None):
+    """Mean speed and top speed of every team's lap.
+
+    The mean speed is the track length divided by the lap time. Without a
+    known track length the distance covered by the lap's car data is used.
+    """
+    results = []
+    for team, lap in team_laps.items():
+        data = team_data[team]
+        length = data['Distance'].max() if pd.isna(track_length) else track_length
+        results.append({
+            'Team': team,
+            'Mean speed (km/h)': length / lap['LapTime'].total_seconds() * 3.6,
+            'Top speed (km/h)': float(data['Speed'].max())
+        })
+    return pd.DataFrame(results, columns=['Team', 'Mean speed (km/h)', 'Top speed (km/h)'])
+
+
+def representative_laps(session):
+    """Timed laps of the session that reflect the car's pace.
+
+    Quick laps (within 107% of the fastest) that were not deleted and are
+    neither in nor out laps, for the teams of the session.
+    """
+    laps = session.laps.pick_quicklaps().dropna(subset=['LapTime'])
+    if 'PitInTime' in laps and 'PitOutTime' in laps:
+        laps = laps.pick_wo_box()
+    if 'Deleted' in laps:
+        laps = laps[laps['Deleted'] != True]  # noqa: E712
+    return laps[laps['Team'].isin(session_teams(session))]
+
+
+def split_laps(car_data, laps):
+    """Samples of a driver's session car data that fall inside ``laps``.
+
+    ``car_data`` is the merged car data of one driver over the whole session
+    (``session.car_data[number]``), ``laps`` some of that driver's laps. The
+    samples are located with one ``searchsorted`` over the lap start and end
+    times, and the distance of every lap is integrated from its speed as
+    ``add_distance`` does. Returns the lap position (among the laps kept),
+    distance, time and speed of every sample, and which laps have samples.
+    """
+    session_time = car_data['SessionTime'].dt.total_seconds().to_numpy()
+    start = laps['LapStartTime'].dt.total_seconds().to_numpy()
+    end = laps['Time'].dt.total_seconds().to_numpy()
+    lo = np.searchsorted(session_time, np.nan_to_num(start, nan=np.inf), side='left')
+    hi = np.searchsorted(session_time, np.nan_to_num(end, nan=-np.inf), side='right')
+    sizes = (hi - lo).clip(0)
+    keep = sizes > 0
+    sizes, lo, start = sizes[keep], lo[keep], start[keep]
+
+    #Sample indices of the laps laid end to end
+    offsets = np.cumsum(sizes) - sizes
+    idx = np.arange(sizes.sum()) - np.repeat(offsets - lo, sizes)
+    lap = np.repeat(np.arange(len(sizes)), sizes)
+    time = session_time[idx]
+    speed = car_data['Speed'].to_numpy(dtype=float)[idx]
+
+    dt = np.diff(time, prepend=np.nan)
+    dt[offsets] = time[offsets] - start
+    covered = np.concatenate([[0.0], np.cumsum(speed / 3.6 * dt)])
+    dist = covered[1:] - np.repeat(covered[offsets], sizes)
+    return lap, dist, time, speed, keep
+
+
+def _lap_metrics(lap, dist, time, speed, corner_distances, trap_distance):
+    #One grouped pass over the samples of laps laid end to end (``lap`` is
+    #the lap position of every sample), reductions are per lap in numpy
+    starts = np.flatnonzero(np.diff(lap, prepend=-1))
+    n_laps = len(starts)
+
+    top = np.maximum.reduceat(speed, starts)
+
+    #Speed at the trap, every lap shifted past the previous one for a single interpolation
+    stride = dist.max(initial=0.0) + 1.0
+    trap = np.interp(trap_distance + np.arange(n_laps) * stride, dist + lap * stride, speed)
+
+    #Minimum speed in the window around every corner, windows of close corners
+    #are cut at their midpoint so every sample belongs to one corner at most
+    corner_min = np.full((n_laps, len(corner_distances)), np.nan)
+    if len(corner_distances):
+        mids = (corner_distances[1:] + corner_distances[:-1]) / 2
+        lower = np.maximum(corner_distances - CORNER_WINDOW, np.concatenate([[-np.inf], mids]))
+        upper = np.minimum(corner_distances + CORNER_WINDOW, np.concatenate([mids, [np.inf]]))
+        corner = np.searchsorted(lower, dist, side='right') - 1
+        inside = (corner >= 0) & (dist < upper[corner.clip(0)])
+        lowest = np.full(corner_min.size, np.inf)
+        np.minimum.at(lowest, lap[inside] * len(corner_distances) + corner[inside], speed[inside])
+        corner_min = np.where(np.isinf(lowest), np.nan, lowest).reshape(corner_min.shape)
+
+    #Straight-line acceleration: speed gained over time spent accelerating in the band
+    dv = np.diff(speed) / 3.6
+    dt = np.diff(time)
+    accelerating = ((lap[1:] == lap[:-1]) & (dv > 0) & (dt > 0)
+                    & (speed[:-1] >= ACCEL_BAND[0]) & (speed[1:] <= ACCEL_BAND[1]))
+    gained = np.bincount(lap[1:][accelerating], weights=dv[accelerating], minlength=n_laps)
+    spent = np.bincount(lap[1:][accelerating], weights=dt[accelerating], minlength=n_laps)
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        accel = gained / spent
+    return top, trap, corner_min, accel
+
+
+def session_speed_metrics(session, driver_car_data, track_length=None, corner_distances=(),
+                          max_workers=MAX_WORKERS):
+    """Speed metrics of every team over all its representative laps.
+
+    ``driver_car_data`` returns the merged car data of a driver over the
+    whole session from its driver number (``session.car_data[number]``).
+    Drivers are processed concurrently: the car data of each is split into
+    its representative laps with :func:`split_laps` and reduced to a few
+    numbers per lap in one grouped pass, so only the drivers in flight are
+    ever sliced and no per-lap frame is built or kept. The per-lap numbers
+    are then aggregated per team:
+
+    * mean speed: track length over the median lap time
+    * top speed: median of the laps' top speeds
+    * speed trap p50/p90: the official speed trap (``SpeedST``) when the laps
+      carry it, else the car data at the point the fastest lap peaks
+    * corner min speed: median over laps of the mean minimum speed around
+      the corners at ``corner_distances`` (metres along the lap)
+    * acceleration: median straight-line acceleration in ``ACCEL_BAND``
+    """
+    laps = representative_laps(session)
+    if not len(laps):
+        return pd.DataFrame(columns=SESSION_SPEED_COLUMNS)
+    corner_distances = np.sort(np.asarray(corner_distances, dtype=float))
+    official = 'SpeedST' in laps and laps['SpeedST'].notna().any()
+
+    def driver_samples(number, driver_laps):
+        car_data = driver_car_data(number)
+        if car_data is None or not len(car_data):
+            return None
+        return split_laps(car_data, driver_laps)
+
+    #Without the official speed trap, it is placed where the fastest representative lap is quickest.
+    #Without car data of the fastest lap, the trap and a missing track length are unknown
+    fastest = laps.pick_fastest()
+    samples = driver_samples(fastest['DriverNumber'], laps.loc[[fastest.name]])
+    trap_distance = np.nan
+    if pd.isna(track_length):
+        track_length = np.nan
+    if samples is not None and samples[4].any():
+        _, dist, _, speed, _ = samples
+        trap_distance = float(dist[np.argmax(speed)])
+        if pd.isna(track_length):
+            track_length = float(dist.max())
+
+    def driver_metrics(item):
+        number, driver_laps = item
+        samples = driver_samples(number, driver_laps)
+        if samples is None or not samples[4].any():
+            return None
+        lap, dist, time, speed, keep = samples
+        top, trap, corner_min, accel = _lap_metrics(lap, dist, time, speed, corner_distances, trap_distance)
+        with np.errstate(invalid='ignore'):
+            corners = np.nanmean(corner_min, axis=1) if corner_min.shape[1] else np.full(len(top), np.nan)
+        return pd.DataFrame({
+            'Team': driver_laps['Team'].to_numpy()[keep],
+            'LapTime': driver_laps['LapTime'].dt.total_seconds().to_numpy()[keep],
+            'Top': top,
+            'Trap': driver_laps['SpeedST'].to_numpy(dtype=float)[keep] if official else trap,
+            'Corner': corners,
+            'Accel': accel
+        })
+
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        parts = [part for part in pool.map(driver_metrics, laps.groupby('DriverNumber', sort=False))
+                 if part is not None]
+
+    if not parts:
+        return pd.DataFrame(columns=SESSION_SPEED_COLUMNS)
+    per_lap = pd.concat(parts, ignore_index=True)
+    by_team = per_lap.groupby('Team', sort=False)
+    results = pd.DataFrame({
+        'Laps': by_team.size(),
+        'Mean speed (km/h)': track_length / by_team['LapTime'].median() * 3.6,
+        'Top speed (km/h)': by_team['Top'].median(),
+        'Speed trap p50 (km/h)': by_team['Trap'].quantile(0.5),
+        'Speed trap p90 (km/h)': by_team['Trap'].quantile(0.9),
+        'Corner min speed (km/h)': by_team['Corner'].median(),
+        'Acceleration (m/s2)': by_team['Accel'].median()
+    }).rename_axis('Team').reset_index()
+    return results[SESSION_SPEED_COLUMNS]
+
+
+def event_team_speeds(year, rnd, event, session_type, track_length=None):
+    """Team speed table of one event, with the columns of the season trend.
+
+    Runs in a worker process: the session is loaded directly (laps and
+    telemetry only) rather than through the page's session store.
+    """
+    import fastf1 as ff1
+    from fastf1 import plotting
+
+    session = ff1.get_session(year, event, session_type)
+    session.load(laps=True, telemetry=True, weather=False, messages=True)
+
+    team_laps, team_data = team_car_data(session, lambda lap: lap.get_car_data().add_distance())
+    results = team_speed_table(team_laps, team_data, track_length)
+    results.insert(0, 'Year', year)
+    results.insert(1, 'Round', rnd)
+    results.insert(2, 'Event', event)
+    results.insert(3, 'Session', session_type)
+    results['Color'] = [plotting.get_team_color(team, session, exact_match=True) for team in team_laps]
+    results['Team'] = [plotting.get_team_name(team, session, short=True) for team in team_laps]
+    return results
+
+
+def _trend_path(trend_dir, year, rnd, session_type):
+    return os.path.join(trend_dir, str(year), f"{rnd:02d}_{session_type.replace(' ', '_')}.csv")
+
+
+def season_trend(years, session_type, index=None, trend_dir=TREND_DIR, max_workers=None):
+    """Team speeds of every past event of one or more seasons.
+
+    Events already computed are read back from ``trend_dir``; only new events
+    are computed, fanned out over a process pool, and then persisted. Events
+    that fail to load are logged and retried on the next run.
+    """
+    if index is None:
+        from metadata_index import get_metadata_index
+        index = get_metadata_index()
+
+    today = dt.date.today().isoformat()
+    frames = []
+    jobs = {}
+    for year in years:
+        for _, row in index.schedule(year).iterrows():
+            event = row['raceName']
+            if row['raceDate'] > today:
+                continue
+            if session_type not in index.session_names(year, event, (session_type,)):
+                continue
+            path = _trend_path(trend_dir, year, row['round'], session_type)
+            if os.path.exists(path):
+                frames.append(pd.read_csv(path))
+            else:
+                jobs[path] = (year, row['round'], event, session_type, row['trackLength'])
+
+    if jobs:
+        #Spawned, not forked: the server's threads may hold the import or logging locks
+        with ProcessPoolExecutor(max_workers=max_workers, mp_context=multiprocessing.get_context("spawn")) as pool:
+            futures = {pool.submit(event_team_speeds, *job): path for path, job in jobs.items()}
+            for future in as_completed(futures):
+                path = futures[future]
+                try:
+                    results = future.result()
+                except Exception as exc:
+                    year, _, event = jobs[path][:3]
+                    _logger.warning("Skipping %s %s: %s", year, event, exc)
+                    continue
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                results.to_csv(path + '.tmp', index=False)
+                os.replace(path + '.tmp', path)
+                frames.append(results)
+
+    if not frames:
+        return pd.DataFrame(columns=['Year', 'Round', 'Event', 'Session', 'Team',
+                                     'Mean speed (km/h)', 'Top speed (km/h)', 'Color'])
+    return pd.concat(frames, ignore_index=True).sort_values(by=['Year', 'Round', 'Team']).reset_index(drop=True)
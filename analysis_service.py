@@ -0,0 +1,556 @@
+"""Local analysis service: the computations of the pages over HTTP/JSON.
+
+Every Streamlit session used to recompute its analyses in its own script
+run, and nothing outside Streamlit could reuse them. The service runs them
+once per request in a bounded thread pool, and identical requests that
+arrive while one is being computed wait on that computation instead of
+starting their own::
+
+    python analysis_service.py --port 8765 --workers 4
+    F1_SERVICE_URL=http://127.0.0.1:8765 streamlit run F1_hotlap_comparison.py
+
+Endpoints (GET, parameters in the query string, JSON responses)::
+
+    /ideal_lap      year, event, session
+    /drivers        year, event, session
+    /pair           year, event, session, driver1, driver2
+    /minisectors    year, event, session, drivers, n, all_laps
+    /track_map      year, event, session
+    /cross_session  year, event, session, driver, other_year, other_session, other_driver
+    /aero           year, event, session, all_laps
+    /stats
+
+The pool uses threads so every computation shares the process' session
+store, figures are still rendered by the clients. Without
+``F1_SERVICE_URL`` the pages call :func:`fetch`, which runs the same
+endpoints in-process through the same coalescing pool, so pages behave the
+same with or without a separate service.
+
+With ``F1_PROFILE=1`` the handlers time their stages with the same spans the
+pages used (session load, telemetry, corners, engine...). Every computation
+is logged server-side as a run of page ``service.<endpoint>``, and its spans
+are returned with the result (``spans``) and added to the requesting page's
+run, so the sidebar still shows where the time goes.
+"""
+import argparse
+import asyncio
+import json
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from http import HTTPStatus
+from urllib.error import HTTPError
+from urllib.parse import parse_qsl, urlencode, urlsplit
+from urllib.request import urlopen
+
+import numpy as np
+import pandas as pd
+
+from hotlap_analysis import CornerMap, MiniSectors
+from instrumentation import add_run_records, run_records, span, start_run
+
+#Base URL of a running service, the analyses run in-process when empty
+SERVICE_URL = os.environ.get("F1_SERVICE_URL", "")
+
+HOST = os.environ.get("F1_SERVICE_HOST", "127.0.0.1")
+PORT = int(os.environ.get("F1_SERVICE_PORT", 8765))
+
+#Computations running at once, further requests queue
+MAX_WORKERS = int(os.environ.get("F1_SERVICE_WORKERS", 4))
+
+#Seconds a client waits for a result (a cold session load included)
+TIMEOUT = float(os.environ.get("F1_SERVICE_TIMEOUT", 600))
+
+#Offset of the corner labels from the track, in normalized track units
+CORNER_LABEL_OFFSET = 0.06
+
+
+class ServiceError(RuntimeError):
+    """Request the service cannot answer, with the HTTP status to report."""
+
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = int(status)
+
+
+# ---- ANALYSES ----
+
+def _hotlap(year, event, session_type):
+    #Session, corner index and delta engine of the hotlap page, each built once per session
+    from hotlap_analysis import ADAPTIVE_GRID, build_delta_engine, get_adaptive_grid, get_corner_index
+    from metadata_index import circuit_corners, get_metadata_index
+    from session_store import get_derived, get_lap_telemetry, get_session, get_session_store
+
+    with span("session.load", cache=get_session_store()):
+        session = get_session(year, event, session_type)
+
+    with span("reference_telemetry", cache=get_session_store()):
+        reference = get_lap_telemetry(year, event, session_type, session.laps.pick_fastest())
+
+    #Corners are located once per circuit on the session's fastest lap
+    with span("corner_index"):
+        corners = circuit_corners(get_metadata_index(), session, year, event)
+        corner_index = get_corner_index((year, event), corners, reference)
+
+    #Grid points are concentrated in corners and braking zones, with one on every corner
+    with span("adaptive_grid"):
+        grid = get_adaptive_grid((year, event), reference, corner_index.fractions) if ADAPTIVE_GRID else None
+
+    #Every driver's fastest lap is interpolated once per session onto a shared distance grid
+    with span("delta_engine", cache=get_session_store()):
+        engine = get_derived(
+            year, event, session_type, "delta_engine",
+            lambda: build_delta_engine(session, lambda lap: get_lap_telemetry(year, event, session_type, lap), grid=grid)
+        )
+    return session, corners, reference, corner_index, engine
+
+
+def _corners(corner_map, numbers, gains):
+    return {
+        'number': [int(number) for number in numbers],
+        'distance': corner_map.distance,
+        'grid_idx': corner_map.grid_idx,
+        'xy': corner_map.xy,
+        'label_xy': corner_map.label_xy,
+        'gain': gains
+    }
+
+
+def ideal_lap(year, event, session):
+    """Ideal lap table, ultimate lap and drivers of a session."""
+    from hotlap_analysis import add_seconds_columns, ideal_lap_table
+    from prefetch import prefetch_after_select
+    from session_store import get_session, get_session_store
+
+    with span("session.load", cache=get_session_store()):
+        loaded = get_session(year, event, session)
+    #Warm the neighbouring sessions of the weekend and the top qualifiers' laps in the background
+    prefetch_after_select(year, event, session)
+
+    #Per-driver sector gaps in one grouped pass over the laps
+    with span("ideal_lap_table"):
+        laps = loaded.laps.pick_quicklaps().dropna(subset=['LapTime', 'Sector1Time', 'Sector2Time', 'Sector3Time'])
+        drivers = list(pd.unique(laps['Driver']))
+        laps = add_seconds_columns(laps)
+        ult = laps['Sector1(s)'].min() + laps['Sector2(s)'].min() + laps['Sector3(s)'].min()
+        table = ideal_lap_table(laps).sort_values(by='Total_delta', ascending=False)
+    return {
+        'title': f"{loaded.event.year} {loaded.event['EventName']}, {loaded.name}",
+        'drivers': drivers,
+        'ultimate': float(ult),
+        'table': table.to_dict(orient='list')
+    }
+
+
+def drivers(year, event, session):
+    """Drivers of the session's delta engine, the ones whose fastest lap has telemetry."""
+    return {'drivers': list(_hotlap(year, event, session)[4].drivers)}
+
+
+def pair(year, event, session, driver1, driver2):
+    """Smoothed delta, normalized track and corner gains of a driver pair."""
+    from hotlap_analysis import normalize_track
+
+    _, _, _, corner_index, engine = _hotlap(year, event, session)
+    x, y, center, scale = normalize_track(*engine.track(driver1))
+    #Corners are mapped onto this comparison's distance grid in one batched call
+    with span("corner_mapping"):
+        corner_map = corner_index.map(engine.distance, center=center, scale=scale, offset=CORNER_LABEL_OFFSET)
+        corner_gain = engine.corner_gains(driver1, driver2, corner_map.grid_idx)
+    return {
+        'distance': engine.distance,
+        'delta': engine.delta(driver1, driver2),
+        'x': x,
+        'y': y,
+        'corners': _corners(corner_map, corner_index.numbers, corner_gain)
+    }
+
+
+def minisectors(year, event, session, drivers, n, all_laps):
+    """Mini-sector dominance of ``drivers`` and their colours.
+
+    Over the fastest laps, or with ``all_laps`` over every timed lap of the drivers.
+    """
+    from fastf1 import plotting
+
+    from session_store import get_lap_telemetry, get_session_store
+
+    loaded, _, _, _, engine = _hotlap(year, event, session)
+    laps = None
+    if all_laps:
+        with span("lap_telemetry.all", cache=get_session_store()):
+            timed = loaded.laps.dropna(subset=['LapTime'])
+            timed = timed[timed['Driver'].isin(drivers)]
+            laps = [(lap['Driver'], get_lap_telemetry(year, event, session, lap)) for _, lap in timed.iterlaps()]
+    with span("mini_sectors"):
+        result = engine.mini_sectors(n, drivers, laps)
+    return {
+        **result._asdict(),
+        'colors': {driver: plotting.get_driver_color(driver, loaded) for driver in result.drivers}
+    }
+
+
+def track_map(year, event, session):
+    """Payload of the interactive track map, built once per session."""
+    from session_store import get_derived
+    from track_map_view import track_map_payload
+
+    engine = _hotlap(year, event, session)[4]
+    with span("track_map_payload"):
+        payload = get_derived(year, event, session, "track_map_payload", lambda: track_map_payload(engine))
+    return {'payload': payload}
+
+
+def cross_session(year, event, session, driver, other_year, other_session, other_driver):
+    """Delta and corner gains of a driver's lap against a lap of another session at the same circuit."""
+    from circuit_frame import get_frame_registry
+    from hotlap_analysis import DeltaEngine, get_corner_index, normalize_track
+    from metadata_index import get_metadata_index
+    from session_store import get_derived, get_lap_telemetry, get_session, get_session_store
+
+    metadata = get_metadata_index()
+    circuit = metadata.circuit_id(year, event)
+    other_events = metadata.circuit_events(other_year, circuit)
+    if not other_events:
+        raise ServiceError(HTTPStatus.NOT_FOUND, f"The circuit was not raced in {other_year}.")
+    other_event = other_events[0]
+    if (other_year, other_event, other_session, other_driver) == (year, event, session, driver):
+        raise ServiceError(HTTPStatus.BAD_REQUEST, "A lap cannot be compared with itself, pick another session or driver.")
+    loaded, corners, reference, _, _ = _hotlap(year, event, session)
+    with span("session.load.other", cache=get_session_store()):
+        other = get_session(other_year, other_event, other_session)
+
+    #Each session is registered once onto the circuit's canonical frame from its
+    #fastest lap, the laps compared are then aligned with that registration
+    with span("circuit_registration"):
+        registry = get_frame_registry()
+        frame, registration = get_derived(
+            year, event, session, "circuit_registration",
+            lambda: registry.register(circuit, reference)
+        )
+        other_frame, other_registration = get_derived(
+            other_year, other_event, other_session, "circuit_registration",
+            lambda: registry.register(circuit, get_lap_telemetry(other_year, other_event, other_session,
+                                                                 other.laps.pick_fastest()))
+        )
+    if other_frame is not frame:
+        raise ServiceError(HTTPStatus.CONFLICT,
+                           "The circuit layout changed between the two sessions, their laps cannot be compared.")
+
+    label1 = f"{driver} {year} {session}"
+    label2 = f"{other_driver} {other_year} {other_session}"
+    with span("cross_session_telemetry", cache=get_session_store()):
+        lap1 = loaded.laps.pick_drivers(driver).pick_fastest()
+        lap2 = other.laps.dropna(subset=['LapTime']).pick_drivers(other_driver).pick_fastest()
+        tel1 = get_lap_telemetry(year, event, session, lap1)
+        tel2 = get_lap_telemetry(other_year, other_event, other_session, lap2)
+
+    with span("cross_session_delta"):
+        cross = DeltaEngine({
+            label1: frame.align(tel1, registration),
+            label2: frame.align(tel2, other_registration)
+        }, frame.length)
+
+        #Corners moved to the canonical frame, located once per layout
+        canonical_corners = corners.copy()
+        canonical_corners[['X', 'Y']] = frame.transform(corners[['X', 'Y']].to_numpy(dtype=float), registration)
+        frame_corners = get_corner_index(frame.key, canonical_corners, frame.telemetry())
+
+        x, y, center, scale = normalize_track(*cross.track(label1))
+        corner_map = frame_corners.map(cross.distance, center=center, scale=scale, offset=CORNER_LABEL_OFFSET)
+    return {
+        'event': other_event,
+        'labels': [label1, label2],
+        'distance': cross.distance,
+        'delta': cross.delta(label1, label2),
+        'x': x,
+        'y': y,
+        'corners': _corners(corner_map, frame_corners.numbers, cross.corner_gains(label1, label2, corner_map.grid_idx))
+    }
+
+
+def aero(year, event, session, all_laps):
+    """Team speed table, short team names and colours of the aero page."""
+    from fastf1 import plotting
+
+    from aero_analysis import session_speed_metrics, team_car_data, team_speed_table
+    from hotlap_analysis import get_corner_index
+    from metadata_index import circuit_corners, get_metadata_index
+    from prefetch import prefetch_after_select
+    from session_store import get_derived, get_driver_car_data, get_lap_car_data, get_lap_telemetry, get_session, get_session_store
+
+    #Only the laps are loaded here, car data is fetched per team lap below
+    with span("session.load", cache=get_session_store()):
+        loaded = get_session(year, event, session)
+    prefetch_after_select(year, event, session)
+    metadata = get_metadata_index()
+    track_length = metadata.track_length(year, event)
+
+    def lap_car_data(lap):
+        return get_lap_car_data(year, event, session, lap)
+
+    if all_laps:
+        #Corners are located on the session's fastest lap to measure the minimum speeds around them
+        def build_session_speeds():
+            with span("corner_index", cache=get_session_store()):
+                reference = get_lap_telemetry(year, event, session, loaded.laps.pick_fastest())
+                corner_index = get_corner_index((year, event), circuit_corners(metadata, loaded, year, event),
+                                                reference)
+            return session_speed_metrics(loaded, lambda number: get_driver_car_data(year, event, session, number),
+                                         track_length, corner_index.fractions * reference['Distance'].max())
+
+        #Every driver's car data is split into its representative laps in one pass, once per session
+        with span("session_speed_metrics", cache=get_session_store()):
+            results = get_derived(year, event, session, "session_speed_metrics", build_session_speeds).copy()
+        team_names = list(results['Team'])
+        basis = "All Representative Laps"
+    else:
+        #Fastest lap of every team, the laps are sliced concurrently and kept with the session
+        with span("team_car_data", cache=get_session_store()):
+            team_laps, team_data = get_derived(year, event, session, "team_car_data",
+                                               lambda: team_car_data(loaded, lap_car_data))
+        with span("team_speed_table"):
+            results = team_speed_table(team_laps, team_data, track_length)
+        team_names = list(team_laps)
+        basis = "Fastest Laps"
+
+    #Short team names for the plot labels (e.g. "Haas F1 Team" -> "Haas")
+    results['Team'] = [plotting.get_team_name(team, loaded, short=True) for team in team_names]
+    return {
+        'title': f"{loaded.event.year} {loaded.event['EventName']} - {loaded.name}",
+        'basis': basis,
+        'table': results.to_dict(orient='list'),
+        'palette': {team: plotting.get_team_color(team, session=loaded) for team in results['Team']}
+    }
+
+
+def _flag(value):
+    return value.lower() in ('1', 'true', 'yes')
+
+
+def _names(value):
+    return tuple(name for name in value.split(',') if name)
+
+
+_SESSION = {'year': int, 'event': str, 'session': str}
+
+ENDPOINTS = {
+    'ideal_lap': (ideal_lap, _SESSION),
+    'drivers': (drivers, _SESSION),
+    'pair': (pair, {**_SESSION, 'driver1': str, 'driver2': str}),
+    'minisectors': (minisectors, {**_SESSION, 'drivers': _names, 'n': int, 'all_laps': _flag}),
+    'track_map': (track_map, _SESSION),
+    'cross_session': (cross_session, {**_SESSION, 'driver': str, 'other_year': int,
+                                      'other_session': str, 'other_driver': str}),
+    'aero': (aero, {**_SESSION, 'all_laps': _flag})
+}
+
+
+# ---- COALESCING EXECUTOR ----
+
+class AnalysisService:
+    """Bounded pool running the endpoints, one computation per distinct request in flight."""
+
+    def __init__(self, max_workers=MAX_WORKERS):
+        self.max_workers = max_workers
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="analysis")
+        self._inflight = {}  # (endpoint, params) -> Future
+        self._lock = threading.Lock()
+        self.computed = 0
+        self.coalesced = 0
+
+    @staticmethod
+    def parse(endpoint, params):
+        """Handler and typed arguments of a request, from its string parameters."""
+        if endpoint not in ENDPOINTS:
+            raise ServiceError(HTTPStatus.NOT_FOUND, f"Unknown endpoint: {endpoint!r}")
+        handler, spec = ENDPOINTS[endpoint]
+        missing = sorted(set(spec) - set(params))
+        if missing:
+            raise ServiceError(HTTPStatus.BAD_REQUEST, f"Missing parameters: {', '.join(missing)}")
+        try:
+            return handler, {name: convert(params[name]) for name, convert in spec.items()}
+        except ValueError as exc:
+            raise ServiceError(HTTPStatus.BAD_REQUEST, str(exc)) from None
+
+    def submit(self, endpoint, params):
+        """Future of a request's result, shared by every identical request in flight."""
+        handler, kwargs = self.parse(endpoint, params)
+        key = (endpoint, tuple(sorted(kwargs.items())))
+        with self._lock:
+            future = self._inflight.get(key)
+            if future is not None:
+                self.coalesced += 1
+                return future
+            future = self._pool.submit(self._run, endpoint, handler, kwargs)
+            self._inflight[key] = future
+            self.computed += 1
+        future.add_done_callback(lambda _: self._done(key))
+        return future
+
+    @staticmethod
+    def _run(endpoint, handler, kwargs):
+        #Each computation is one profiled run, its spans travel back with the result
+        start_run(f"service.{endpoint}")
+        result = handler(**kwargs)
+        records = run_records()
+        return {**result, 'spans': records} if records else result
+
+    def _done(self, key):
+        with self._lock:
+            self._inflight.pop(key, None)
+
+    def stats(self):
+        with self._lock:
+            return {'computed': self.computed, 'coalesced': self.coalesced,
+                    'in_flight': len(self._inflight), 'workers': self.max_workers}
+
+
+_service = None
+_service_lock = threading.Lock()
+
+
+def get_analysis_service():
+    """Return the process-wide analysis service."""
+    global _service
+    with _service_lock:
+        if _service is None:
+            _service = AnalysisService()
+        return _service
+
+
+# ---- HTTP SERVER ----
+
+def _json_default(value):
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    if isinstance(value, np.generic):
+        return value.item()
+    raise TypeError(f"{type(value).__name__} is not JSON serializable")
+
+
+def _status(exc):
+    if isinstance(exc, ServiceError):
+        return exc.status
+    #Unknown drivers and bad values surface as lookup and value errors of the analyses
+    if isinstance(exc, (KeyError, ValueError, LookupError)):
+        return HTTPStatus.BAD_REQUEST
+    return HTTPStatus.INTERNAL_SERVER_ERROR
+
+
+async def _respond(writer, status, body):
+    data = json.dumps(body, default=_json_default).encode()
+    status = HTTPStatus(status)
+    head = (f"HTTP/1.1 {status.value} {status.phrase}\r\n"
+            "Content-Type: application/json\r\n"
+            f"Content-Length: {len(data)}\r\n"
+            "Connection: close\r\n\r\n")
+    writer.write(head.encode('latin-1') + data)
+    await writer.drain()
+
+
+async def _handle(service, reader, writer):
+    try:
+        request_line = (await reader.readline()).decode('latin-1').split()
+        while (await reader.readline()) not in (b'\r\n', b'\n', b''):
+            pass
+        if len(request_line) != 3:
+            raise ServiceError(HTTPStatus.BAD_REQUEST, "Malformed request")
+        method, target, _ = request_line
+        if method != 'GET':
+            raise ServiceError(HTTPStatus.METHOD_NOT_ALLOWED, "Only GET is supported")
+
+        url = urlsplit(target)
+        endpoint = url.path.strip('/')
+        if endpoint == 'stats':
+            body = service.stats()
+        else:
+            body = await asyncio.wrap_future(service.submit(endpoint, dict(parse_qsl(url.query))))
+        await _respond(writer, HTTPStatus.OK, body)
+    except Exception as exc:
+        await _respond(writer, _status(exc), {'error': str(exc) or type(exc).__name__})
+    finally:
+        writer.close()
+
+
+async def serve(host=HOST, port=PORT, service=None):
+    """Serve the endpoints until cancelled."""
+    service = service if service is not None else get_analysis_service()
+    server = await asyncio.start_server(lambda r, w: _handle(service, r, w), host, port)
+    async with server:
+        await server.serve_forever()
+
+
+# ---- CLIENT ----
+
+def _param(value):
+    if isinstance(value, bool):
+        return '1' if value else '0'
+    if isinstance(value, (list, tuple)):
+        return ','.join(str(item) for item in value)
+    return str(value)
+
+
+def fetch(endpoint, url=SERVICE_URL, **params):
+    """Result of an endpoint, from the service at ``url`` or computed in-process.
+
+    Raises ``ServiceError`` for requests the service rejects.
+    """
+    params = {name: _param(value) for name, value in params.items()}
+    with span(f"service.{endpoint}"):
+        if not url:
+            result = get_analysis_service().submit(endpoint, params).result()
+        else:
+            try:
+                with urlopen(f"{url.rstrip('/')}/{endpoint}?{urlencode(params)}", timeout=TIMEOUT) as response:
+                    result = json.load(response)
+            except HTTPError as exc:
+                try:
+                    message = json.load(exc).get('error', exc.reason)
+                except ValueError:
+                    message = exc.reason
+                raise ServiceError(exc.code, message) from None
+    #Stages timed by the service, shown with the page's own spans
+    add_run_records(result.get('spans', ()))
+    return result
+
+
+def corner_results(data):
+    """Corner map, corner numbers and corner gains of a ``pair`` or ``cross_session`` result."""
+    corner_map = CornerMap(
+        distance=np.asarray(data['distance'], dtype=float),
+        grid_idx=np.asarray(data['grid_idx'], dtype=int),
+        xy=np.asarray(data['xy'], dtype=float).reshape(-1, 2),
+        label_xy=np.asarray(data['label_xy'], dtype=float).reshape(-1, 2)
+    )
+    return corner_map, data['number'], np.asarray(data['gain'], dtype=float)
+
+
+def minisector_results(data):
+    """``MiniSectors`` and driver colours of a ``minisectors`` result."""
+    result = MiniSectors(
+        boundaries=np.asarray(data['boundaries'], dtype=float),
+        drivers=list(data['drivers']),
+        times=np.asarray(data['times'], dtype=float),
+        fastest=np.asarray(data['fastest'], dtype=int),
+        theoretical_best=float(data['theoretical_best'])
+    )
+    return result, data['colors']
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve the analyses of the pages over HTTP/JSON.")
+    parser.add_argument('--host', default=HOST)
+    parser.add_argument('--port', type=int, default=PORT)
+    parser.add_argument('--workers', type=int, default=MAX_WORKERS, help="Computations running at once")
+    args = parser.parse_args()
+
+    print(f"Serving on http://{args.host}:{args.port}")
+    try:
+        asyncio.run(serve(args.host, args.port, AnalysisService(args.workers)))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
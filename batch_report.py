@@ -0,0 +1,183 @@
+"""Headless report of a session: every analysis of both pages, precomputed.
+
+Run it right after a session ends so the results exist before anyone opens
+the pages::
+
+    python batch_report.py 2024 "Monaco Grand Prix" Qualifying --out reports
+
+Writes to ``<out>/<year>/<event>/<session>/``:
+
+    ideal_lap.png, ideal_lap.<fmt>     ideal lap table and chart
+    lap_deltas.<fmt>                   lap time difference of every driver pair
+    corner_gains.<fmt>                 corner gains of every driver pair
+    track_maps/<D1>_vs_<D2>.png        track map of every driver pair
+    aero_speeds.<fmt>, aero_map.png    team speeds and aero map
+    aero_session_speeds.<fmt>          team speed metrics over all representative laps
+
+``<fmt>`` is ``csv`` or ``parquet``. The track maps are rendered across a
+process pool; the data is loaded once in the main process through the
+session store. The session's telemetry is then written to the columnar
+telemetry store before the script exits, so the pages read it from there.
+"""
+import argparse
+import itertools
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import matplotlib
+
+from paths import slug
+
+_context = {}
+
+
+def _write_table(df, path, fmt):
+    if fmt == 'parquet':
+        df.to_parquet(f"{path}.parquet", index=False)
+    else:
+        df.to_csv(f"{path}.csv", index=False)
+
+
+def _init_worker(context):
+    matplotlib.use('Agg')
+    _context.update(context)
+
+
+def _render_pair(pair):
+    #Runs in a worker process, the engine and corners come from the initializer
+    from figures import track_map_figure
+    from hotlap_analysis import normalize_track
+    from render_cache import figure_bytes
+
+    driver1, driver2 = pair
+    engine = _context['engine']
+    corner_index = _context['corner_index']
+
+    x, y, center, scale = normalize_track(*engine.track(driver1))
+    corner_map = corner_index.map(engine.distance, center=center, scale=scale)
+    corner_gain = engine.corner_gains(driver1, driver2, corner_map.grid_idx)
+    fig = track_map_figure(
+        x, y, engine.delta(driver1, driver2), corner_map, corner_index.numbers, corner_gain,
+        _context['title'], driver1, driver2
+    )
+    path = os.path.join(_context['out'], 'track_maps', f"{slug(driver1)}_vs_{slug(driver2)}.png")
+    with open(path, 'wb') as f:
+        f.write(figure_bytes(fig))
+    return path
+
+
+def hotlap_report(year, event, session_type, out, fmt='csv', max_workers=None):
+    """Ideal lap table, pair deltas, corner gains and track maps of a session."""
+    from figures import ideal_lap_figure
+    from hotlap_analysis import (ADAPTIVE_GRID, add_seconds_columns, ideal_lap_table, get_corner_index,
+                                 get_adaptive_grid, build_delta_engine, pair_corner_gains)
+    from metadata_index import get_metadata_index, circuit_corners
+    from render_cache import figure_bytes
+    from session_store import get_session, get_lap_telemetry
+
+    session = get_session(year, event, session_type)
+
+    laps = session.laps.pick_quicklaps().dropna(subset=['LapTime', 'Sector1Time', 'Sector2Time', 'Sector3Time'])
+    laps = add_seconds_columns(laps)
+    ult = laps['Sector1(s)'].min() + laps['Sector2(s)'].min() + laps['Sector3(s)'].min()
+    df = ideal_lap_table(laps).sort_values(by='Total_delta', ascending=False)
+    _write_table(df, os.path.join(out, 'ideal_lap'), fmt)
+    with open(os.path.join(out, 'ideal_lap.png'), 'wb') as f:
+        f.write(figure_bytes(ideal_lap_figure(df, ult, f"{session.event.year} {session.event['EventName']}, {session.name}")))
+
+    corners = circuit_corners(get_metadata_index(), session, year, event)
+    reference = get_lap_telemetry(year, event, session_type, session.laps.pick_fastest())
+    corner_index = get_corner_index((year, event), corners, reference)
+    grid = get_adaptive_grid((year, event), reference, corner_index.fractions) if ADAPTIVE_GRID else None
+
+    engine = build_delta_engine(session, lambda lap: get_lap_telemetry(year, event, session_type, lap), grid=grid)
+    _write_table(engine.delta_matrix().rename_axis('Driver').reset_index(), os.path.join(out, 'lap_deltas'), fmt)
+    grid_idx = corner_index.map(engine.distance, center=(0, 0), scale=1).grid_idx
+    _write_table(pair_corner_gains(engine, grid_idx, corner_index.numbers), os.path.join(out, 'corner_gains'), fmt)
+
+    os.makedirs(os.path.join(out, 'track_maps'), exist_ok=True)
+    context = {
+        'engine': engine,
+        'corner_index': corner_index,
+        'title': f"{year} {event} {session_type}",
+        'out': out
+    }
+    pairs = list(itertools.combinations(engine.drivers, 2))
+    #Spawned, not forked: the session store's extraction and prefetch threads may hold locks
+    with ProcessPoolExecutor(max_workers=max_workers, mp_context=multiprocessing.get_context("spawn"),
+                             initializer=_init_worker, initargs=(context,)) as pool:
+        return list(pool.map(_render_pair, pairs, chunksize=4))
+
+
+def aero_report(year, event, session_type, out, fmt='csv'):
+    """Team speed tables and aero map of a session."""
+    from fastf1 import plotting
+
+    from aero_analysis import session_speed_metrics, team_car_data, team_speed_table
+    from figures import aero_map_figure
+    from hotlap_analysis import get_corner_index
+    from metadata_index import circuit_corners, get_metadata_index
+    from render_cache import figure_bytes
+    from session_store import get_session, get_driver_car_data, get_lap_car_data, get_lap_telemetry
+
+    index = get_metadata_index()
+    track_length = index.track_length(year, event)
+    session = get_session(year, event, session_type)
+
+    def lap_car_data(lap):
+        return get_lap_car_data(year, event, session_type, lap)
+
+    team_laps, team_data = team_car_data(session, lap_car_data)
+    results = team_speed_table(team_laps, team_data, track_length)
+    results['Team'] = [plotting.get_team_name(team, session, short=True) for team in team_laps]
+    _write_table(results, os.path.join(out, 'aero_speeds'), fmt)
+
+    reference = get_lap_telemetry(year, event, session_type, session.laps.pick_fastest())
+    corner_index = get_corner_index((year, event), circuit_corners(index, session, year, event), reference)
+    metrics = session_speed_metrics(session, lambda number: get_driver_car_data(year, event, session_type, number),
+                                    track_length, corner_index.fractions * reference['Distance'].max())
+    metrics['Team'] = [plotting.get_team_name(team, session, short=True) for team in metrics['Team']]
+    _write_table(metrics, os.path.join(out, 'aero_session_speeds'), fmt)
+
+    team_palette = {team: plotting.get_team_color(team, session=session) for team in results['Team']}
+    title = f"{session.event.year} {session.event['EventName']} - {session.name}"
+    with open(os.path.join(out, 'aero_map.png'), 'wb') as f:
+        f.write(figure_bytes(aero_map_figure(results, team_palette, title)))
+
+
+def report_dir(root, year, event, session_type):
+    return os.path.join(root, str(year), slug(event), slug(session_type))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Precompute the hotlap comparisons and aero map of a session.")
+    parser.add_argument('year', type=int)
+    parser.add_argument('event')
+    parser.add_argument('session')
+    parser.add_argument('--out', default='reports', help="Root directory of the reports")
+    parser.add_argument('--format', choices=('csv', 'parquet'), default='csv')
+    parser.add_argument('--workers', type=int, default=None, help="Processes rendering the track maps")
+    parser.add_argument('--skip-hotlap', action='store_true')
+    parser.add_argument('--skip-aero', action='store_true')
+    args = parser.parse_args()
+
+    matplotlib.use('Agg')
+    out = report_dir(args.out, args.year, args.event, args.session)
+    os.makedirs(out, exist_ok=True)
+
+    if not args.skip_hotlap:
+        maps = hotlap_report(args.year, args.event, args.session, out, args.format, args.workers)
+        print(f"hotlap: {len(maps)} track maps")
+    if not args.skip_aero:
+        aero_report(args.year, args.event, args.session, out, args.format)
+        print("aero: map written")
+
+    #The store's background extractions are daemon threads, finish them before exiting
+    from session_store import get_session_store
+    get_session_store().extract(args.year, args.event, args.session)
+    print(f"Report written to {out}")
+
+
+if __name__ == '__main__':
+    main()
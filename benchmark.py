@@ -0,0 +1,153 @@
+"""Offline benchmark of the analysis stages on a synthetic session.
+
+Times every stage of both pages against :class:`SyntheticSession`, without
+network access, and writes the timings as JSON so runs of different versions
+can be compared::
+
+    python benchmark.py --drivers 20 --laps 12 --samples 700 --out benchmarks/results.json
+    python benchmark.py --compare benchmarks/results.json
+
+Each stage runs ``--repeat`` times and reports its min, median and mean.
+"""
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import time
+
+import matplotlib
+
+matplotlib.use('Agg')
+
+import numpy as np
+from scipy.ndimage import gaussian_filter1d
+
+from aero_analysis import session_speed_metrics, team_car_data, team_speed_table
+from figures import aero_map_figure, dominance_map_figure, ideal_lap_figure, track_map_figure
+from hotlap_analysis import (SIGMA, CornerIndex, DeltaEngine, adaptive_grid, add_seconds_columns, build_delta_engine,
+                             fastest_laps, ideal_lap_table, normalize_track, pair_corner_gains)
+from render_cache import figure_bytes
+from synthetic_session import SyntheticSession
+
+
+def _timed(fn, repeat):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+    return {
+        'min_s': min(times),
+        'median_s': statistics.median(times),
+        'mean_s': statistics.fmean(times),
+        'repeat': repeat
+    }
+
+
+def _commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)), check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(drivers=20, laps=12, samples=700, repeat=5):
+    """Timings of every stage, as a JSON-ready dict."""
+    session = SyntheticSession(drivers=drivers, laps=laps, samples=samples)
+    quicklaps = session.laps.pick_quicklaps()
+    telemetry = {driver: session.lap_telemetry(lap) for driver, lap in fastest_laps(session.laps).items()}
+    all_laps = [(lap['Driver'], session.lap_telemetry(lap)) for _, lap in session.laps.iterlaps()]
+    lap_length = max(tel['Distance'].max() for tel in telemetry.values())
+    engine = DeltaEngine(telemetry, lap_length)
+    reference = session.lap_telemetry(session.laps.pick_fastest())
+    corner_index = CornerIndex(session.corners, reference)
+    grid = adaptive_grid(reference, knots=corner_index.fractions) * lap_length
+    adaptive = DeltaEngine(telemetry, lap_length, distance=grid)
+    driver1, driver2 = engine.drivers[:2]
+
+    laps_seconds = add_seconds_columns(quicklaps.copy())
+    ult = laps_seconds[['Sector1(s)', 'Sector2(s)', 'Sector3(s)']].min().sum()
+    ideal = ideal_lap_table(laps_seconds)
+    x, y, center, scale = normalize_track(*engine.track(driver1))
+    corner_map = corner_index.map(engine.distance, center, scale)
+    minisectors = engine.mini_sectors()
+    team_laps, team_data = team_car_data(session, session.lap_car_data)
+    speeds = team_speed_table(team_laps, team_data)
+
+    stages = {
+        'sector_aggregation': lambda: ideal_lap_table(add_seconds_columns(quicklaps.copy())),
+        'telemetry_fetch': lambda: build_delta_engine(session, session.lap_telemetry),
+        'telemetry_interpolation': lambda: DeltaEngine(telemetry, lap_length),
+        'gaussian_smoothing': lambda: gaussian_filter1d(engine.times, SIGMA, axis=1),
+        'adaptive_grid': lambda: adaptive_grid(reference, knots=corner_index.fractions),
+        'telemetry_interpolation_adaptive': lambda: DeltaEngine(telemetry, lap_length, distance=grid),
+        'gaussian_smoothing_adaptive': lambda: adaptive._smooth(adaptive.times),
+        'corner_mapping': lambda: CornerIndex(session.corners, reference).map(engine.distance, center, scale),
+        'pair_corner_gains': lambda: pair_corner_gains(engine, corner_map.grid_idx, corner_index.numbers),
+        'minisectors': lambda: engine.mini_sectors(),
+        'minisectors_all_laps': lambda: engine.mini_sectors(laps=all_laps),
+        'team_speeds': lambda: team_speed_table(*team_car_data(session, session.lap_car_data)),
+        'session_speed_metrics': lambda: session_speed_metrics(
+            session, session.driver_car_data, corner_distances=corner_index.fractions * reference['Distance'].max()),
+        'render_ideal_lap': lambda: figure_bytes(ideal_lap_figure(ideal, ult, "Synthetic")),
+        'render_track_map': lambda: figure_bytes(track_map_figure(
+            x, y, engine.delta(driver1, driver2), corner_map, corner_index.numbers,
+            engine.corner_gains(driver1, driver2, corner_map.grid_idx), "Synthetic", driver1, driver2)),
+        'render_dominance_map': lambda: figure_bytes(dominance_map_figure(
+            x, y, engine.distance, minisectors, {}, "Synthetic")),
+        'render_aero_map': lambda: figure_bytes(aero_map_figure(speeds, {}, "Synthetic"))
+    }
+
+    return {
+        'commit': _commit(),
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'config': {'drivers': drivers, 'laps': laps, 'samples': samples, 'repeat': repeat},
+        'stages': {name: _timed(fn, repeat) for name, fn in stages.items()}
+    }
+
+
+def compare(results, baseline):
+    """Median of every stage against a baseline run, as printable lines."""
+    lines = []
+    for name, stage in results['stages'].items():
+        base = baseline['stages'].get(name)
+        if base is None:
+            lines.append(f"{name:34s} {stage['median_s'] * 1000:10.2f} ms   (new)")
+            continue
+        ratio = stage['median_s'] / base['median_s']
+        lines.append(f"{name:34s} {stage['median_s'] * 1000:10.2f} ms   x{ratio:.2f} vs {base['median_s'] * 1000:.2f} ms")
+    return lines
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the analysis stages on a synthetic session.")
+    parser.add_argument('--drivers', type=int, default=20)
+    parser.add_argument('--laps', type=int, default=12)
+    parser.add_argument('--samples', type=int, default=700, help="Telemetry samples per lap")
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--out', default=None, help="JSON file to write the results to")
+    parser.add_argument('--compare', default=None, help="JSON results of a previous run to compare with")
+    args = parser.parse_args()
+
+    results = run(args.drivers, args.laps, args.samples, args.repeat)
+
+    if args.compare:
+        with open(args.compare) as f:
+            lines = compare(results, json.load(f))
+    else:
+        lines = [f"{name:34s} {stage['median_s'] * 1000:10.2f} ms" for name, stage in results['stages'].items()]
+    print("\n".join(lines))
+
+    if args.out:
+        os.makedirs(os.path.dirname(os.path.abspath(args.out)), exist_ok=True)
+        with open(args.out, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
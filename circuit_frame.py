@@ -0,0 +1,239 @@
+"""Canonical per-circuit frame to compare laps of different sessions.
+
+Every session has its own position frame and its laps differ slightly in
+length, so laps of two sessions (FP3 against Qualifying, or last year's pole
+lap) cannot be compared on their raw distance and X/Y. A :class:`CircuitFrame`
+is the reference lap of a circuit layout resampled on a uniform distance
+axis. A session is registered onto it once, from its fastest lap: a
+similarity transform (rotation, scale, offset) fitted by iterative closest
+points. Laps of the session are then aligned by applying that transform and
+projecting every sample onto the reference line, which gives its canonical
+distance.
+
+Frames are built the first time a circuit is seen and saved under
+``F1_CIRCUIT_FRAME_DIR``. A lap that does not fit any known layout of its
+circuit (length or shape too different) starts a new layout::
+
+    registry = get_frame_registry()
+    frame, registration = registry.register(circuit, reference_telemetry)
+    aligned = frame.align(lap_telemetry, registration)
+"""
+import glob
+import os
+import threading
+from collections import namedtuple
+
+import numpy as np
+import pandas as pd
+
+from paths import slug
+
+FRAME_DIR = os.environ.get(
+    "F1_CIRCUIT_FRAME_DIR",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "circuit_frames")
+)
+
+#Points of the canonical reference line
+FRAME_POINTS = 2000
+
+#Largest relative difference of lap length between laps of the same layout
+LENGTH_TOLERANCE = 0.02
+
+#Largest RMS distance to the reference line after registration, as a share of its length
+RESIDUAL_TOLERANCE = 0.002
+
+ICP_ITERATIONS = 30
+
+Registration = namedtuple('Registration', ['rotation', 'scale', 'offset', 'residual'])
+
+IDENTITY = Registration(rotation=np.eye(2), scale=1.0, offset=np.zeros(2), residual=0.0)
+
+
+def similarity_transform(src, dst):
+    """Rotation, scale and offset mapping the points ``src`` onto ``dst`` in the least squares sense."""
+    src_mean, dst_mean = src.mean(axis=0), dst.mean(axis=0)
+    src_c, dst_c = src - src_mean, dst - dst_mean
+    u, s, vt = np.linalg.svd(dst_c.T @ src_c / len(src))
+    #No reflection: the track is never mirrored between sessions
+    signs = np.array([1.0, np.sign(np.linalg.det(u @ vt)) or 1.0])
+    rotation = u @ np.diag(signs) @ vt
+    scale = float((s * signs).sum() / src_c.var(axis=0).sum())
+    return rotation, scale, dst_mean - scale * rotation @ src_mean
+
+
+def _resample(tel, points):
+    #Distance and X/Y of a lap on a uniform distance axis
+    dist = tel['Distance'].to_numpy(dtype=float)
+    axis = np.linspace(0, dist[-1], points)
+    xy = np.column_stack([np.interp(axis, dist, tel[c].to_numpy(dtype=float)) for c in ('X', 'Y')])
+    return axis, xy
+
+
+class CircuitFrame:
+    """Reference line of one circuit layout on a canonical distance axis."""
+
+    def __init__(self, distance, xy, circuit=None, layout=0):
+        from scipy.spatial import cKDTree
+
+        self.distance = np.asarray(distance, dtype=float)
+        self.xy = np.asarray(xy, dtype=float)
+        self.circuit = circuit
+        self.layout = layout
+        self.length = float(self.distance[-1])
+        step = np.diff(self.xy, axis=0)
+        self._step = step
+        self._step_len2 = np.maximum((step ** 2).sum(axis=1), 1e-12)
+        self._path_length = float(np.sqrt(self._step_len2).sum())
+        self._tree = cKDTree(self.xy)
+
+    @classmethod
+    def from_lap(cls, tel, circuit=None, layout=0, points=FRAME_POINTS):
+        return cls(*_resample(tel, points), circuit=circuit, layout=layout)
+
+    @property
+    def key(self):
+        return (self.circuit, self.layout)
+
+    def telemetry(self):
+        """Reference line as a lap telemetry frame (Distance, X, Y)."""
+        return pd.DataFrame({'Distance': self.distance, 'X': self.xy[:, 0], 'Y': self.xy[:, 1]})
+
+    def transform(self, xy, registration):
+        """Positions of a registered session in the canonical frame."""
+        xy = np.asarray(xy, dtype=float)
+        return registration.scale * xy @ registration.rotation.T + registration.offset
+
+    def register(self, tel, iterations=ICP_ITERATIONS):
+        """Similarity transform of a lap's position frame onto this frame.
+
+        Laps start on the finish line, so samples at the same share of the lap
+        give the first guess; closest points on the reference line refine it.
+        """
+        _, xy = _resample(tel, len(self.distance))
+        rotation, scale, offset = similarity_transform(xy, self.xy)
+        for _ in range(iterations):
+            moved = scale * xy @ rotation.T + offset
+            _, nearest = self._tree.query(moved)
+            new = similarity_transform(xy, self.xy[nearest])
+            converged = np.allclose(new[0], rotation, atol=1e-9) and np.allclose(new[2], offset, atol=1e-6)
+            rotation, scale, offset = new
+            if converged:
+                break
+        error, _ = self._tree.query(scale * xy @ rotation.T + offset)
+        residual = float(np.sqrt(np.mean(error ** 2)) / self._path_length)
+        return Registration(rotation, scale, offset, residual)
+
+    def fits(self, tel, registration):
+        """True when a registered lap is of the same layout as this frame."""
+        length = float(tel['Distance'].max())
+        return (abs(length / self.length - 1) <= LENGTH_TOLERANCE
+                and registration.residual <= RESIDUAL_TOLERANCE)
+
+    def project(self, xy, guess):
+        """Canonical distance of positions already in this frame.
+
+        Every point is projected on the reference line segments either side
+        of its closest point. ``guess`` (the lap distance scaled to this
+        frame) picks the lap around the start line, and the result is made
+        non-decreasing.
+        """
+        _, nearest = self._tree.query(xy)
+        best_dist = best_err = None
+        for start in (nearest - 1, nearest):
+            j = start.clip(0, len(self.distance) - 2)
+            rel = xy - self.xy[j]
+            t = ((rel * self._step[j]).sum(axis=1) / self._step_len2[j]).clip(0, 1)
+            err = np.hypot(*(rel - t[:, None] * self._step[j]).T)
+            dist = self.distance[j] + t * (self.distance[j + 1] - self.distance[j])
+            if best_dist is None:
+                best_dist, best_err = dist, err
+            else:
+                closer = err < best_err
+                best_dist = np.where(closer, dist, best_dist)
+                best_err = np.where(closer, err, best_err)
+
+        best_dist += self.length * np.round((guess - best_dist) / self.length)
+        return np.maximum.accumulate(best_dist).clip(0, self.length)
+
+    def align(self, tel, registration):
+        """Copy of a lap's telemetry on the canonical distance axis and frame.
+
+        Telemetry without positions (car data) is only rescaled to the
+        canonical lap length.
+        """
+        dist = tel['Distance'].to_numpy(dtype=float)
+        guess = dist * self.length / dist[-1]
+        aligned = tel.copy()
+        if 'X' not in tel or 'Y' not in tel:
+            aligned['Distance'] = guess
+            return aligned
+        xy = self.transform(tel[['X', 'Y']].to_numpy(dtype=float), registration)
+        aligned['Distance'] = self.project(xy, guess)
+        aligned['X'] = xy[:, 0]
+        aligned['Y'] = xy[:, 1]
+        return aligned
+
+    def save(self, path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = path + '.tmp.npz'
+        np.savez(tmp, distance=self.distance, xy=self.xy)
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path, circuit=None, layout=0):
+        with np.load(path) as data:
+            return cls(data['distance'], data['xy'], circuit=circuit, layout=layout)
+
+
+class FrameRegistry:
+    """Known layouts of every circuit, loaded from and saved to ``root``."""
+
+    def __init__(self, root=FRAME_DIR):
+        self.root = root
+        self._frames = {}  # circuit -> [CircuitFrame]
+        self._lock = threading.Lock()
+
+    def _path(self, circuit, layout):
+        return os.path.join(self.root, slug(circuit), f"layout_{layout}.npz")
+
+    def frames(self, circuit):
+        """Layouts of a circuit, read from disk on first use."""
+        frames = self._frames.get(circuit)
+        if frames is None:
+            paths = sorted(glob.glob(os.path.join(self.root, slug(circuit), 'layout_*.npz')),
+                           key=lambda p: int(os.path.basename(p)[7:-4]))
+            frames = self._frames[circuit] = [
+                CircuitFrame.load(path, circuit, int(os.path.basename(path)[7:-4])) for path in paths
+            ]
+        return frames
+
+    def register(self, circuit, reference):
+        """Frame of the layout ``reference`` (a lap with X/Y) is on, and its registration.
+
+        The first lap of a new layout becomes its frame, with an identity
+        registration.
+        """
+        with self._lock:
+            frames = self.frames(circuit)
+            for frame in frames:
+                registration = frame.register(reference)
+                if frame.fits(reference, registration):
+                    return frame, registration
+            frame = CircuitFrame.from_lap(reference, circuit, len(frames))
+            if self.root:
+                frame.save(self._path(circuit, frame.layout))
+            frames.append(frame)
+            return frame, IDENTITY
+
+
+_registry = None
+_registry_lock = threading.Lock()
+
+
+def get_frame_registry():
+    """Return the process-wide circuit frame registry."""
+    global _registry
+    with _registry_lock:
+        if _registry is None:
+            _registry = FrameRegistry()
+        return _registry
@@ -0,0 +1,59 @@
+"""Compact telemetry frames: only the requested channels, in small dtypes.
+
+fastf1 telemetry carries float64/object columns and channels the analyses do
+not use (Brake, DRS, nGear, Status, Source, ...). :func:`compact` keeps the
+requested channels only and downcasts them: float32 for distance, time and
+coordinates, small integers for speed, RPM, gear and throttle. ``Time`` becomes
+float32 seconds from the start of the lap, read it with :func:`time_seconds`.
+
+At lap scale float32 keeps distances to about a millimetre and times to about
+ten microseconds; speeds are rounded to the km/h they are reported in.
+"""
+import numpy as np
+import pandas as pd
+
+DTYPES = {
+    'Distance': 'float32',
+    'RelativeDistance': 'float32',
+    'Time': 'float32',
+    'X': 'float32',
+    'Y': 'float32',
+    'Z': 'float32',
+    'Speed': 'int16',
+    'RPM': 'int16',
+    'nGear': 'int8',
+    'Throttle': 'int16',
+    'DRS': 'int8',
+    'Brake': 'bool'
+}
+
+
+def frame_nbytes(df):
+    return int(df.memory_usage(index=True, deep=True).sum())
+
+
+def time_seconds(tel):
+    """``Time`` channel in seconds, for full and compact telemetry alike."""
+    time = tel['Time']
+    if pd.api.types.is_timedelta64_dtype(time):
+        return time.dt.total_seconds().to_numpy()
+    return time.to_numpy(dtype=float)
+
+
+def compact(tel, channels):
+    """Copy of ``tel`` reduced to ``channels`` in compact dtypes."""
+    columns = {}
+    for channel in channels:
+        dtype = DTYPES.get(channel)
+        values = time_seconds(tel) if channel == 'Time' else tel[channel].to_numpy()
+        if dtype is None:
+            columns[channel] = values
+            continue
+        if np.dtype(dtype).kind == 'i':
+            #Integers cannot hold gaps, keep those channels as float32 then
+            if np.isnan(values.astype(float)).any():
+                dtype = 'float32'
+            else:
+                values = np.rint(values)
+        columns[channel] = values.astype(dtype)
+    return pd.DataFrame(columns)
@@ -0,0 +1,295 @@
+"""Figures of the analysis pages.
+
+Each function takes the computed results and returns a matplotlib figure, so
+the pages (through the render cache) and the batch report draw the same charts.
+"""
+import numpy as np
+from matplotlib import pyplot as plt
+from matplotlib.collections import LineCollection
+
+from label_placer import place_labels
+
+
+def ideal_lap_figure(df, ult, title):
+    """Gap of every driver's ideal lap to the ultimate lap, split per sector.
+
+    ``df`` is the output of ``hotlap_analysis.ideal_lap_table`` and ``ult``
+    the ultimate lap time in seconds.
+    """
+    fig, ax = plt.subplots(figsize=(8, 8))
+
+    ax.set_title(f"{title}\nIdeal vs actual laptimes")
+
+    ax.barh(y=df['Driver'], width=df['S1_delta'], left=0, color='#FF0000', label='Gap to best-overall S1 time', fill=True)
+    ax.barh(y=df['Driver'], width=df['S2_delta'], left=(df['S1_delta']), color='#00A1FF', label='Gap to best-overall S2 time', fill=True)
+    ax.barh(y=df['Driver'], width=df['S3_delta'], left=(df['S1_delta'] + df['S2_delta']), color='#FFEA00', label='Gap to best-overall S3 time', fill=True)
+    ax.scatter(x=df['Total_delta'], y=df['Driver'], color='#C900FF', label='Ideal PB', zorder=2)
+    ax.plot((df['Total_delta']+df['Gap_PB_ideal']), df['Driver'], color='#5EFF00', label='Actual PB', linestyle="--", marker="o", zorder=1)
+    ax.legend()
+    ax.set_xlabel(f"Gap (s) from ideal personal-best lap to \"ultimate\" lap ({ult} s)")
+    ax.grid(linestyle='--', color='#808080', which='major', axis='x') #major grid lines settings
+    ax.minorticks_on() #show minor grid lines
+    ax.grid(linestyle='--', color='#404040', which='minor', axis='x', linewidth = 0.5) #minor grid lines settings
+
+    return fig
+
+
+def track_map_figure(x, y, delta, corner_map, corner_numbers, corner_gain, title, driver1, driver2):
+    """Track map coloured by the delta of two drivers, with corner numbers.
+
+    ``x`` and ``y`` are the normalized track of ``hotlap_analysis.normalize_track``
+    and ``corner_map`` the corners mapped on the same grid and frame.
+    """
+
+    # ---- BUILD TRACK SEGMENTS ----
+    points = np.array([x, y]).T.reshape(-1,1,2)
+    segments = np.concatenate([points[:-1], points[1:]], axis=1)
+
+    # ---- PLOT ----
+    fig, ax = plt.subplots(figsize=(8,8))
+
+    norm = plt.Normalize(-abs(delta).max(), abs(delta).max())
+
+    lc = LineCollection(
+        segments,
+        cmap="coolwarm",
+        norm=norm,
+        linewidth=5
+    )
+
+    lc.set_array(delta)
+    ax.add_collection(lc)
+
+    # ---- LOCK AXIS LIMITS ----
+    ax.set_xlim(-1.1,1.1)
+    ax.set_ylim(-1.1,1.1)
+
+    ax.set_aspect("equal")
+    ax.axis("off")
+
+    # ---- COLORBAR ----
+    cbar = fig.colorbar(lc, ax=ax, shrink=0.75)
+    cbar.set_label("Delta (s)")
+
+    # ---- TITLE ----
+    ax.set_title(
+        f"{title}\n{driver1} vs {driver2}",
+        color="black"
+    )
+
+    # ---- DRIVER COLOR CAPTION ----
+    ax.text(
+        0,
+        -1.25,
+        f"Red = {driver1} faster    |    Blue = {driver2} faster",
+        ha="center",
+        fontsize=10,
+        bbox=dict(facecolor="white", alpha=0.8, edgecolor="none", pad=3)
+    )
+
+    # ---- CORNER LABELS (NUMBER ONLY) ----
+    # Labels go next to the track when there is room, otherwise to the nearest
+    # free spot that covers neither the track nor another label
+    numbers = [f"{int(number)}" for number in corner_numbers]
+    labels = place_labels(
+        ax,
+        corner_map.xy[:, 0],
+        corner_map.xy[:, 1],
+        numbers,
+        fontsize=9,
+        pad=1,
+        preferred=corner_map.label_xy,
+        obstacles=np.concatenate([np.column_stack([x, y]), corner_map.xy]),
+        obstacle_radius=2.5
+    )
+
+    # White dot at every corner
+    ax.scatter(corner_map.xy[:, 0], corner_map.xy[:, 1], color="white", s=8, zorder=5)
+
+    for number, gain, lx, ly in zip(numbers, corner_gain, labels.x, labels.y):
+
+        # Color depending on faster driver
+        if gain > 0:
+            color = "red"     # driver 1 faster
+        else:
+            color = "blue"    # driver 2 faster
+
+        # Draw only the corner number
+        ax.text(
+            lx,
+            ly,
+            number,
+            color="white",
+            fontsize=9,
+            ha="center",
+            va="center",
+            bbox=dict(
+                facecolor=color,
+                edgecolor="black",
+                linewidth=0.5,
+                alpha=0.9,
+                pad=1
+            )
+        )
+
+    return fig
+
+
+def boxed_text_field(ax, x, y, text, **kwargs):
+    ax.text(
+        x, y, text,
+        color="white",
+        bbox=dict(
+        facecolor="gray",
+        edgecolor="none",
+        alpha=0.55,
+        boxstyle="round,pad=0.35"
+        ),
+        **kwargs
+    )
+
+
+def boxed_text_axe(ax, x, y, text, **kwargs):
+    ax.text(
+        x, y, text,
+        color="white",
+        bbox=dict(
+        facecolor="black",
+        edgecolor="none",
+        alpha=0.55,
+        boxstyle="round,pad=0.35"
+        ),
+        **kwargs
+    )
+
+
+def aero_map_figure(results, team_palette, title, basis="Fastest Laps"):
+    """Top speed versus mean speed of every team, split in aero quadrants.
+
+    ``results`` is the output of ``aero_analysis.team_speed_table`` (or
+    ``session_speed_metrics``) with the team names to show, ``team_palette``
+    maps those names to colours and ``basis`` names the laps used.
+    """
+    fig, ax = plt.subplots(figsize=(10, 8))
+
+    # Scatter plot
+    ax.scatter(results['Mean speed (km/h)'],
+               results['Top speed (km/h)'],
+               s=120,
+               color=[team_palette.get(team, "black") for team in results['Team']],
+               edgecolor="black",
+               linewidth=0.6,
+               zorder=3)
+
+    ax.set_xlabel("Mean Speed (km/h)")
+    ax.set_ylabel("Top Speed (km/h)")
+
+    ax.set_title(f"{title}\nAero Performance Map ({basis})")
+
+    #Labels are placed in display space, so fix the layout first
+    ax.autoscale_view()
+    fig.tight_layout()
+
+    # Team labels next to their point, with a leader line when pushed further away
+    points = results[['Mean speed (km/h)', 'Top speed (km/h)']].to_numpy()
+    labels = place_labels(ax, points[:, 0], points[:, 1], results['Team'],
+                          fontsize=9, obstacles=points, obstacle_radius=6)
+
+    for team, (mean_speed, top_speed), lx, ly, moved in zip(
+            results['Team'], points, labels.x, labels.y, labels.moved):
+        ax.annotate(team,
+                    xy=(mean_speed, top_speed),
+                    xytext=(lx, ly),
+                    fontsize=9,
+                    ha='center',
+                    va='center',
+                    arrowprops=dict(arrowstyle="-", color='gray', lw=0.5) if moved else None)
+
+    # ----- CENTER -----
+    center_x = results['Mean speed (km/h)'].mean()
+    center_y = results['Top speed (km/h)'].mean()
+
+    ax.axvline(center_x, color='gray', linestyle='--', linewidth=1)
+    ax.axhline(center_y, color='gray', linestyle='--', linewidth=1)
+
+    # ----- QUADRANT LABELS -----
+    xmin, xmax = ax.get_xlim()
+    ymin, ymax = ax.get_ylim()
+
+    x_offset = (xmax - xmin) * 0.03
+    y_offset = (ymax - ymin) * 0.03
+
+    boxed_text_field(ax, xmax - x_offset, center_y, "Quick", ha="right", fontsize=9)
+    boxed_text_field(ax, xmin + x_offset, center_y, "Slow", ha="left", fontsize=9)
+
+    boxed_text_field(ax, center_x, ymax - y_offset, "Low Drag", ha="center", fontsize=9)
+    boxed_text_field(ax, center_x, ymin + y_offset, "High Drag", ha="center", fontsize=9)
+
+
+    # ----- DIAGONAL LABELS -----
+    boxed_text_axe(ax, center_x + (xmax-center_x)*0.55,
+               center_y + (ymax-center_y)*0.55,
+               "High Efficiency",
+               fontsize=9)
+
+    boxed_text_axe(ax, center_x - (center_x-xmin)*0.55,
+               center_y + (ymax-center_y)*0.55,
+               "Low Downforce",
+               fontsize=9,
+               ha="right")
+
+    boxed_text_axe(ax, center_x - (center_x-xmin)*0.55,
+               center_y - (center_y-ymin)*0.55,
+               "Low Efficiency",
+               fontsize=9,
+               ha="right")
+
+    boxed_text_axe(ax, center_x + (xmax-center_x)*0.55,
+               center_y - (center_y-ymin)*0.55,
+               "High Downforce",
+               fontsize=9)
+
+    # ----- STYLE -----
+    ax.grid(linestyle='-.', color='#CCCCCC')
+
+    return fig
+
+
+def dominance_map_figure(x, y, distance, minisectors, colors, title):
+    """Track map with every mini-sector in the colour of its fastest driver.
+
+    ``x``, ``y`` and ``distance`` are the normalized track on the distance
+    grid, ``minisectors`` the output of ``DeltaEngine.mini_sectors`` and
+    ``colors`` maps drivers to colours.
+    """
+    points = np.array([x, y]).T.reshape(-1,1,2)
+    segments = np.concatenate([points[:-1], points[1:]], axis=1)
+
+    #Mini-sector of every segment, then the driver owning it
+    sector = np.searchsorted(minisectors.boundaries, distance[:-1], side='right') - 1
+    sector = sector.clip(0, len(minisectors.fastest) - 1)
+    owners = [minisectors.drivers[i] for i in minisectors.fastest[sector]]
+
+    fig, ax = plt.subplots(figsize=(8,8))
+
+    lc = LineCollection(segments, colors=[colors.get(owner, "gray") for owner in owners], linewidth=5)
+    ax.add_collection(lc)
+
+    ax.set_xlim(-1.1,1.1)
+    ax.set_ylim(-1.1,1.1)
+    ax.set_aspect("equal")
+    ax.axis("off")
+
+    # ---- LEGEND: mini-sectors won by every driver ----
+    won = np.bincount(minisectors.fastest, minlength=len(minisectors.drivers))
+    handles = [plt.Line2D([], [], color=colors.get(driver, "gray"), linewidth=5,
+                          label=f"{driver} ({count})")
+               for driver, count in zip(minisectors.drivers, won)]
+    ax.legend(handles=handles, loc="upper left", bbox_to_anchor=(1.0, 1.0), title="Mini-sectors won")
+
+    ax.set_title(
+        f"{title}\nTrack dominance over {len(minisectors.fastest)} mini-sectors",
+        color="black"
+    )
+
+    return fig
@@ -0,0 +1,473 @@
+"""Computations behind the hotlap comparison page."""
+import logging
+import os
+from collections import namedtuple
+
+import numpy as np
+import pandas as pd
+
+from compact_telemetry import time_seconds
+
+_logger = logging.getLogger(__name__)
+
+SECTOR_COLUMNS = ['Sector1(s)', 'Sector2(s)', 'Sector3(s)']
+
+
+def add_seconds_columns(laps):
+    """Add lap and sector times in seconds to a laps frame."""
+    laps['LapTime(s)'] = laps['LapTime'].dt.total_seconds()
+    laps['Sector1(s)'] = laps['Sector1Time'].dt.total_seconds()
+    laps['Sector2(s)'] = laps['Sector2Time'].dt.total_seconds()
+    laps['Sector3(s)'] = laps['Sector3Time'].dt.total_seconds()
+    return laps
+
+
+def ideal_lap_table(laps, session_col=None):
+    """Gap of every driver's ideal lap to the ultimate lap, per sector.
+
+    ``laps`` needs the columns added by :func:`add_seconds_columns`. Pass
+    ``session_col`` for a frame holding the laps of several sessions (e.g. FP1
+    to Q concatenated with a session column): drivers are then compared with
+    the best sectors of their own session and get one row per session.
+
+    Returns one row per driver with ``S1_delta``, ``S2_delta``, ``S3_delta``,
+    ``Total_delta`` (ideal lap to ultimate lap) and ``Gap_PB_ideal`` (personal
+    best lap to ideal lap), in order of first appearance.
+    """
+    keys = [session_col, 'Driver'] if session_col else ['Driver']
+
+    best = laps.groupby(keys, sort=False)[SECTOR_COLUMNS].min()
+    if session_col:
+        overall = best.groupby(level=session_col).transform('min')
+    else:
+        overall = best.min()
+    deltas = best - overall
+
+    #Same lap as pick_fastest(): the quickest lap flagged as personal best
+    lap_time = laps['LapTime(s)']
+    if 'IsPersonalBest' in laps:
+        lap_time = lap_time.where(laps['IsPersonalBest'] == True)  # noqa: E712
+    pb = lap_time.groupby([laps[k] for k in keys], sort=False).min()
+
+    df = pd.DataFrame({
+        'S1_delta': deltas['Sector1(s)'],
+        'S2_delta': deltas['Sector2(s)'],
+        'S3_delta': deltas['Sector3(s)'],
+        'Total_delta': deltas.sum(axis=1, skipna=False),
+        'Gap_PB_ideal': pb - best.sum(axis=1, skipna=False)
+    })
+    return df.reset_index()
+
+
+#Number of points of the distance grid the laps are compared on
+GRID_POINTS = 1800
+
+#Width of the gaussian smoothing applied to the time delta, in grid points
+SIGMA = 6
+
+#Set to 0 to compare laps on the uniform grid instead of the adaptive one
+ADAPTIVE_GRID = os.environ.get("F1_ADAPTIVE_GRID", "1") == "1"
+
+#Points of the adaptive grid
+ADAPTIVE_POINTS = int(os.environ.get("F1_ADAPTIVE_POINTS", 600))
+
+#Density of the adaptive grid on straights, relative to its mean density from corners and braking
+ADAPTIVE_FLOOR = 0.5
+
+#Distance in metres the extra density of a corner or braking zone is spread over
+ADAPTIVE_SPREAD = 40.0
+
+#Default number of mini-sectors the lap is split into
+MINI_SECTORS = 25
+
+CornerMap = namedtuple('CornerMap', ['distance', 'grid_idx', 'xy', 'label_xy'])
+MiniSectors = namedtuple('MiniSectors', ['boundaries', 'drivers', 'times', 'fastest', 'theoretical_best'])
+
+
+def nearest_index(grid, values):
+    """Index of the nearest grid point for every value, on a sorted grid."""
+    values = np.asarray(values, dtype=float)
+    idx = np.searchsorted(grid, values).clip(1, len(grid) - 1)
+    #Step back when the left neighbour is at least as close (same as argmin)
+    idx -= (values - grid[idx - 1]) <= (grid[idx] - values)
+    return idx
+
+
+class CornerIndex:
+    """Corners of a circuit located once on a reference lap.
+
+    Corner positions along the lap are kept as fractions of the reference lap
+    length, together with the track direction at each corner, so the index can
+    be reused for the laps of any driver on the same circuit.
+    """
+
+    def __init__(self, corners, reference):
+        ref_dist = reference['Distance'].to_numpy(dtype=float)
+        ref_xy = reference[['X', 'Y']].to_numpy(dtype=float)
+        lap_length = ref_dist.max()
+
+        self.numbers = corners['Number'].to_numpy().astype(int)
+        self.xy = corners[['X', 'Y']].to_numpy(dtype=float)
+
+        #Closest reference sample of every corner in one spatial query
+        from scipy.spatial import cKDTree
+
+        _, nearest = cKDTree(ref_xy).query(self.xy)
+        corner_dist = ref_dist[nearest]
+        self.fractions = corner_dist / lap_length
+
+        #Track direction one grid step either side of the corner
+        step = lap_length / GRID_POINTS
+        ahead = np.clip(corner_dist + step, 0, lap_length)
+        behind = np.clip(corner_dist - step, 0, lap_length)
+        dx = np.interp(ahead, ref_dist, ref_xy[:, 0]) - np.interp(behind, ref_dist, ref_xy[:, 0])
+        dy = np.interp(ahead, ref_dist, ref_xy[:, 1]) - np.interp(behind, ref_dist, ref_xy[:, 1])
+        length = np.hypot(dx, dy)
+        self.normals = np.column_stack([-dy, dx]) / length[:, None]
+
+    def map(self, distance, center, scale, offset=0.06):
+        """Locate every corner on a distance grid and a normalized track map.
+
+        Returns the corner distances, their grid indices, the normalized corner
+        positions and the label anchors offset perpendicular to the track.
+        """
+        corner_distance = self.fractions * distance[-1]
+        xy = (self.xy - np.asarray(center, dtype=float)) / scale
+        return CornerMap(
+            distance=corner_distance,
+            grid_idx=nearest_index(distance, corner_distance),
+            xy=xy,
+            label_xy=xy + self.normals * offset
+        )
+
+
+_corner_indexes = {}
+
+
+def get_corner_index(circuit_key, corners, reference):
+    """Corner index of a circuit, built on first use and cached by circuit."""
+    index = _corner_indexes.get(circuit_key)
+    if index is None:
+        index = _corner_indexes.setdefault(circuit_key, CornerIndex(corners, reference))
+    return index
+
+
+def adaptive_grid(reference, points=ADAPTIVE_POINTS, knots=(), floor=ADAPTIVE_FLOOR, spread=ADAPTIVE_SPREAD):
+    """Distance grid of a circuit, denser where the track turns and the speed changes.
+
+    The density along the reference lap is its curvature plus its rate of
+    change of speed (each relative to its mean), spread over ``spread``
+    metres and raised by ``floor`` so straights keep some points. The grid
+    follows the inverse of the cumulative density. ``knots`` (e.g. corner
+    fractions) replace their nearest grid point, so values at the corners are
+    read exactly. Returned as fractions of the lap length, so the grid fits
+    any lap of the circuit.
+    """
+    from scipy.ndimage import gaussian_filter1d
+
+    dist = reference['Distance'].to_numpy(dtype=float)
+    lap_length = dist[-1]
+    fine = np.linspace(0, lap_length, 8 * GRID_POINTS)
+    x = np.interp(fine, dist, reference['X'].to_numpy(dtype=float))
+    y = np.interp(fine, dist, reference['Y'].to_numpy(dtype=float))
+    speed = np.interp(fine, dist, reference['Speed'].to_numpy(dtype=float))
+
+    heading = np.unwrap(np.arctan2(np.gradient(y), np.gradient(x)))
+    curvature = np.abs(np.gradient(heading, fine))
+    speed_change = np.abs(np.gradient(speed, fine))
+    density = curvature / curvature.mean() + speed_change / speed_change.mean()
+    density = gaussian_filter1d(density, spread / (fine[1] - fine[0]), mode='wrap')
+    density = floor + density / density.mean()
+
+    cumulative = np.concatenate([[0], np.cumsum((density[1:] + density[:-1]) / 2)])
+    grid = np.interp(np.linspace(0, 1, points), cumulative / cumulative[-1], fine / lap_length)
+
+    knots = np.asarray(knots, dtype=float)
+    if len(knots):
+        grid[nearest_index(grid, knots).clip(1, points - 2)] = knots.clip(0, 1)
+        grid = np.unique(grid)
+    return grid
+
+
+def smoothing_kernel(distance, width, truncate=4.0):
+    """Sparse gaussian smoothing matrix of ``width`` metres on a sorted, possibly uneven grid.
+
+    Row i holds the normalized weights of the grid points within
+    ``truncate * width`` of point i, each scaled by the grid spacing around
+    it, so ``kernel @ values`` smooths over the same distance wherever the
+    grid is dense or sparse.
+    """
+    from scipy.sparse import csr_matrix
+
+    n = len(distance)
+    reach = truncate * width
+    start = np.searchsorted(distance, distance - reach)
+    stop = np.searchsorted(distance, distance + reach, side='right')
+    counts = stop - start
+    rows = np.repeat(np.arange(n), counts)
+    cols = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts) + np.repeat(start, counts)
+    #Every point weighs for the stretch of track it stands for, or dense stretches would pull the average
+    cell = np.gradient(distance)
+    weights = np.exp(-0.5 * ((distance[cols] - distance[rows]) / width) ** 2) * cell[cols]
+    weights /= np.bincount(rows, weights=weights, minlength=n)[rows]
+    return csr_matrix((weights, (rows, cols)), shape=(n, n))
+
+
+_adaptive_grids = {}
+
+
+def get_adaptive_grid(circuit_key, reference, knots=()):
+    """Adaptive grid of a circuit, built on first use and cached by circuit."""
+    grid = _adaptive_grids.get(circuit_key)
+    if grid is None:
+        grid = _adaptive_grids.setdefault(circuit_key, adaptive_grid(reference, knots=knots))
+    return grid
+
+
+class DeltaEngine:
+    """Fastest laps of every driver of a session on one shared distance grid.
+
+    Lap time, position and speed of each driver are interpolated once onto a
+    common grid and kept as 2-D arrays (one row per driver). Any pairwise
+    delta, smoothed delta or corner gain is then a difference of two rows,
+    and all pairs at once are a broadcast over the driver axis.
+
+    The gaussian smoothing is linear, so the smoothed times are stored and a
+    smoothed delta is the difference of two smoothed rows.
+
+    The grid is ``grid_points`` uniform points, or any sorted ``distance``
+    grid (see ``adaptive_grid``). On an uneven grid the smoothing keeps the
+    width in metres of ``sigma`` points of the uniform grid.
+    """
+
+    def __init__(self, telemetry, lap_length, grid_points=GRID_POINTS, sigma=SIGMA, distance=None):
+        self.drivers = list(telemetry)
+        self._rows = {driver: i for i, driver in enumerate(self.drivers)}
+        self.sigma = sigma
+        if distance is None:
+            self.distance = np.linspace(0, lap_length, grid_points)
+            self._kernel = None
+        else:
+            self.distance = np.asarray(distance, dtype=float)
+            self._kernel = smoothing_kernel(self.distance, sigma * lap_length / (grid_points - 1))
+
+        shape = (len(self.drivers), len(self.distance))
+        self.times = np.empty(shape)
+        self.x = np.empty(shape)
+        self.y = np.empty(shape)
+        self.speed = np.empty(shape)
+        for i, tel in enumerate(telemetry.values()):
+            self.times[i], self.x[i], self.y[i], self.speed[i] = self._interpolate(tel)
+
+        self.smoothed = self._smooth(self.times)
+
+    def _smooth(self, times):
+        if self._kernel is None:
+            from scipy.ndimage import gaussian_filter1d
+            return gaussian_filter1d(times, self.sigma, axis=-1)
+        return (self._kernel @ times.T).T
+
+    def _interpolate(self, tel):
+        dist = tel['Distance'].to_numpy(dtype=float)
+        return (np.interp(self.distance, dist, time_seconds(tel)),
+                np.interp(self.distance, dist, tel['X']),
+                np.interp(self.distance, dist, tel['Y']),
+                np.interp(self.distance, dist, tel['Speed']))
+
+    def update(self, driver, tel):
+        """Replace the lap of one driver, or add a new driver.
+
+        Only that driver's row is interpolated and smoothed, so an update
+        costs one lap of work whatever the number of drivers. A new driver
+        grows the arrays by one row.
+        """
+        i = self._rows.get(driver)
+        if i is None:
+            i = len(self.drivers)
+            self.drivers.append(driver)
+            self._rows[driver] = i
+            row = np.empty((1, len(self.distance)))
+            self.times, self.smoothed, self.x, self.y, self.speed = (
+                np.concatenate([a, row]) for a in (self.times, self.smoothed, self.x, self.y, self.speed))
+
+        self.times[i], self.x[i], self.y[i], self.speed[i] = self._interpolate(tel)
+        self.smoothed[i] = self._smooth(self.times[i])
+
+    @property
+    def nbytes(self):
+        return sum(a.nbytes for a in (self.times, self.smoothed, self.x, self.y, self.speed))
+
+    def row(self, driver):
+        return self._rows[driver]
+
+    def delta(self, driver1, driver2, smooth=True):
+        """Time lost by driver2 to driver1 along the lap (positive = driver1 ahead)."""
+        times = self.smoothed if smooth else self.times
+        return times[self.row(driver2)] - times[self.row(driver1)]
+
+    def track(self, driver):
+        """Position of a driver's lap on the grid."""
+        i = self.row(driver)
+        return self.x[i], self.y[i]
+
+    def corner_gains(self, driver1, driver2, grid_idx):
+        """Time gained by driver1 on driver2 between consecutive corners."""
+        return np.diff(self.delta(driver1, driver2)[grid_idx], prepend=0)
+
+    def delta_matrix(self):
+        """Lap time difference of every driver pair, rows minus columns."""
+        lap = self.times[:, -1]
+        return pd.DataFrame(lap[:, None] - lap[None, :], index=self.drivers, columns=self.drivers)
+
+    def corner_gain_matrix(self, grid_idx):
+        """Corner gains of every pair as an (N, N, corners) array.
+
+        ``[i, j]`` holds the gains of driver i on driver j, i.e.
+        ``corner_gains(drivers[i], drivers[j], grid_idx)``.
+        """
+        at_corners = self.smoothed[:, grid_idx]
+        delta = at_corners[None, :, :] - at_corners[:, None, :]
+        return np.diff(delta, axis=2, prepend=0)
+
+    def mini_sectors(self, n=MINI_SECTORS, drivers=None, laps=None):
+        """Mini-sector times of the fastest lap of every driver (or of ``drivers``).
+
+        With ``laps``, a sequence of ``(driver, telemetry)`` pairs (e.g. every
+        timed lap of the session), each driver's best time through every
+        mini-sector over all its laps is used instead. The laps are read in
+        one interpolation, on the same mini-sectors of this engine's lap.
+        """
+        boundaries = np.linspace(0, self.distance[-1], n + 1)
+        if laps is not None:
+            laps = [(driver, tel) for driver, tel in laps
+                    if len(tel) and (drivers is None or driver in drivers)]
+            at = lap_boundary_times([tel for _, tel in laps], boundaries)
+            return mini_sectors([driver for driver, _ in laps], at, boundaries)
+        rows = [self.row(driver) for driver in drivers] if drivers is not None else slice(None)
+        at = grid_boundary_times(self.distance, self.times[rows], boundaries)
+        return mini_sectors(drivers if drivers is not None else self.drivers, at, boundaries)
+
+
+def fastest_laps(laps):
+    """Fastest lap of every driver, in order of first appearance."""
+    return {driver: laps.pick_drivers(driver).pick_fastest()
+            for driver in pd.unique(laps['Driver'])}
+
+
+def build_delta_engine(session, lap_telemetry, grid=None, **kwargs):
+    """Delta engine over the fastest lap of every driver of a session.
+
+    ``lap_telemetry`` returns the telemetry (with distance) of a lap; drivers
+    whose lap has no telemetry are left out of the engine. The grid spans the
+    fastest lap with telemetry: uniform, or ``grid`` (fractions of the lap,
+    see ``adaptive_grid``).
+    """
+    laps = {driver: lap for driver, lap in fastest_laps(session.laps).items() if lap is not None}
+    telemetry = {}
+    for driver, lap in laps.items():
+        #A driver whose lap has no telemetry is left out, the others are still compared
+        try:
+            tel = lap_telemetry(lap)
+        except Exception as exc:
+            _logger.info("No telemetry for the fastest lap of %s: %s", driver, exc)
+            continue
+        if len(tel):
+            telemetry[driver] = tel
+    if not telemetry:
+        raise ValueError("No driver's fastest lap has telemetry")
+
+    fastest = min(telemetry, key=lambda driver: laps[driver]['LapTime'])
+    lap_length = telemetry[fastest]['Distance'].max()
+    if grid is not None:
+        kwargs['distance'] = np.asarray(grid) * lap_length
+    return DeltaEngine(telemetry, lap_length, **kwargs)
+
+
+def normalize_track(x, y):
+    """Track centered on its mean and scaled to [-1, 1], with the center and scale."""
+    center = (np.mean(x), np.mean(y))
+    x = x - center[0]
+    y = y - center[1]
+    scale = max(np.max(np.abs(x)), np.max(np.abs(y)))
+    return x / scale, y / scale, center, scale
+
+
+def corner_gain_table(corner_numbers, corner_gain, driver1, driver2):
+    """Faster driver and time gained over every corner."""
+    df = pd.DataFrame({
+        'Turn': [int(number) for number in corner_numbers],
+        'Delta (s)': np.round(corner_gain, 3)
+    })
+    df['Faster Driver'] = np.where(df['Delta (s)'] > 0, driver1, driver2)
+    df['Gain (s)'] = df['Delta (s)'].abs()
+    return df[['Turn', 'Faster Driver', 'Gain (s)']]
+
+
+def pair_corner_gains(engine, grid_idx, corner_numbers):
+    """Corner gains of every driver pair as a long table.
+
+    One row per (Driver1, Driver2, Turn) with the time driver 1 gained on
+    driver 2 over the corner, for every unordered pair of drivers.
+    """
+    gains = engine.corner_gain_matrix(grid_idx)
+    i, j = np.triu_indices(len(engine.drivers), k=1)
+    drivers = np.asarray(engine.drivers, dtype=object)
+    turns = np.asarray([int(number) for number in corner_numbers])
+    n = len(turns)
+    return pd.DataFrame({
+        'Driver1': np.repeat(drivers[i], n),
+        'Driver2': np.repeat(drivers[j], n),
+        'Turn': np.tile(turns, len(i)),
+        'Delta (s)': gains[i, j].ravel()
+    })
+
+
+def grid_boundary_times(distance, times, boundaries):
+    """Lap time at every boundary for rows of times on a distance grid.
+
+    ``times`` is (rows, grid points); returns (rows, boundaries). The grid
+    positions of the boundaries are found once and shared by every row.
+    """
+    pos = np.interp(boundaries, distance, np.arange(len(distance)))
+    left = np.floor(pos).astype(int).clip(0, len(distance) - 2)
+    frac = pos - left
+    return times[:, left] * (1 - frac) + times[:, left + 1] * frac
+
+
+def lap_boundary_times(telemetry, boundaries):
+    """Lap time at every boundary for any number of laps, in one interpolation.
+
+    ``telemetry`` is a sequence of lap telemetry frames (with distance). The
+    laps are laid end to end on one distance axis, each shifted past the end
+    of the previous one, so a single ``np.interp`` serves all of them.
+    Boundaries past the end of a lap are clamped to its last sample.
+    """
+    dist = [tel['Distance'].to_numpy(dtype=float) for tel in telemetry]
+    lengths = np.array([d[-1] if len(d) else 0.0 for d in dist])
+    stride = max(lengths.max(initial=0.0), boundaries[-1]) + 1.0
+    offsets = np.arange(len(dist)) * stride
+
+    axis = np.concatenate([d + offset for d, offset in zip(dist, offsets)])
+    values = np.concatenate([time_seconds(tel) for tel in telemetry])
+    query = np.minimum(boundaries[None, :], lengths[:, None]) + offsets[:, None]
+    return np.interp(query.ravel(), axis, values).reshape(len(dist), len(boundaries))
+
+
+def mini_sectors(drivers, boundary_times, boundaries):
+    """Best mini-sector times per driver, the fastest driver of each and the theoretical best.
+
+    ``boundary_times`` holds one row per lap (several laps of a driver are
+    allowed) and ``drivers`` the driver of each row. The theoretical best is
+    the sum of the fastest time of every mini-sector, whoever set it.
+    """
+    rows, names = pd.factorize(pd.Series(list(drivers)))
+    times = np.diff(boundary_times, axis=1)
+    best = np.full((len(names), times.shape[1]), np.inf)
+    np.minimum.at(best, rows, times)
+    return MiniSectors(
+        boundaries=boundaries,
+        drivers=list(names),
+        times=best,
+        fastest=np.argmin(best, axis=0),
+        theoretical_best=float(best.min(axis=0).sum())
+    )
@@ -0,0 +1,99 @@
+"""Import-time profile of the pages.
+
+Runs the imports every page starts with in a fresh interpreter with
+``python -X importtime`` and reports what each page pays before its first
+element is shown, and the modules that cost the most::
+
+    python import_profile.py
+    python import_profile.py F1_hotlap_comparison.py --top 15 --out benchmarks/imports.json
+
+Only the imports a page starts with are profiled: imports deferred to the
+stage that needs them are left out, which is the point.
+"""
+import argparse
+import ast
+import glob
+import json
+import os
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+
+
+def header_imports(path):
+    """Source of the import statements a script starts with, before its first other statement."""
+    with open(path, encoding='utf-8') as f:
+        source = f.read()
+    imports = []
+    for node in ast.parse(source).body:
+        if isinstance(node, (ast.Import, ast.ImportFrom)):
+            imports.append(ast.get_source_segment(source, node))
+        elif not (isinstance(node, ast.Expr) and isinstance(node.value, ast.Constant)):
+            break
+    return '\n'.join(imports)
+
+
+def parse_importtime(stderr):
+    """Self and cumulative microseconds and nesting depth per module from ``-X importtime`` output."""
+    modules = {}
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        #Nested imports are indented two spaces per level after the separator
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        modules.setdefault(name.strip(), (int(self_us), int(cumulative_us), depth))
+    return modules
+
+
+def profile(code, cwd=ROOT):
+    """Import profile of running ``code`` in a fresh interpreter."""
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', code],
+                            capture_output=True, text=True, cwd=cwd)
+    if result.returncode:
+        raise RuntimeError(result.stderr.strip().splitlines()[-1])
+    modules = parse_importtime(result.stderr)
+    #Top-level entries (no indent) add up to the whole import time
+    total = sum(cumulative for _, cumulative, depth in modules.values() if depth == 0)
+    return {
+        'total_ms': total / 1000,
+        'modules': {name: {'self_ms': s / 1000, 'cumulative_ms': c / 1000}
+                    for name, (s, c, _) in modules.items()}
+    }
+
+
+def page_profile(path, top=10):
+    """Import profile of a page and its ``top`` most expensive top-level packages."""
+    result = profile(header_imports(path))
+    packages = {}
+    for name, times in result['modules'].items():
+        root = name.split('.')[0]
+        packages[root] = max(packages.get(root, 0.0), times['cumulative_ms'])
+    heaviest = sorted(packages.items(), key=lambda item: item[1], reverse=True)[:top]
+    return {'page': os.path.basename(path), 'total_ms': result['total_ms'], 'heaviest': dict(heaviest)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Profile the import time of the pages.")
+    parser.add_argument('pages', nargs='*', help="Page scripts, all pages by default")
+    parser.add_argument('--top', type=int, default=10, help="Most expensive packages listed per page")
+    parser.add_argument('--out', default=None, help="JSON file to write the profiles to")
+    args = parser.parse_args()
+
+    pages = args.pages or sorted(glob.glob(os.path.join(ROOT, 'F1_*.py')))
+    profiles = [page_profile(page, args.top) for page in pages]
+
+    for result in profiles:
+        print(f"{result['page']:32s} {result['total_ms']:10.1f} ms")
+        for name, ms in result['heaviest'].items():
+            print(f"    {name:28s} {ms:10.1f} ms")
+
+    if args.out:
+        os.makedirs(os.path.dirname(os.path.abspath(args.out)), exist_ok=True)
+        with open(args.out, 'w') as f:
+            json.dump(profiles, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,204 @@
+"""Named timing spans around the stages of the pages.
+
+Enable with ``F1_PROFILE=1``. Every span records its wall time, the growth of
+the process' peak RSS while it ran and, when given a cache (any object with
+``hits`` and ``misses`` counters, e.g. the session store or the render cache),
+the cache hits and misses it caused::
+
+    start_run("hotlap")
+    with span("session.load", cache=get_session_store()):
+        session = get_session(year, event, session_type)
+    ...
+    finish_run()
+
+Spans are appended as JSON lines to ``F1_PROFILE_LOG`` and, at the end of a
+run, per-stage totals and the memory of the session store and render cache
+are written in Prometheus text format to ``F1_PROFILE_PROM`` (for a
+node-exporter textfile collector). ``sidebar_panel()`` shows the spans of the
+current run in the Streamlit sidebar.
+
+When profiling is disabled ``span`` returns a shared no-op context manager,
+so instrumented code pays one function call per stage.
+"""
+import contextlib
+import json
+import os
+import sys
+import threading
+import time
+from collections import defaultdict
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+ENABLED = os.environ.get("F1_PROFILE", "0") == "1"
+
+_DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data")
+LOG_PATH = os.environ.get("F1_PROFILE_LOG", os.path.join(_DATA_DIR, "profile.jsonl"))
+PROM_PATH = os.environ.get("F1_PROFILE_PROM", os.path.join(_DATA_DIR, "profile.prom"))
+
+_NOOP = contextlib.nullcontext()
+_local = threading.local()
+_lock = threading.Lock()
+_totals = defaultdict(lambda: {'count': 0, 'seconds': 0.0, 'hits': 0, 'misses': 0})
+
+
+def _peak_rss():
+    #Peak resident set size of the process in bytes
+    if resource is None:
+        return 0
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+class _Span:
+
+    def __init__(self, name, cache, labels):
+        self.name = name
+        self.cache = cache
+        self.labels = labels
+
+    def __enter__(self):
+        if self.cache is not None:
+            self._hits, self._misses = self.cache.hits, self.cache.misses
+        self._rss = _peak_rss()
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        record = {
+            'span': self.name,
+            'page': getattr(_local, 'page', None),
+            'time': time.time(),
+            'wall_s': time.perf_counter() - self._start,
+            'peak_rss_delta_mb': (_peak_rss() - self._rss) / 1024 ** 2,
+            'error': exc_type.__name__ if exc_type else None,
+            **self.labels
+        }
+        if self.cache is not None:
+            record['cache_hits'] = self.cache.hits - self._hits
+            record['cache_misses'] = self.cache.misses - self._misses
+        _record(record)
+        return False
+
+
+def _record(record):
+    records = getattr(_local, 'records', None)
+    if records is not None:
+        records.append(record)
+    with _lock:
+        total = _totals[(record['page'], record['span'])]
+        total['count'] += 1
+        total['seconds'] += record['wall_s']
+        total['hits'] += record.get('cache_hits', 0)
+        total['misses'] += record.get('cache_misses', 0)
+        if LOG_PATH:
+            os.makedirs(os.path.dirname(os.path.abspath(LOG_PATH)), exist_ok=True)
+            with open(LOG_PATH, 'a') as f:
+                f.write(json.dumps(record) + '\n')
+
+
+def span(name, cache=None, **labels):
+    """Context manager timing one stage, a no-op when profiling is disabled."""
+    if not ENABLED:
+        return _NOOP
+    return _Span(name, cache, labels)
+
+
+def start_run(page):
+    """Start collecting the spans of one script run of ``page``."""
+    if ENABLED:
+        _local.page = page
+        _local.records = []
+
+
+def run_records():
+    """Spans recorded so far in the current run."""
+    return list(getattr(_local, 'records', None) or [])
+
+
+def add_run_records(records):
+    """Add spans recorded elsewhere (e.g. by the analysis service) to the current run.
+
+    They are only shown with the run, their totals were counted where they ran.
+    """
+    current = getattr(_local, 'records', None)
+    if current is not None:
+        current.extend(records)
+
+
+def _memory_gauges():
+    from render_cache import get_render_cache
+    from session_store import get_session_store
+
+    store = get_session_store()
+    gauges = [('f1_render_cache_bytes', {}, get_render_cache().nbytes),
+              ('f1_session_store_bytes', {}, store.nbytes)]
+    for _, row in store.memory_report().iterrows():
+        gauges.append(('f1_session_resident_bytes', {'session': row['Session']}, row['Resident (MB)'] * 1024 ** 2))
+        gauges.append(('f1_session_compaction_saved_bytes', {'session': row['Session']},
+                       row['Saved by compaction (MB)'] * 1024 ** 2))
+    return gauges
+
+
+def _prom_line(metric, labels, value):
+    label_text = ','.join(f'{key}="{str(val)}"'.replace('\n', ' ') for key, val in labels.items())
+    return f"{metric}{{{label_text}}} {value}" if label_text else f"{metric} {value}"
+
+
+def prometheus_text():
+    """Per-stage totals and memory gauges in Prometheus text format."""
+    metrics = {
+        'f1_stage_seconds': ('summary', []),
+        'f1_stage_cache_hits_total': ('counter', []),
+        'f1_stage_cache_misses_total': ('counter', [])
+    }
+    with _lock:
+        totals = dict(_totals)
+    for (page, name), total in sorted(totals.items(), key=lambda item: (str(item[0][0]), item[0][1])):
+        labels = {'page': page or '', 'stage': name}
+        metrics['f1_stage_seconds'][1].append(_prom_line('f1_stage_seconds_sum', labels, total['seconds']))
+        metrics['f1_stage_seconds'][1].append(_prom_line('f1_stage_seconds_count', labels, total['count']))
+        metrics['f1_stage_cache_hits_total'][1].append(_prom_line('f1_stage_cache_hits_total', labels, total['hits']))
+        metrics['f1_stage_cache_misses_total'][1].append(_prom_line('f1_stage_cache_misses_total', labels, total['misses']))
+    for metric, labels, value in _memory_gauges():
+        metrics.setdefault(metric, ('gauge', []))[1].append(_prom_line(metric, labels, value))
+
+    lines = []
+    for metric, (kind, samples) in metrics.items():
+        lines.append(f"# TYPE {metric} {kind}")
+        lines.extend(samples)
+    return '\n'.join(lines) + '\n'
+
+
+def finish_run():
+    """Write the Prometheus file at the end of a script run."""
+    if not ENABLED or not PROM_PATH:
+        return
+    text = prometheus_text()
+    os.makedirs(os.path.dirname(os.path.abspath(PROM_PATH)), exist_ok=True)
+    tmp = PROM_PATH + '.tmp'
+    with open(tmp, 'w') as f:
+        f.write(text)
+    os.replace(tmp, PROM_PATH)
+
+
+def sidebar_panel():
+    """Spans of the current run and store memory in the Streamlit sidebar."""
+    if not ENABLED:
+        return
+    import pandas as pd
+    import streamlit as st
+
+    from session_store import get_session_store
+
+    with st.sidebar.expander("Stage timings", expanded=False):
+        records = pd.DataFrame(run_records())
+        if len(records):
+            columns = [c for c in ('span', 'wall_s', 'peak_rss_delta_mb', 'cache_hits', 'cache_misses')
+                       if c in records]
+            st.dataframe(records[columns], hide_index=True)
+            st.caption(f"Total {records['wall_s'].sum():.3f} s")
+        st.dataframe(get_session_store().memory_report(), hide_index=True)
@@ -0,0 +1,157 @@
+"""Deterministic label placement for scatter and track-map labels.
+
+Every label gets a list of candidate positions around its anchor (an optional
+preferred position first, then eight directions on rings of growing radius).
+Candidates are tried in order and the first one that overlaps neither an
+already placed label, an obstacle (markers, track samples) nor the edge of the
+axes is kept; when none is free, the candidate with the least overlap wins.
+Overlaps of all the candidates of a label are looked up at once in a uniform
+grid, so placing hundreds of labels stays in the tens of milliseconds, and
+the same inputs always give the same layout.
+
+Placement works in display coordinates, so call it once the axes limits and
+the figure layout are final.
+"""
+from collections import defaultdict, namedtuple
+from functools import lru_cache
+
+import numpy as np
+from matplotlib.font_manager import FontProperties
+from matplotlib.textpath import text_to_path
+
+LabelPlacement = namedtuple('LabelPlacement', ['x', 'y', 'moved'])
+
+#Unit directions tried on every ring: right, left, up, down, then diagonals
+_DIRECTIONS = np.array([
+    (1, 0), (-1, 0), (0, 1), (0, -1),
+    (1, 1), (-1, 1), (1, -1), (-1, -1)
+], dtype=float)
+
+
+@lru_cache(maxsize=4096)
+def _text_width(text, fontsize):
+    #Advance width from the font metrics, in points
+    width, _, _ = text_to_path.get_text_width_height_descent(text, FontProperties(size=fontsize), ismath=False)
+    return width
+
+
+def text_size(text, fontsize, dpi, pad=0.0):
+    """Width and height of a text box in pixels, without a renderer."""
+    width = _text_width(str(text), fontsize)
+    scale = dpi / 72
+    return (width + 2 * pad) * scale, (1.2 * fontsize + 2 * pad) * scale
+
+
+class _BoxIndex:
+    """Uniform grid over axis-aligned boxes for overlap queries.
+
+    Boxes are no larger than a cell and are kept in the cell of their lower
+    left corner only, so a query looks one cell further down and left and
+    never sees a box twice.
+    """
+
+    def __init__(self, cell):
+        self.cell = cell
+        self.cells = defaultdict(list)
+        self.boxes = np.empty((64, 4))
+        self.size = 0
+
+    def add(self, box):
+        if self.size == len(self.boxes):
+            self.boxes = np.concatenate([self.boxes, np.empty_like(self.boxes)])
+        self.boxes[self.size] = box
+        self.cells[int(box[0] // self.cell), int(box[1] // self.cell)].append(self.size)
+        self.size += 1
+
+    def overlaps(self, boxes):
+        """Area every box of ``boxes`` (k, 4) shares with the indexed boxes."""
+        x0, y0 = (boxes[:, :2].min(axis=0) - self.cell) // self.cell
+        x1, y1 = boxes[:, 2:].max(axis=0) // self.cell
+        cells = self.cells
+        ids = [k for i in range(int(x0), int(x1) + 1) for j in range(int(y0), int(y1) + 1)
+               for k in cells.get((i, j), ())]
+        if not ids:
+            return np.zeros(len(boxes))
+        other = self.boxes[ids]
+        w = np.minimum(boxes[:, 2, None], other[:, 2]) - np.maximum(boxes[:, 0, None], other[:, 0])
+        h = np.minimum(boxes[:, 3, None], other[:, 3]) - np.maximum(boxes[:, 1, None], other[:, 1])
+        return (np.maximum(w, 0) * np.maximum(h, 0)).sum(axis=1)
+
+
+def _outside(boxes, bounds):
+    #Area of every box that falls outside the axes
+    x0, y0, x1, y1 = bounds
+    w = boxes[:, 2] - boxes[:, 0]
+    h = boxes[:, 3] - boxes[:, 1]
+    inside_w = np.maximum(np.minimum(boxes[:, 2], x1) - np.maximum(boxes[:, 0], x0), 0)
+    inside_h = np.maximum(np.minimum(boxes[:, 3], y1) - np.maximum(boxes[:, 1], y0), 0)
+    return w * h - inside_w * inside_h
+
+
+def place_labels(ax, x, y, labels, fontsize=9, pad=1.0, radius=4.0, rings=4,
+                 preferred=None, obstacles=None, obstacle_radius=4.0):
+    """Place one label per anchor point without overlaps.
+
+    Args:
+        ax: axes the labels are drawn on, with final limits
+        x, y: anchor points in data coordinates
+        labels: label texts
+        fontsize: font size of the labels, in points
+        pad: padding around each text, in points (e.g. the bbox pad)
+        radius: gap between the anchor and the label box, in points
+        rings: number of rings of candidates around each anchor
+        preferred: optional (n, 2) label centers in data coordinates tried
+            before the rings
+        obstacles: optional (m, 2) points in data coordinates labels should
+            not cover (markers, track samples)
+        obstacle_radius: half size of the obstacles, in points
+
+    Returns:
+        label centers in data coordinates (draw with ha/va='center') and a
+        mask of the labels that ended up away from their first candidate
+    """
+    fig = ax.figure
+    #Fixed aspect ratios are only applied at draw time
+    ax.apply_aspect()
+    scale = fig.dpi / 72
+    to_display = ax.transData.transform
+    anchors = to_display(np.column_stack([x, y]).astype(float))
+    sizes = np.array([text_size(label, fontsize, fig.dpi, pad) for label in labels]).reshape(-1, 2)
+
+    bounds = ax.get_window_extent().extents
+    r = obstacle_radius * scale
+    #Every box fits in a cell, see _BoxIndex
+    cell = max(sizes.max(initial=1.0), 2 * r, 1.0)
+    index = _BoxIndex(cell)
+
+    if obstacles is not None and len(obstacles):
+        for ox, oy in to_display(np.asarray(obstacles, dtype=float)):
+            index.add((ox - r, oy - r, ox + r, oy + r))
+
+    if preferred is not None:
+        preferred = to_display(np.asarray(preferred, dtype=float))
+
+    #Offsets of the ring candidates in units of (half box + ring gap)
+    gap = radius * scale
+    steps = np.repeat(gap * np.arange(1, rings + 1), len(_DIRECTIONS))
+    directions = np.tile(_DIRECTIONS, (rings, 1))
+
+    centers = np.empty_like(anchors)
+    moved = np.zeros(len(anchors), dtype=bool)
+    for i, (anchor, (w, h)) in enumerate(zip(anchors, sizes)):
+        candidates = anchor + directions * (np.array([w / 2, h / 2]) + steps[:, None])
+        if preferred is not None:
+            candidates = np.vstack([preferred[i], candidates])
+        half = np.array([w / 2, h / 2])
+        boxes = np.hstack([candidates - half, candidates + half])
+
+        #All candidates are scored at once: the first free one, or the least overlapping
+        cost = index.overlaps(boxes) + _outside(boxes, bounds)
+        best = int(np.argmin(cost))
+
+        centers[i] = candidates[best]
+        moved[i] = best > 0
+        index.add(boxes[best])
+
+    data = ax.transData.inverted().transform(centers) if len(centers) else centers
+    return LabelPlacement(x=data[:, 0], y=data[:, 1], moved=moved)
@@ -0,0 +1,290 @@
+"""Incremental hotlap analysis of a live session.
+
+Lap updates (lap and sector times plus the lap's telemetry) are applied one
+at a time: a lap only touches its driver's best sectors and, when it is a new
+personal best, that driver's row of the delta engine. The ideal lap table,
+pair deltas and corner gains are then read off the small per-driver arrays,
+so an update costs one lap of work whatever the size of the session.
+
+The live timing client is replaced locally by a recorded file replayed at any
+speed, one JSON object per line::
+
+    {"type": "session", "year": 2024, "event": "...", "session": "Qualifying", "corners": [[X, Y, Number, Letter, Angle], ...]}
+    {"type": "lap", "t": 1834.2, "Driver": "VER", "Team": "...", "LapNumber": 12, "LapTime": 71.3,
+     "Sector1Time": 18.2, "Sector2Time": 33.0, "Sector3Time": 20.1, "Deleted": false,
+     "telemetry": {"Distance": [...], "Time": [...], "Speed": [...], "X": [...], "Y": [...]}}
+
+``t`` is the session time the lap was completed at, in seconds. Record a
+session that already took place with::
+
+    python live_session.py 2024 "Monaco Grand Prix" Qualifying data/live/monaco_q.jsonl
+"""
+import argparse
+import json
+import os
+import threading
+import time
+
+import numpy as np
+import pandas as pd
+
+from hotlap_analysis import GRID_POINTS, SIGMA, DeltaEngine
+from metadata_index import CORNER_COLUMNS
+
+#Recorded sessions offered by the live page
+LIVE_DIR = os.environ.get(
+    "F1_LIVE_DIR",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "live")
+)
+
+#Seconds between two refreshes of the live views
+LIVE_INTERVAL = float(os.environ.get("F1_LIVE_INTERVAL", 2.0))
+
+#Size of the render cache of the live figures in MB, apart from the shared one
+#so refreshes never evict the figures of the other pages
+LIVE_RENDER_MB = int(os.environ.get("F1_LIVE_RENDER_MB", 16))
+
+SECTOR_TIMES = ['Sector1Time', 'Sector2Time', 'Sector3Time']
+
+
+def _seconds(value):
+    return np.nan if value is None else float(value)
+
+
+class LiveSession:
+    """Ideal lap table and delta engine kept up to date lap by lap.
+
+    Readers take ``lock`` while they copy what they draw; ``version`` grows
+    with every update that changed a view.
+    """
+
+    def __init__(self, lap_length=None, grid_points=GRID_POINTS, sigma=SIGMA):
+        self.lock = threading.Lock()
+        self.version = 0
+        self.header = {}
+        self.lap_length = lap_length
+        self.grid_points = grid_points
+        self.sigma = sigma
+        self.engine = None
+        self.reference = None  # telemetry of the fastest lap so far
+        self._rows = {}        # driver -> row of the arrays below
+        self._sectors = np.empty((0, 3))  # best sector times per driver
+        self._pb = np.empty(0)            # personal best lap time per driver
+
+    @property
+    def drivers(self):
+        return list(self._rows)
+
+    @property
+    def corners(self):
+        corners = self.header.get('corners')
+        return None if corners is None else pd.DataFrame(corners, columns=CORNER_COLUMNS)
+
+    def _row(self, driver):
+        i = self._rows.get(driver)
+        if i is None:
+            i = self._rows[driver] = len(self._rows)
+            self._sectors = np.vstack([self._sectors, np.full((1, 3), np.nan)])
+            self._pb = np.append(self._pb, np.nan)
+        return i
+
+    def apply(self, update):
+        """Apply one update, returns True when a view changed."""
+        if update.get('type') == 'session':
+            with self.lock:
+                self.header = update
+                self.version += 1
+            return True
+        if update.get('Deleted') or update.get('LapTime') is None:
+            return False
+
+        driver = str(update['Driver'])
+        lap_time = float(update['LapTime'])
+        sectors = np.array([_seconds(update.get(name)) for name in SECTOR_TIMES])
+        tel = pd.DataFrame(update['telemetry']) if update.get('telemetry') else None
+
+        with self.lock:
+            i = self._row(driver)
+            best = np.fmin(self._sectors[i], sectors)
+            changed = not np.array_equal(best, self._sectors[i], equal_nan=True)
+            self._sectors[i] = best
+
+            #A timed lap without telemetry still sets the personal best, the
+            #engine keeps the driver's last lap that had telemetry
+            if not lap_time >= self._pb[i]:
+                self._pb[i] = lap_time
+                changed = True
+                if tel is not None and len(tel):
+                    if self.engine is None:
+                        length = self.lap_length or float(tel['Distance'].max())
+                        self.engine = DeltaEngine({}, length, self.grid_points, self.sigma)
+                    self.engine.update(driver, tel)
+                    if not lap_time > np.fmin.reduce(self._pb):
+                        self.reference = tel
+
+            if changed:
+                self.version += 1
+        return changed
+
+    def ideal_lap_table(self):
+        """Same columns as ``hotlap_analysis.ideal_lap_table``, from the live bests."""
+        with self.lock:
+            drivers = self.drivers
+            best = self._sectors.copy()
+            pb = self._pb.copy()
+        deltas = best - np.fmin.reduce(best, axis=0) if len(best) else best
+        return pd.DataFrame({
+            'Driver': drivers,
+            'S1_delta': deltas[:, 0],
+            'S2_delta': deltas[:, 1],
+            'S3_delta': deltas[:, 2],
+            'Total_delta': deltas.sum(axis=1),
+            'Gap_PB_ideal': pb - best.sum(axis=1)
+        })
+
+    def ultimate_lap(self):
+        """Sum of the best sector times of the session."""
+        with self.lock:
+            return float(np.fmin.reduce(self._sectors, axis=0).sum()) if len(self._sectors) else np.nan
+
+
+def read_updates(path):
+    """Updates of a recorded session, in file order."""
+    with open(path) as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+
+class ReplayFeed(threading.Thread):
+    """Replays a recorded session into a live session, ``speed`` times faster.
+
+    A speed of 0 applies every update at once.
+    """
+
+    def __init__(self, path, live, speed=1.0):
+        super().__init__(daemon=True, name=f"replay-{os.path.basename(path)}")
+        self.path = path
+        self.live = live
+        self.speed = speed
+        self.finished = False
+        self._halt = threading.Event()
+
+    def run(self):
+        start = time.monotonic()
+        first = None
+        for update in read_updates(self.path):
+            if 't' in update and self.speed:
+                first = update['t'] if first is None else first
+                wait = start + (update['t'] - first) / self.speed - time.monotonic()
+                if wait > 0 and self._halt.wait(wait):
+                    return
+            if self._halt.is_set():
+                return
+            self.live.apply(update)
+        self.finished = True
+
+    def stop(self):
+        self._halt.set()
+
+
+_live = {}
+_live_lock = threading.Lock()
+
+
+def get_live_session(path, speed=1.0):
+    """Live session fed by the replay of ``path``, started on first use.
+
+    Asking again with another speed restarts the replay from the beginning.
+    """
+    with _live_lock:
+        live, feed = _live.get(path, (None, None))
+        if feed is None or feed.speed != speed:
+            if feed is not None:
+                feed.stop()
+            live = LiveSession()
+            feed = ReplayFeed(path, live, speed)
+            feed.start()
+            _live[path] = (live, feed)
+        return live, feed
+
+
+_live_render = None
+_live_render_lock = threading.Lock()
+
+
+def get_live_render_cache():
+    """Return the render cache of the live figures, every refresh adds new versions to it."""
+    from render_cache import RenderCache
+
+    global _live_render
+    with _live_render_lock:
+        if _live_render is None:
+            _live_render = RenderCache(LIVE_RENDER_MB * 1024 ** 2)
+        return _live_render
+
+
+def record_session(session, path, corners=None):
+    """Write the laps of a loaded session as a replayable live recording.
+
+    The session needs laps and telemetry loaded. Laps are written in the
+    order they were completed, with the telemetry channels of the live mode.
+    Returns the number of laps written.
+    """
+    from compact_telemetry import compact
+    from telemetry_store import CHANNELS, lap_telemetry
+
+    laps = session.laps.dropna(subset=['LapTime']).sort_values('Time')
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    count = 0
+    with open(path, 'w') as f:
+        header = {
+            'type': 'session',
+            'year': int(session.event.year),
+            'event': session.event['EventName'],
+            'session': session.name,
+            'corners': None if corners is None else corners[CORNER_COLUMNS].values.tolist()
+        }
+        f.write(json.dumps(header) + '\n')
+        for _, lap in laps.iterlaps():
+            try:
+                tel = compact(lap_telemetry(lap, 'telemetry'), CHANNELS['telemetry'])
+            except Exception:
+                continue
+            update = {
+                'type': 'lap',
+                't': lap['Time'].total_seconds(),
+                'Driver': str(lap['Driver']),
+                'Team': str(lap['Team']),
+                'LapNumber': int(lap['LapNumber']),
+                'LapTime': lap['LapTime'].total_seconds(),
+                'Deleted': lap.get('Deleted') == True,  # noqa: E712
+                'telemetry': {channel: np.round(tel[channel].to_numpy(dtype=float), 3).tolist()
+                              for channel in tel}
+            }
+            for name in SECTOR_TIMES:
+                update[name] = None if pd.isna(lap[name]) else lap[name].total_seconds()
+            f.write(json.dumps(update) + '\n')
+            count += 1
+    return count
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Record a session as a replayable live timing file.")
+    parser.add_argument('year', type=int)
+    parser.add_argument('event')
+    parser.add_argument('session')
+    parser.add_argument('path')
+    args = parser.parse_args()
+
+    import fastf1 as ff1
+    from metadata_index import circuit_corners, get_metadata_index
+
+    session = ff1.get_session(args.year, args.event, args.session)
+    session.load(laps=True, telemetry=True, weather=False, messages=True)
+    corners = circuit_corners(get_metadata_index(), session, args.year, args.event)
+    print(f"{record_session(session, args.path, corners)} laps written to {args.path}")
+
+
+if __name__ == '__main__':
+    main()
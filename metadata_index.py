@@ -0,0 +1,254 @@
+"""Local, versioned index of season schedules and circuit metadata.
+
+The index holds for every round of a season the Grand Prix name, circuit,
+weekend format (sprint or conventional), track length and the corner table of
+``session.get_circuit_info()``. It is stored as a compact JSON file and loaded
+once per process, so the pages can fill their selectboxes without calling
+Ergast on every rerun and keep working offline.
+
+Seasons are fetched the first time they are asked for. The current season is
+refreshed every few days, and only rounds missing from the index are added.
+Corner tables are filled in the first time a session of the round is loaded.
+
+Build or refresh the index ahead of time with::
+
+    python metadata_index.py 2024 2025 --corners
+"""
+import argparse
+import datetime as dt
+import json
+import os
+import threading
+
+import pandas as pd
+
+INDEX_VERSION = 2
+
+INDEX_PATH = os.environ.get(
+    "F1_METADATA_INDEX",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "metadata_index.json")
+)
+
+#Set to 1 to never touch the network, only the local index is used
+OFFLINE = os.environ.get("F1_OFFLINE", "0") == "1"
+
+#Days after which the current season is checked for new rounds
+REFRESH_AFTER_DAYS = 3
+
+#Track length in metres by Ergast circuit id, a Grand Prix that moves to a new
+#venue keeps its name but not its length
+TRACK_LENGTHS = {
+    'albert_park': 5278, 'shanghai': 5451, 'suzuka': 5807,
+    'bahrain': 5412, 'jeddah': 6174, 'miami': 5412,
+    'imola': 4909, 'monaco': 3337, 'catalunya': 4675,
+    'villeneuve': 4361, 'red_bull_ring': 4318, 'silverstone': 5891,
+    'spa': 7004, 'hungaroring': 4381, 'zandvoort': 4259,
+    'monza': 5793, 'baku': 6003, 'marina_bay': 4940,
+    'americas': 5513, 'rodriguez': 4304, 'interlagos': 4309,
+    'vegas': 6201, 'losail': 5419, 'yas_marina': 5281
+}
+
+CORNER_COLUMNS = ['X', 'Y', 'Number', 'Letter', 'Angle']
+
+
+def _fetch_schedule(year):
+    from fastf1.ergast import Ergast
+    return Ergast().get_race_schedule(season=year)
+
+
+def _round_record(row):
+    sprint = 'sprintDate' in row and pd.notna(row['sprintDate'])
+    return {
+        'raceName': row['raceName'],
+        'circuitId': row['circuitId'],
+        'raceDate': str(pd.Timestamp(row['raceDate']).date()),
+        'format': 'sprint' if sprint else 'conventional',
+        'trackLength': TRACK_LENGTHS.get(row['circuitId']),
+        'corners': None
+    }
+
+
+class MetadataIndex:
+    """Schedule and circuit metadata of every indexed season."""
+
+    def __init__(self, path=INDEX_PATH, offline=OFFLINE, fetch_schedule=_fetch_schedule):
+        self.path = path
+        self.offline = offline
+        self._fetch_schedule = fetch_schedule
+        self._lock = threading.Lock()
+        self._data = self._read()
+
+    def _read(self):
+        try:
+            with open(self.path, encoding='utf-8') as f:
+                data = json.load(f)
+        except (FileNotFoundError, ValueError):
+            data = None
+        #Version 1 looked track lengths up by Grand Prix name, the rounds are kept
+        if data and data.get('version') == 1:
+            for season in data['seasons'].values():
+                for record in season['rounds'].values():
+                    record['trackLength'] = TRACK_LENGTHS.get(record['circuitId'])
+            data['version'] = INDEX_VERSION
+        #Rebuild from scratch when the file layout changed
+        if not data or data.get('version') != INDEX_VERSION:
+            data = {'version': INDEX_VERSION, 'seasons': {}}
+        return data
+
+    def save(self):
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        tmp = self.path + '.tmp'
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump(self._data, f, ensure_ascii=False, separators=(',', ':'))
+        os.replace(tmp, self.path)
+
+    def _season(self, year):
+        return self._data['seasons'].get(str(year))
+
+    def _is_stale(self, year, season):
+        if int(year) < dt.date.today().year:
+            return False
+        refreshed = dt.date.fromisoformat(season['refreshed'])
+        return (dt.date.today() - refreshed).days >= REFRESH_AFTER_DAYS
+
+    def refresh(self, year):
+        """Fetch the schedule of a season and add the rounds not indexed yet.
+
+        Returns the number of rounds added.
+        """
+        schedule = self._fetch_schedule(int(year))
+        with self._lock:
+            season = self._data['seasons'].setdefault(str(year), {'rounds': {}})
+            rounds = season['rounds']
+            added = 0
+            for _, row in schedule.iterrows():
+                rnd = str(int(row['round']))
+                if rnd not in rounds:
+                    rounds[rnd] = _round_record(row)
+                    added += 1
+            season['refreshed'] = dt.date.today().isoformat()
+            self.save()
+        return added
+
+    def _ensure(self, year):
+        season = self._season(year)
+        if self.offline:
+            if season is None:
+                raise LookupError(f"Season {year} is not in the metadata index ({self.path})")
+            return season
+        if season is None:
+            self.refresh(year)
+        elif self._is_stale(year, season):
+            #A failed refresh keeps the indexed rounds, the app stays usable offline
+            try:
+                self.refresh(year)
+            except Exception:
+                pass
+        return self._season(year)
+
+    def schedule(self, year):
+        """Rounds of a season as a DataFrame, one row per round."""
+        rounds = self._ensure(year)['rounds']
+        schedule = pd.DataFrame(
+            [{'round': int(rnd), **{k: v for k, v in r.items() if k != 'corners'}}
+             for rnd, r in rounds.items()]
+        )
+        return schedule.sort_values(by='round').reset_index(drop=True)
+
+    def _round(self, year, event):
+        for rnd, record in self._ensure(year)['rounds'].items():
+            if record['raceName'] == event:
+                return rnd, record
+        raise KeyError(f"{event} is not in the {year} schedule")
+
+    def event_format(self, year, event):
+        return self._round(year, event)[1]['format']
+
+    def session_names(self, year, event, options):
+        """Filter the session options of a page to those held at the event."""
+        if self.event_format(year, event) == 'sprint':
+            dropped = {'FP3', 'Sprint Qualifying'} if int(year) <= 2022 else {'FP2', 'FP3'}
+        else:
+            dropped = {'Sprint Qualifying'}
+        return tuple(s for s in options if s not in dropped)
+
+    def circuit_id(self, year, event):
+        return self._round(year, event)[1]['circuitId']
+
+    def circuit_events(self, year, circuit):
+        """Grand Prix names held at a circuit in a season."""
+        return [record['raceName'] for record in self._ensure(year)['rounds'].values()
+                if record['circuitId'] == circuit]
+
+    def track_length(self, year, event):
+        """Track length of the event's circuit in metres, or None when unknown.
+
+        Callers fall back to the distance of the laps they measure.
+        """
+        record = self._round(year, event)[1]
+        return record['trackLength'] or TRACK_LENGTHS.get(record['circuitId'])
+
+    def corners(self, year, event):
+        """Indexed corner table of the event, or None when not indexed yet."""
+        corners = self._round(year, event)[1]['corners']
+        if corners is None:
+            return None
+        return pd.DataFrame(corners, columns=CORNER_COLUMNS)
+
+    def set_corners(self, year, event, corners):
+        rnd, record = self._round(year, event)
+        with self._lock:
+            record['corners'] = corners[CORNER_COLUMNS].values.tolist()
+            self.save()
+
+
+def circuit_corners(index, session, year, event):
+    """Corner table of a loaded session, read from the index when available."""
+    corners = index.corners(year, event)
+    if corners is None:
+        corners = session.get_circuit_info().corners
+        index.set_corners(year, event, corners)
+    return corners
+
+
+_index = None
+_index_lock = threading.Lock()
+
+
+def get_metadata_index():
+    """Return the process-wide index, reading it from disk on first use."""
+    global _index
+    with _index_lock:
+        if _index is None:
+            _index = MetadataIndex()
+        return _index
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build or refresh the local metadata index.")
+    parser.add_argument('years', nargs='+', type=int)
+    parser.add_argument('--corners', action='store_true',
+                        help="also index the corner table of every round (loads each qualifying session)")
+    args = parser.parse_args()
+
+    index = MetadataIndex(offline=False)
+    for year in args.years:
+        print(f"{year}: {index.refresh(year)} new rounds")
+        if not args.corners:
+            continue
+
+        import fastf1 as ff1
+        for event in index.schedule(year)['raceName']:
+            if index.corners(year, event) is not None:
+                continue
+            try:
+                session = ff1.get_session(year, event, 'Qualifying')
+                session.load(laps=True, telemetry=False, weather=False, messages=False)
+                circuit_corners(index, session, year, event)
+                print(f"{year} {event}: corners indexed")
+            except Exception as exc:
+                print(f"{year} {event}: no corners ({exc})")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,7 @@
+"""Helpers shared by the on-disk stores and reports."""
+import re
+
+
+def slug(text):
+    """Filesystem-safe name of an event, session, driver or circuit (e.g. "Monaco_Grand_Prix")."""
+    return re.sub(r'\W+', '_', str(text)).strip('_')
@@ -0,0 +1,134 @@
+"""Background prefetch of the sessions a user is likely to open next.
+
+Users walk through a weekend in order (FP1, FP2, FP3, Qualifying) and jump
+between the aero and hotlap pages for the same session. Once a session is
+selected, :meth:`Prefetcher.after_select` loads the sessions before and after
+it at the same event and the lap telemetry of the top qualifiers (used by the
+hotlap page) in worker threads, so the next click hits a warm store.
+
+Prefetching is bounded: at most ``max_workers`` loads run at once, each key
+is queued only once, and nothing is started while the session store is above
+``memory_fraction`` of its budget. Prefetched sessions are stored as least
+recently used, so they are evicted before any session in use.
+"""
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from session_store import LAPS, get_session_store
+from hotlap_analysis import fastest_laps
+
+_logger = logging.getLogger(__name__)
+
+#Set to 0 to disable prefetching
+ENABLED = os.environ.get("F1_PREFETCH", "1") == "1"
+
+#Concurrent background loads
+MAX_WORKERS = int(os.environ.get("F1_PREFETCH_WORKERS", 2))
+
+#Share of the session store budget above which nothing is prefetched
+MEMORY_FRACTION = float(os.environ.get("F1_PREFETCH_MEMORY", 0.75))
+
+#Drivers whose fastest qualifying lap telemetry is warmed
+TOP_QUALIFIERS = 6
+
+#Order of the sessions of a weekend offered by the pages
+WEEKEND_ORDER = ('FP1', 'FP2', 'FP3', 'Sprint Qualifying', 'Qualifying')
+QUALIFYING = ('Qualifying', 'Sprint Qualifying')
+
+
+def adjacent_sessions(sessions, session_type):
+    """Sessions right after and right before ``session_type``, next one first."""
+    if session_type not in sessions:
+        return []
+    i = sessions.index(session_type)
+    return sessions[i + 1:i + 2] + sessions[max(i - 1, 0):i]
+
+
+class Prefetcher:
+    """Bounded pool of background session and lap telemetry loads."""
+
+    def __init__(self, store=None, max_workers=MAX_WORKERS, memory_fraction=MEMORY_FRACTION,
+                 top_qualifiers=TOP_QUALIFIERS, index=None):
+        self.store = store if store is not None else get_session_store()
+        self.memory_fraction = memory_fraction
+        self.top_qualifiers = top_qualifiers
+        self._index = index
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="prefetch")
+        self._queued = set()
+        self._lock = threading.Lock()
+
+    def _has_room(self):
+        return self.store.nbytes < self.memory_fraction * self.store.max_bytes
+
+    def _submit(self, key, fn, *args):
+        #Every key is prefetched once per process, failures are not retried
+        with self._lock:
+            if key in self._queued or not self._has_room():
+                return False
+            self._queued.add(key)
+        self._pool.submit(self._run, key, fn, *args)
+        return True
+
+    def _run(self, key, fn, *args):
+        if not self._has_room():
+            with self._lock:
+                self._queued.discard(key)
+            return
+        try:
+            fn(*args)
+        except Exception as exc:
+            _logger.info("Prefetch of %s failed: %s", key, exc)
+
+    def session(self, year, event, session_type, needs=(LAPS,)):
+        """Queue a background load of a session."""
+        if (year, event, session_type) in self.store:
+            return False
+        return self._submit(('session', year, event, session_type), self.store.prefetch,
+                            year, event, session_type, needs)
+
+    def hotlaps(self, year, event, session_type):
+        """Queue the lap telemetry of the fastest laps of the top qualifiers."""
+        return self._submit(('hotlaps', year, event, session_type), self._load_hotlaps,
+                            year, event, session_type)
+
+    def _load_hotlaps(self, year, event, session_type):
+        session = self.store.prefetch(year, event, session_type)
+        #Same laps as the hotlap page's delta engine, quickest drivers first
+        laps = [lap for lap in fastest_laps(session.laps).values() if lap is not None]
+        laps.sort(key=lambda lap: lap['LapTime'])
+        for lap in laps[:self.top_qualifiers]:
+            self.store.lap_data(year, event, session_type, lap, "telemetry", prefetch=True)
+
+    def after_select(self, year, event, session_type):
+        """Warm what is likely to be opened after selecting a session."""
+        if self._index is None:
+            from metadata_index import get_metadata_index
+            self._index = get_metadata_index()
+        sessions = list(self._index.session_names(year, event, WEEKEND_ORDER))
+        adjacent = adjacent_sessions(sessions, session_type)
+        for other in adjacent:
+            self.session(year, event, other)
+        for other in [session_type, *adjacent]:
+            if other in QUALIFYING:
+                self.hotlaps(year, event, other)
+
+
+_prefetcher = None
+_prefetcher_lock = threading.Lock()
+
+
+def get_prefetcher():
+    """Return the process-wide prefetcher."""
+    global _prefetcher
+    with _prefetcher_lock:
+        if _prefetcher is None:
+            _prefetcher = Prefetcher()
+        return _prefetcher
+
+
+def prefetch_after_select(year, event, session_type):
+    """Warm the sessions next to the selected one, when prefetching is enabled."""
+    if ENABLED:
+        get_prefetcher().after_select(year, event, session_type)
@@ -0,0 +1,92 @@
+"""Process-wide cache of rendered figures.
+
+Figures are rendered once per set of analysis inputs and kept as finished
+image bytes, so a repeat view serves the image without running matplotlib.
+The cache is bounded in bytes with LRU eviction. Figures are closed as soon as
+they are saved, so matplotlib does not keep them alive across reruns.
+
+Bump ``STYLE_VERSION`` whenever a chart's look changes, it is part of every key.
+"""
+import io
+import os
+import threading
+from collections import OrderedDict
+
+STYLE_VERSION = 2
+
+#Cache size in MB, can be overridden from the environment
+DEFAULT_MAX_MB = int(os.environ.get("F1_RENDER_CACHE_MB", 256))
+
+#Same output as st.pyplot
+SAVEFIG_OPTIONS = {"bbox_inches": "tight", "dpi": 200}
+
+
+def figure_bytes(fig, fmt="png"):
+    """Save a figure to bytes and close it."""
+    from matplotlib import pyplot as plt
+
+    buf = io.BytesIO()
+    try:
+        fig.savefig(buf, format=fmt, **SAVEFIG_OPTIONS)
+    finally:
+        plt.close(fig)
+    return buf.getvalue()
+
+
+class RenderCache:
+    """LRU cache of image bytes keyed by the inputs of the figure."""
+
+    def __init__(self, max_bytes=DEFAULT_MAX_MB * 1024 ** 2):
+        self.max_bytes = max_bytes
+        self._images = OrderedDict()  # key -> bytes
+        self._nbytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, render, fmt="png"):
+        """Image bytes of ``render()``'s figure, rendered only on a miss."""
+        key = (*key, fmt, STYLE_VERSION)
+        with self._lock:
+            image = self._images.get(key)
+            if image is not None:
+                self._images.move_to_end(key)
+                self.hits += 1
+                return image
+            self.misses += 1
+
+        image = figure_bytes(render(), fmt)
+
+        with self._lock:
+            if key not in self._images:
+                self._images[key] = image
+                self._nbytes += len(image)
+            while len(self._images) > 1 and self._nbytes > self.max_bytes:
+                _, evicted = self._images.popitem(last=False)
+                self._nbytes -= len(evicted)
+        return image
+
+    @property
+    def nbytes(self):
+        return self._nbytes
+
+    def __len__(self):
+        return len(self._images)
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_render_cache():
+    """Return the process-wide render cache."""
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = RenderCache()
+        return _cache
+
+
+def render_image(key, render, fmt="png"):
+    """Cached image bytes of the figure returned by ``render()``."""
+    return get_render_cache().get(key, render, fmt)
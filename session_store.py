@@ -0,0 +1,394 @@
+"""Process-wide store of loaded fastf1 sessions shared by both Streamlit pages.
+
+Sessions are keyed by (year, event, session type), kept in LRU order and
+evicted once the configured memory budget is exceeded. Concurrent requests for
+a session that is still loading wait on the same load instead of starting
+their own.
+
+Sessions are loaded in tiers: callers state which data they need (``LAPS``,
+``TELEMETRY``, ``WEATHER``) and only that is loaded. A session that was loaded
+with fewer tiers is upgraded in place when a later view asks for more. Lap
+telemetry slices are fetched on demand per driver/lap and kept with the
+session.
+
+Lap telemetry is read from the columnar telemetry store when the session has
+been extracted there, without loading the telemetry tier at all. Otherwise it
+is sliced from fastf1 and the session is extracted in the background, so the
+next views read from the store. Lap telemetry kept in memory is compacted to
+the channels the pages use, and the bytes saved are reported per session. fastf1 itself
+is only imported by the first load.
+"""
+import logging
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future
+
+import pandas as pd
+
+from telemetry_store import CHANNELS, extract_session, get_telemetry_store, lap_telemetry
+from compact_telemetry import compact, frame_nbytes
+
+_logger = logging.getLogger(__name__)
+
+#Memory budget in MB, can be overridden from the environment
+DEFAULT_MAX_MB = int(os.environ.get("F1_SESSION_STORE_MB", 2048))
+
+#Set to 0 to not extract sessions to the telemetry store automatically
+AUTO_EXTRACT = os.environ.get("F1_TELEMETRY_STORE_AUTO", "1") == "1"
+
+#Data tiers a page can ask for
+LAPS = "laps"            # laps, results and race control messages (deleted laps)
+TELEMETRY = "telemetry"  # car data and position data of every driver
+WEATHER = "weather"
+
+TIERS = (LAPS, TELEMETRY, WEATHER)
+
+
+def _load_session(year, event, session_type, tiers):
+    import fastf1 as ff1
+
+    session = ff1.get_session(year, event, session_type)
+    session.load(
+        laps=LAPS in tiers,
+        telemetry=TELEMETRY in tiers,
+        weather=WEATHER in tiers,
+        #Race control messages are needed to flag deleted lap times
+        messages=LAPS in tiers
+    )
+    return session
+
+
+def _upgrade_session(session, tiers):
+    #Load the missing tiers into an already loaded session
+    if TELEMETRY in tiers:
+        session._load_telemetry()
+    if WEATHER in tiers:
+        session._load_weather_data()
+
+
+def _frame_bytes(df):
+    if df is None:
+        return 0
+    return frame_nbytes(df)
+
+
+def session_nbytes(session):
+    """Approximate resident size of the data loaded into a session."""
+    total = 0
+    for name in ("_laps", "_results", "_weather_data", "_race_control_messages",
+                 "_session_status", "_track_status"):
+        df = getattr(session, name, None)
+        if isinstance(df, pd.DataFrame):
+            total += _frame_bytes(df)
+    for name in ("_car_data", "_pos_data"):
+        for df in (getattr(session, name, None) or {}).values():
+            total += _frame_bytes(df)
+    return total
+
+
+def _lap_key(lap):
+    return (str(lap["Driver"]), int(lap["LapNumber"]))
+
+
+class _Entry:
+
+    def __init__(self, session, tiers):
+        self.session = session
+        self.tiers = set(tiers)
+        self.laps = {}     # (driver, lap number, kind) -> telemetry
+        self.derived = {}  # name -> result computed from the session
+        self.extracting = {}  # telemetry kind -> thread writing it to the store
+        self.session_bytes = session_nbytes(session)
+        self.extra_bytes = 0  # lap telemetry and derived results
+        self.saved_bytes = 0  # saved by compacting lap telemetry
+        self.lock = threading.Lock()
+        self.derived_lock = threading.Lock()
+
+    @property
+    def nbytes(self):
+        return self.session_bytes + self.extra_bytes
+
+
+class SessionStore:
+    """LRU cache of sessions with a memory budget and single-flight loading."""
+
+    def __init__(self, max_bytes=DEFAULT_MAX_MB * 1024 ** 2,
+                 loader=_load_session, upgrader=_upgrade_session,
+                 telemetry_store=None, auto_extract=AUTO_EXTRACT):
+        self.max_bytes = max_bytes
+        self._loader = loader
+        self._upgrader = upgrader
+        self._telemetry_store = telemetry_store
+        self._auto_extract = auto_extract
+        self._entries = OrderedDict()  # key -> _Entry
+        self._inflight = {}            # key -> Future
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.prefetches = 0
+
+    @staticmethod
+    def key(year, event, session_type):
+        return (int(year), str(event), str(session_type))
+
+    def get(self, year, event, session_type, needs=(LAPS,)):
+        tiers = {LAPS, *needs}
+        unknown = tiers - set(TIERS)
+        if unknown:
+            raise ValueError(f"Unknown session tiers: {sorted(unknown)}")
+
+        entry = self._entry(self.key(year, event, session_type), tiers)
+        if not tiers <= entry.tiers:
+            self._upgrade(entry, tiers)
+        return entry.session
+
+    def prefetch(self, year, event, session_type, needs=(LAPS,)):
+        """Load a session ahead of a request, without making it recent.
+
+        Prefetched sessions go to the least recently used end of the store, so
+        they are the first to be evicted and never push out the sessions in
+        use. A later ``get`` moves them to the recent end as usual.
+        """
+        entry = self._entry(self.key(year, event, session_type), {LAPS, *needs}, prefetch=True)
+        if not {LAPS, *needs} <= entry.tiers:
+            self._upgrade(entry, {LAPS, *needs})
+        return entry.session
+
+    def _entry(self, key, tiers, prefetch=False):
+        with self._lock:
+            if key in self._entries:
+                if not prefetch:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                return self._entries[key]
+
+            future = self._inflight.get(key)
+            leader = future is None
+            if leader:
+                future = Future()
+                self._inflight[key] = future
+                if prefetch:
+                    self.prefetches += 1
+                else:
+                    self.misses += 1
+
+        #Another rerun (or the prefetcher) is already loading this session, wait for its result
+        if not leader:
+            entry = future.result()
+            if not prefetch:
+                with self._lock:
+                    if key in self._entries:
+                        self._entries.move_to_end(key)
+            return entry
+
+        #Waiters are released on every path, a failed load is retried by the next request
+        try:
+            entry = _Entry(self._loader(*key, tiers), tiers)
+            with self._lock:
+                self._entries[key] = entry
+                self._entries.move_to_end(key, last=not prefetch)
+                self._evict()
+        except BaseException as exc:
+            future.set_exception(exc)
+            raise
+        else:
+            future.set_result(entry)
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+        return entry
+
+    def _upgrade(self, entry, tiers):
+        #Only one rerun upgrades a session, the others wait on the entry lock
+        with entry.lock:
+            missing = tiers - entry.tiers
+            if not missing:
+                return
+            self._upgrader(entry.session, missing)
+            entry.tiers |= missing
+            entry.session_bytes = session_nbytes(entry.session)
+        with self._lock:
+            self._evict()
+
+    def lap_data(self, year, event, session_type, lap, kind="telemetry", prefetch=False):
+        """Telemetry of a single lap with distance added, fetched on demand.
+
+        ``kind`` is ``"telemetry"`` for merged car and position data or
+        ``"car"`` for car data only. The result is a compact frame with the
+        channels of ``telemetry_store.CHANNELS``. With ``prefetch`` the
+        session is neither made recent nor counted as a hit, as in
+        :meth:`prefetch`.
+        """
+        session_key = self.key(year, event, session_type)
+        entry = self._entry(session_key, {LAPS}, prefetch=prefetch)
+
+        key = (*_lap_key(lap), kind)
+        tel = entry.laps.get(key)
+        if tel is not None:
+            return tel
+
+        #Memory-mapped slice from the telemetry store, not counted as resident
+        if self._telemetry_store is not None:
+            tel = self._telemetry_store.read(session_key, kind, *key[:2])
+            if tel is not None:
+                with entry.lock:
+                    tel = entry.laps.setdefault(key, tel)
+                return tel
+
+        if TELEMETRY not in entry.tiers:
+            self._upgrade(entry, {LAPS, TELEMETRY})
+        full = lap_telemetry(lap, kind)
+        tel = compact(full, CHANNELS[kind])
+        self._extract(session_key, entry, kind)
+        with entry.lock:
+            if key not in entry.laps:
+                entry.laps[key] = tel
+                entry.extra_bytes += _frame_bytes(tel)
+                entry.saved_bytes += _frame_bytes(full) - _frame_bytes(tel)
+            tel = entry.laps[key]
+        return tel
+
+    def driver_car_data(self, year, event, session_type, number):
+        """Car data of one driver over the whole session, or None.
+
+        The session's own merged car data (``session.car_data[number]``, with
+        ``SessionTime`` and without distance), for analyses that split every
+        lap of a driver in one pass. It is part of the telemetry tier and
+        already counted with the session, so nothing is kept per lap.
+        """
+        session = self.get(year, event, session_type, needs=(TELEMETRY,))
+        return session.car_data.get(str(number))
+
+    def _extract(self, session_key, entry, kind, force=False):
+        #Write the whole session to the telemetry store once, in the background.
+        #Returns the thread writing it (possibly started earlier), or None.
+        if self._telemetry_store is None or not (self._auto_extract or force):
+            return None
+
+        def run():
+            #A failed extraction is logged and retried by the next lap read from fastf1
+            try:
+                extract_session(entry.session, session_key, kind, self._telemetry_store)
+            except Exception:
+                _logger.exception("Extraction of %s %s to the telemetry store failed", session_key, kind)
+            finally:
+                with entry.lock:
+                    entry.extracting.pop(kind, None)
+
+        with entry.lock:
+            thread = entry.extracting.get(kind)
+            if thread is not None or self._telemetry_store.has(session_key, kind):
+                return thread
+            thread = entry.extracting[kind] = threading.Thread(target=run, daemon=True)
+        thread.start()
+        return thread
+
+    def extract(self, year, event, session_type, kinds=tuple(CHANNELS)):
+        """Write a session's telemetry to the telemetry store and wait for it.
+
+        For scripts that exit right after their work, where a background
+        extraction (a daemon thread) would be cut short. Kinds already stored
+        are skipped, extractions already running are waited for.
+        """
+        if self._telemetry_store is None:
+            return
+        session_key = self.key(year, event, session_type)
+        entry = self._entry(session_key, {LAPS})
+        if all(self._telemetry_store.has(session_key, kind) for kind in kinds):
+            return
+        if TELEMETRY not in entry.tiers:
+            self._upgrade(entry, {LAPS, TELEMETRY})
+        for thread in [self._extract(session_key, entry, kind, force=True) for kind in kinds]:
+            if thread is not None:
+                thread.join()
+
+    def derived(self, year, event, session_type, name, build):
+        """Result of ``build()`` computed once per session and kept with it.
+
+        Used for per-session structures (e.g. the delta engine) so they are
+        evicted together with their session.
+        """
+        entry = self._entry(self.key(year, event, session_type), {LAPS})
+        if name not in entry.derived:
+            with entry.derived_lock:
+                if name not in entry.derived:
+                    result = build()
+                    entry.derived[name] = result
+                    entry.extra_bytes += getattr(result, 'nbytes', 0)
+                    #Large results (delta engines) can take the store over its budget
+                    with self._lock:
+                        self._evict()
+        return entry.derived[name]
+
+    def _evict(self):
+        #Drop least recently used sessions, but always keep the newest one
+        while len(self._entries) > 1 and self.nbytes > self.max_bytes:
+            self._entries.popitem(last=False)
+
+    @property
+    def nbytes(self):
+        return sum(entry.nbytes for entry in self._entries.values())
+
+    def memory_report(self):
+        """Resident size and bytes saved by compaction of every stored session."""
+        rows = [{
+            'Session': f"{year} {event} {session_type}",
+            'Tiers': ', '.join(sorted(entry.tiers)),
+            'Resident (MB)': entry.nbytes / 1024 ** 2,
+            'Lap telemetry (MB)': entry.extra_bytes / 1024 ** 2,
+            'Saved by compaction (MB)': entry.saved_bytes / 1024 ** 2
+        } for (year, event, session_type), entry in list(self._entries.items())]
+        return pd.DataFrame(rows)
+
+    def tiers(self, year, event, session_type):
+        entry = self._entries.get(self.key(year, event, session_type))
+        return set(entry.tiers) if entry else set()
+
+    def __contains__(self, key):
+        return self.key(*key) in self._entries
+
+    def __len__(self):
+        return len(self._entries)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_session_store():
+    """Return the process-wide store, creating it on first use."""
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = SessionStore(telemetry_store=get_telemetry_store())
+        return _store
+
+
+def get_session(year, event, session_type, needs=(LAPS,)):
+    """Load (or reuse and upgrade) a session through the shared store."""
+    return get_session_store().get(year, event, session_type, needs=needs)
+
+
+def get_lap_telemetry(year, event, session_type, lap):
+    """Merged car and position telemetry of one lap, with distance."""
+    return get_session_store().lap_data(year, event, session_type, lap, "telemetry")
+
+
+def get_lap_car_data(year, event, session_type, lap):
+    """Car data of one lap, with distance."""
+    return get_session_store().lap_data(year, event, session_type, lap, "car")
+
+
+def get_driver_car_data(year, event, session_type, number):
+    """Car data of one driver over the whole session."""
+    return get_session_store().driver_car_data(year, event, session_type, number)
+
+
+def get_derived(year, event, session_type, name, build):
+    """Per-session result of ``build()``, shared by all reruns and pages."""
+    return get_session_store().derived(year, event, session_type, name, build)
@@ -0,0 +1,135 @@
+"""Synthetic stand-in for a loaded fastf1 session, for offline benchmarks.
+
+The circuit is a closed curve with a speed profile that drops in the tight
+sections; every driver gets a pace offset and every lap some noise, so lap
+and sector times, fastest laps and deltas behave like real ones. Sizes are
+configurable, and the same arguments always give the same data.
+
+    session = SyntheticSession(drivers=20, laps=12, samples=700)
+    session.laps                       # fastf1 Laps with sector times
+    session.lap_telemetry(lap)         # Distance, Time, Speed, X, Y
+    session.driver_car_data(number)    # SessionTime, Speed over the session
+    session.corners                    # X, Y, Number, Letter, Angle
+"""
+import numpy as np
+import pandas as pd
+from fastf1.core import Laps
+
+#Length of the synthetic circuit in metres
+TRACK_LENGTH = 5000.0
+
+#Seconds between the end of a timed lap and the start of the next one
+COOL_DOWN = 90.0
+
+
+class SyntheticSession:
+    """Laps, lap telemetry and corners of a made-up qualifying session."""
+
+    def __init__(self, drivers=20, laps=12, samples=700, teams=10, corners=16, seed=0):
+        self.name = 'Qualifying'
+        self.event = {'EventName': 'Synthetic Grand Prix', 'year': 2024}
+        self.samples = samples
+        self.seed = seed
+
+        #Circuit shape and its speed profile on a fine distance grid
+        theta = np.linspace(0, 2 * np.pi, 4000)
+        x = 2000 * np.cos(theta) + 400 * np.cos(3 * theta) + 150 * np.sin(7 * theta)
+        y = 1200 * np.sin(theta) + 300 * np.sin(2 * theta)
+        step = np.hypot(np.diff(x), np.diff(y))
+        dist = np.concatenate([[0], np.cumsum(step)]) * TRACK_LENGTH / step.sum()
+        heading = np.unwrap(np.arctan2(np.gradient(y), np.gradient(x)))
+        curvature = np.abs(np.gradient(heading, dist))
+        self._shape = (dist, x, y, 330 - 240 * np.sqrt(curvature / curvature.max()))
+
+        at = np.linspace(0, len(theta) - 1, corners + 2).astype(int)[1:-1]
+        self.corners = pd.DataFrame({
+            'X': x[at],
+            'Y': y[at],
+            'Number': np.arange(1, corners + 1),
+            'Letter': '',
+            'Angle': np.degrees(heading[at]) % 360
+        })
+
+        rng = np.random.default_rng(seed)
+        codes = [f"D{i:02d}" for i in range(drivers)]
+        pace = dict(zip(codes, rng.normal(1.0, 0.006, drivers)))
+        rows = []
+        for k, code in enumerate(codes):
+            start = 0.0
+            for lap_number in range(1, laps + 1):
+                sectors = self._lap_times(pace[code], code, lap_number)
+                rows.append({
+                    'Driver': code,
+                    'DriverNumber': str(k + 1),
+                    'Team': f"Team {k % teams}",
+                    'LapNumber': float(lap_number),
+                    'LapTime': pd.to_timedelta(sectors.sum(), unit='s'),
+                    'LapStartTime': pd.to_timedelta(start, unit='s'),
+                    'Time': pd.to_timedelta(start + sectors.sum(), unit='s'),
+                    'Sector1Time': pd.to_timedelta(sectors[0], unit='s'),
+                    'Sector2Time': pd.to_timedelta(sectors[1], unit='s'),
+                    'Sector3Time': pd.to_timedelta(sectors[2], unit='s'),
+                    'Deleted': False
+                })
+                #A cool-down lap between two timed laps
+                start += sectors.sum() + COOL_DOWN
+        df = pd.DataFrame(rows)
+        #Personal best flags like fastf1: every lap that improved on the best so far
+        df['IsPersonalBest'] = df['LapTime'] == df.groupby('Driver')['LapTime'].cummin()
+        self.laps = Laps(df)
+        self._pace = pace
+        self._car_data = {}
+
+    def _lap_rng(self, driver, lap_number):
+        return np.random.default_rng([self.seed, int(driver[1:]), int(lap_number)])
+
+    def _profile(self, pace, driver, lap_number):
+        #Speed along the lap of one driver and lap, slowed by pace and noise
+        dist, x, y, speed = self._shape
+        noise = self._lap_rng(driver, lap_number).normal(0, 0.01, 8)
+        wobble = 1 + sum(a * np.sin((i + 1) * np.pi * dist / TRACK_LENGTH) for i, a in enumerate(noise)) / 4
+        return speed / pace * wobble
+
+    def _lap_times(self, pace, driver, lap_number):
+        dist = self._shape[0]
+        speed = self._profile(pace, driver, lap_number) / 3.6
+        time = np.concatenate([[0], np.cumsum(np.diff(dist) / speed[1:])])
+        bounds = np.interp([TRACK_LENGTH / 3, 2 * TRACK_LENGTH / 3, TRACK_LENGTH], dist, time)
+        return np.diff(bounds, prepend=0)
+
+    def lap_telemetry(self, lap, kind='telemetry'):
+        """Telemetry of a lap, in the layout of ``Lap.get_telemetry().add_distance()``."""
+        driver, lap_number = str(lap['Driver']), int(lap['LapNumber'])
+        dist, x, y, _ = self._shape
+        speed = self._profile(self._pace[driver], driver, lap_number)
+        time = np.concatenate([[0], np.cumsum(np.diff(dist) / (speed[1:] / 3.6))])
+
+        at = np.linspace(0, TRACK_LENGTH, self.samples)
+        tel = pd.DataFrame({
+            'Time': pd.to_timedelta(np.interp(at, dist, time), unit='s'),
+            'Speed': np.rint(np.interp(at, dist, speed)),
+            'Distance': at
+        })
+        if kind == 'telemetry':
+            tel['X'] = np.interp(at, dist, x)
+            tel['Y'] = np.interp(at, dist, y)
+        return tel
+
+    def lap_car_data(self, lap):
+        return self.lap_telemetry(lap, 'car')
+
+    def driver_car_data(self, number):
+        """Car data of a driver over the session, in the layout of ``session.car_data[number]``.
+
+        Built on first use and kept, as fastf1 keeps the car data with the session.
+        """
+        number = str(number)
+        if number in self._car_data:
+            return self._car_data[number]
+        laps = self.laps[self.laps['DriverNumber'] == number]
+        parts = []
+        for _, lap in laps.iterlaps():
+            tel = self.lap_telemetry(lap, 'car')
+            parts.append(pd.DataFrame({'SessionTime': lap['LapStartTime'] + tel['Time'], 'Speed': tel['Speed']}))
+        data = self._car_data[number] = pd.concat(parts, ignore_index=True) if parts else None
+        return data
@@ -0,0 +1,196 @@
+"""Columnar on-disk store of per-lap telemetry with memory-mapped reads.
+
+The telemetry of every timed lap of a session is written once as one ``.npy``
+file per channel (all laps concatenated) plus a lap offset index. Reads map
+the files into memory and return the slice of the requested lap without
+copying, so later views of a session skip fastf1's cache and parsing and only
+touch the bytes of the laps they use.
+
+Layout::
+
+    <root>/v<version>/<year>/<event>/<session>/<kind>/index.npy     driver, lap, start, stop
+    <root>/v<version>/<year>/<event>/<session>/<kind>/<channel>.npy
+
+``kind`` is ``telemetry`` (merged car and position data, as returned by
+``Lap.get_telemetry()``) or ``car`` (``Lap.get_car_data()``). Channels are
+stored in the compact dtypes of :mod:`compact_telemetry`, ``Time`` as float32
+seconds from the start of the lap. Sessions written in an older format
+version are not read, they are extracted again.
+
+Extract a session ahead of time with::
+
+    python telemetry_store.py 2024 "Monaco Grand Prix" Qualifying
+"""
+import argparse
+import os
+import shutil
+import threading
+
+import numpy as np
+import pandas as pd
+
+from compact_telemetry import DTYPES, compact
+from paths import slug
+
+STORE_DIR = os.environ.get(
+    "F1_TELEMETRY_STORE",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "telemetry")
+)
+
+#Bumped whenever the on-disk layout or dtypes change
+FORMAT_VERSION = 2
+
+CHANNELS = {
+    'telemetry': ['Distance', 'Time', 'Speed', 'X', 'Y'],
+    'car': ['Distance', 'Time', 'Speed']
+}
+
+INDEX_DTYPE = np.dtype([('driver', 'U8'), ('lap', 'i4'), ('start', 'i8'), ('stop', 'i8')])
+
+
+def lap_telemetry(lap, kind):
+    """Telemetry of one lap with distance added, straight from fastf1."""
+    if kind == 'telemetry':
+        return lap.get_telemetry().add_distance()
+    if kind == 'car':
+        return lap.get_car_data().add_distance()
+    raise ValueError(f"Unknown telemetry kind: {kind!r}")
+
+
+class _Columns:
+    """Memory-mapped channels and lap index of one session and kind."""
+
+    def __init__(self, path, channels):
+        index = np.load(os.path.join(path, 'index.npy'))
+        self.offsets = {(str(row['driver']), int(row['lap'])): (int(row['start']), int(row['stop']))
+                        for row in index}
+        self.channels = {channel: np.load(os.path.join(path, f'{channel}.npy'), mmap_mode='r')
+                         for channel in channels}
+
+    def lap(self, driver, lap_number):
+        span = self.offsets.get((str(driver), int(lap_number)))
+        if span is None:
+            return None
+        start, stop = span
+        return pd.DataFrame({channel: pd.Series(values[start:stop], copy=False)
+                             for channel, values in self.channels.items()}, copy=False)
+
+
+class TelemetryStore:
+    """Per-session columnar telemetry files under a root directory."""
+
+    def __init__(self, root=STORE_DIR):
+        self.root = root
+        self._open = {}
+        self._lock = threading.Lock()
+
+    def path(self, key, kind):
+        year, event, session_type = key
+        return os.path.join(self.root, f"v{FORMAT_VERSION}", str(year), slug(event), slug(session_type), kind)
+
+    def has(self, key, kind):
+        return os.path.exists(os.path.join(self.path(key, kind), 'index.npy'))
+
+    def _columns(self, key, kind):
+        path = self.path(key, kind)
+        with self._lock:
+            columns = self._open.get(path)
+            if columns is None and self.has(key, kind):
+                columns = self._open[path] = _Columns(path, CHANNELS[kind])
+        return columns
+
+    def read(self, key, kind, driver, lap_number):
+        """Zero-copy telemetry of one lap, or None when it is not stored."""
+        columns = self._columns(key, kind)
+        if columns is None:
+            return None
+        return columns.lap(driver, lap_number)
+
+    def write(self, key, kind, laps):
+        """Write the telemetry of a session.
+
+        ``laps`` yields ``(driver, lap number, telemetry)`` tuples. The files
+        are written to a temporary directory and moved in place at the end,
+        so readers never see a partial session. Returns the number of laps.
+        """
+        channels = CHANNELS[kind]
+        index = []
+        values = {channel: [] for channel in channels}
+        start = 0
+        for driver, lap_number, tel in laps:
+            stop = start + len(tel)
+            index.append((driver, lap_number, start, stop))
+            tel = compact(tel, channels)
+            for channel in channels:
+                values[channel].append(tel[channel].to_numpy())
+            start = stop
+
+        path = self.path(key, kind)
+        tmp = path + '.tmp'
+        shutil.rmtree(tmp, ignore_errors=True)
+        os.makedirs(tmp)
+        np.save(os.path.join(tmp, 'index.npy'), np.array(index, dtype=INDEX_DTYPE))
+        for channel, parts in values.items():
+            data = np.concatenate(parts) if parts else np.empty(0, dtype=DTYPES[channel])
+            np.save(os.path.join(tmp, f'{channel}.npy'), data)
+
+        with self._lock:
+            self._open.pop(path, None)
+            shutil.rmtree(path, ignore_errors=True)
+            os.replace(tmp, path)
+        return len(index)
+
+
+def extract_session(session, key, kind='telemetry', store=None):
+    """Write the telemetry of every timed lap of a loaded session to the store.
+
+    The session needs its telemetry loaded. Laps whose telemetry cannot be
+    sliced are left out. Returns the number of laps written.
+    """
+    store = store or get_telemetry_store()
+    laps = session.laps.dropna(subset=['LapTime'])
+
+    def rows():
+        for _, lap in laps.iterlaps():
+            try:
+                tel = lap_telemetry(lap, kind)
+            except Exception:
+                continue
+            if len(tel):
+                yield str(lap['Driver']), int(lap['LapNumber']), tel
+
+    return store.write(key, kind, rows())
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_telemetry_store():
+    """Return the process-wide telemetry store."""
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = TelemetryStore()
+        return _store
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Extract the lap telemetry of a session to the columnar store.")
+    parser.add_argument('year', type=int)
+    parser.add_argument('event')
+    parser.add_argument('session')
+    parser.add_argument('--kind', choices=sorted(CHANNELS), nargs='+', default=sorted(CHANNELS))
+    args = parser.parse_args()
+
+    import fastf1 as ff1
+    session = ff1.get_session(args.year, args.event, args.session)
+    session.load(laps=True, telemetry=True, weather=False, messages=True)
+
+    key = (args.year, args.event, args.session)
+    for kind in args.kind:
+        print(f"{kind}: {extract_session(session, key, kind)} laps written")
+
+
+if __name__ == '__main__':
+    main()
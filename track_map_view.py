@@ -0,0 +1,250 @@
+"""Interactive track map drawn in the browser.
+
+The track polyline is simplified once per session with a top-down
+Douglas-Peucker pass that stops at a point budget, so the payload stays
+bounded however dense the telemetry is. The payload holds the simplified
+geometry plus the smoothed lap time and speed of every driver at the kept
+points; the page ships it once and the browser computes the delta of the
+selected pair, colours the track, shows hover readouts and handles zoom and
+pan without any server work.
+"""
+import heapq
+import json
+import os
+
+import numpy as np
+
+#Maximum number of track points sent to the browser
+MAX_POINTS = int(os.environ.get("F1_TRACK_MAP_POINTS", 600))
+
+
+def _segment_distances(x, y, start, stop):
+    #Distance of the points strictly between start and stop to the chord
+    px = x[start + 1:stop] - x[start]
+    py = y[start + 1:stop] - y[start]
+    dx = x[stop] - x[start]
+    dy = y[stop] - y[start]
+    length = np.hypot(dx, dy)
+    if length == 0:
+        return np.hypot(px, py)
+    return np.abs(px * dy - py * dx) / length
+
+
+def simplify(x, y, max_points=MAX_POINTS):
+    """Indices of at most ``max_points`` points that best keep the shape.
+
+    Douglas-Peucker run top-down with a budget: the point furthest from the
+    current simplified line is added first, until the budget is spent. The
+    first and last points are always kept and the result is sorted.
+    """
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    n = len(x)
+    if n <= max_points:
+        return np.arange(n)
+
+    keep = [0, n - 1]
+    heap = []
+
+    def push(start, stop):
+        if stop - start < 2:
+            return
+        dist = _segment_distances(x, y, start, stop)
+        k = int(np.argmax(dist))
+        #Ties are broken on the index, so the result is deterministic
+        heapq.heappush(heap, (-dist[k], start + 1 + k, start, stop))
+
+    push(0, n - 1)
+    while heap and len(keep) < max_points:
+        _, split, start, stop = heapq.heappop(heap)
+        keep.append(split)
+        push(start, split)
+        push(split, stop)
+    return np.sort(keep)
+
+
+def track_map_payload(engine, max_points=MAX_POINTS):
+    """JSON payload of the interactive map for every driver of a session.
+
+    The geometry is the lap of the session's fastest driver, normalized to
+    [-1, 1] the same way as the static map.
+    """
+    fastest = int(np.argmin(engine.times[:, -1]))
+    x, y = engine.x[fastest], engine.y[fastest]
+    idx = simplify(x, y, max_points)
+
+    x = x - np.mean(x)
+    y = y - np.mean(y)
+    scale = max(np.max(np.abs(x)), np.max(np.abs(y)))
+
+    payload = {
+        'drivers': engine.drivers,
+        'distance': np.round(engine.distance[idx], 1).tolist(),
+        'x': np.round(x[idx] / scale, 4).tolist(),
+        'y': np.round(y[idx] / scale, 4).tolist(),
+        'time': np.round(engine.smoothed[:, idx], 3).tolist(),
+        'speed': np.round(engine.speed[:, idx]).astype(int).tolist()
+    }
+    return json.dumps(payload, separators=(',', ':'))
+
+
+_TEMPLATE = """
+<div id="map" style="font-family: sans-serif; font-size: 13px;">
+  <div style="display: flex; gap: 12px; align-items: center; margin-bottom: 6px;">
+    <label>Driver 1 <select id="d1"></select></label>
+    <label>Driver 2 <select id="d2"></select></label>
+    <label>Scale <select id="scale">
+      <option value="max">Full range</option>
+      <option value="p95">95th percentile</option>
+      <option value="fixed">&plusmn; 0.25 s</option>
+    </select></label>
+    <label>Colours <select id="cmap">
+      <option value="coolwarm">Red / Blue</option>
+      <option value="purplegreen">Purple / Green</option>
+    </select></label>
+    <button id="reset">Reset zoom</button>
+  </div>
+  <div style="position: relative;">
+    <canvas id="canvas" style="width: 100%; height: __HEIGHT__px; cursor: crosshair;"></canvas>
+    <div id="tip" style="position: absolute; display: none; pointer-events: none; background: rgba(255,255,255,0.92);
+         border: 1px solid #999; border-radius: 4px; padding: 4px 6px; white-space: nowrap;"></div>
+  </div>
+  <div id="legend" style="text-align: center; margin-top: 4px;"></div>
+</div>
+<script>
+const data = __PAYLOAD__;
+const CMAPS = {
+  coolwarm: [[59, 76, 192], [221, 221, 221], [180, 4, 38]],
+  purplegreen: [[64, 0, 75], [247, 247, 247], [0, 68, 27]]
+};
+const NAMES = {coolwarm: ['Blue', 'Red'], purplegreen: ['Purple', 'Green']};
+const canvas = document.getElementById('canvas');
+const ctx = canvas.getContext('2d');
+const tip = document.getElementById('tip');
+const sel1 = document.getElementById('d1');
+const sel2 = document.getElementById('d2');
+for (const d of data.drivers) {
+  sel1.add(new Option(d, d));
+  sel2.add(new Option(d, d));
+}
+sel1.value = __DRIVER1__;
+sel2.value = __DRIVER2__;
+
+let view = {zoom: 1, cx: 0, cy: 0};
+let delta = [], limit = 1;
+
+function update() {
+  const t1 = data.time[data.drivers.indexOf(sel1.value)];
+  const t2 = data.time[data.drivers.indexOf(sel2.value)];
+  delta = t2.map((t, i) => t - t1[i]);
+  const abs = delta.map(Math.abs).sort((a, b) => a - b);
+  const mode = document.getElementById('scale').value;
+  limit = mode === 'fixed' ? 0.25 : mode === 'p95' ? abs[Math.floor(0.95 * (abs.length - 1))] : abs[abs.length - 1];
+  limit = limit || 1e-3;
+  draw();
+}
+
+function colour(value) {
+  const stops = CMAPS[document.getElementById('cmap').value];
+  //Positive delta = driver 1 ahead, drawn with the last stop like the static map
+  const t = Math.max(-1, Math.min(1, value / limit));
+  const [a, b] = t < 0 ? [stops[1], stops[0]] : [stops[1], stops[2]];
+  const f = Math.abs(t);
+  return `rgb(${a.map((c, i) => Math.round(c + (b[i] - c) * f)).join(',')})`;
+}
+
+function toScreen(x, y) {
+  const w = canvas.width, h = canvas.height, s = 0.45 * Math.min(w, h) * view.zoom;
+  return [w / 2 + (x - view.cx) * s, h / 2 - (y - view.cy) * s];
+}
+
+function fromScreen(px, py) {
+  const w = canvas.width, h = canvas.height, s = 0.45 * Math.min(w, h) * view.zoom;
+  return [(px - w / 2) / s + view.cx, -(py - h / 2) / s + view.cy];
+}
+
+function draw() {
+  const names = NAMES[document.getElementById('cmap').value];
+  document.getElementById('legend').textContent =
+    `${names[1]} = ${sel1.value} faster    |    ${names[0]} = ${sel2.value} faster    (scale ±${limit.toFixed(3)} s)`;
+  const ratio = window.devicePixelRatio || 1;
+  canvas.width = canvas.clientWidth * ratio;
+  canvas.height = canvas.clientHeight * ratio;
+  ctx.clearRect(0, 0, canvas.width, canvas.height);
+  ctx.lineWidth = 5 * ratio;
+  ctx.lineCap = 'round';
+  for (let i = 0; i < data.x.length - 1; i++) {
+    const [x0, y0] = toScreen(data.x[i], data.y[i]);
+    const [x1, y1] = toScreen(data.x[i + 1], data.y[i + 1]);
+    ctx.strokeStyle = colour((delta[i] + delta[i + 1]) / 2);
+    ctx.beginPath();
+    ctx.moveTo(x0, y0);
+    ctx.lineTo(x1, y1);
+    ctx.stroke();
+  }
+}
+
+function nearest(px, py) {
+  let best = -1, bestDist = Infinity;
+  for (let i = 0; i < data.x.length; i++) {
+    const [sx, sy] = toScreen(data.x[i], data.y[i]);
+    const d = (sx - px) ** 2 + (sy - py) ** 2;
+    if (d < bestDist) { best = i; bestDist = d; }
+  }
+  return [best, Math.sqrt(bestDist)];
+}
+
+let drag = null;
+canvas.addEventListener('mousemove', (e) => {
+  const ratio = window.devicePixelRatio || 1;
+  const px = e.offsetX * ratio, py = e.offsetY * ratio;
+  if (drag) {
+    const s = 0.45 * Math.min(canvas.width, canvas.height) * view.zoom;
+    view.cx = drag.cx - (px - drag.px) / s;
+    view.cy = drag.cy + (py - drag.py) / s;
+    draw();
+    return;
+  }
+  const [i, dist] = nearest(px, py);
+  if (i < 0 || dist > 20 * ratio) { tip.style.display = 'none'; return; }
+  const s1 = data.speed[data.drivers.indexOf(sel1.value)][i];
+  const s2 = data.speed[data.drivers.indexOf(sel2.value)][i];
+  tip.innerHTML = `${data.distance[i].toFixed(0)} m<br>Delta ${delta[i] >= 0 ? '+' : ''}${delta[i].toFixed(3)} s`
+    + `<br>${sel1.value} ${s1} km/h<br>${sel2.value} ${s2} km/h`;
+  tip.style.left = (e.offsetX + 12) + 'px';
+  tip.style.top = (e.offsetY + 12) + 'px';
+  tip.style.display = 'block';
+});
+canvas.addEventListener('mouseleave', () => { tip.style.display = 'none'; drag = null; });
+canvas.addEventListener('mousedown', (e) => {
+  const ratio = window.devicePixelRatio || 1;
+  drag = {px: e.offsetX * ratio, py: e.offsetY * ratio, cx: view.cx, cy: view.cy};
+});
+canvas.addEventListener('mouseup', () => { drag = null; });
+canvas.addEventListener('wheel', (e) => {
+  e.preventDefault();
+  const ratio = window.devicePixelRatio || 1;
+  const [x, y] = fromScreen(e.offsetX * ratio, e.offsetY * ratio);
+  view.zoom = Math.max(1, Math.min(40, view.zoom * (e.deltaY < 0 ? 1.2 : 1 / 1.2)));
+  //Keep the point under the cursor in place
+  const [nx, ny] = fromScreen(e.offsetX * ratio, e.offsetY * ratio);
+  view.cx += x - nx;
+  view.cy += y - ny;
+  draw();
+}, {passive: false});
+document.getElementById('reset').onclick = () => { view = {zoom: 1, cx: 0, cy: 0}; draw(); };
+for (const id of ['d1', 'd2', 'scale']) document.getElementById(id).onchange = update;
+document.getElementById('cmap').onchange = draw;
+window.addEventListener('resize', draw);
+update();
+</script>
+"""
+
+
+def track_map_html(payload, driver1, driver2, height=560):
+    """HTML of the interactive map for ``components.html``."""
+    return (_TEMPLATE
+            .replace('__PAYLOAD__', payload)
+            .replace('__DRIVER1__', json.dumps(driver1))
+            .replace('__DRIVER2__', json.dumps(driver2))
+            .replace('__HEIGHT__', str(int(height))))
@@ -0,0 +1,110 @@
+"""Warm start of a server process: heavy imports and the default session at boot.
+
+The pages import fastf1, matplotlib and scipy only in the stage that needs
+them, so the first view in a fresh process still pays for them. Starting the
+server through this module does that work in a background thread while the
+server boots::
+
+    F1_WARM_SESSION="2025,Monaco Grand Prix,Qualifying" python warm_start.py F1_hotlap_comparison.py
+
+Any further arguments are passed to ``streamlit run``. The pages run in the
+same process, so they find the modules imported, the metadata index read and
+the default session in the session store (with its neighbouring sessions and
+top qualifier laps prefetched). Set ``F1_WARM_START=0`` to boot cold.
+"""
+import importlib
+import logging
+import os
+import sys
+import threading
+import time
+
+_logger = logging.getLogger(__name__)
+
+#Set to 0 to start the server without warming it
+ENABLED = os.environ.get("F1_WARM_START", "1") == "1"
+
+#Session loaded at boot as "year,event,session", empty for none
+DEFAULT_SESSION = os.environ.get("F1_WARM_SESSION", "")
+
+#Modules the pages defer to their stages
+HEAVY_MODULES = ('fastf1', 'fastf1.plotting', 'matplotlib.pyplot', 'scipy.ndimage', 'scipy.spatial',
+                 'streamlit.components.v1', 'figures')
+
+
+def parse_session(text):
+    """``(year, event, session)`` of a "year,event,session" string, or None when empty."""
+    if not text.strip():
+        return None
+    year, event, session_type = (part.strip() for part in text.split(',', 2))
+    return int(year), event, session_type
+
+
+def preimport(modules=HEAVY_MODULES):
+    """Import ``modules``, returns the seconds each one took."""
+    if 'matplotlib.pyplot' in modules:
+        #The pages only save figures to bytes, never pick an interactive backend off the main thread
+        import matplotlib
+        matplotlib.use('Agg')
+    timings = {}
+    for name in modules:
+        start = time.perf_counter()
+        try:
+            importlib.import_module(name)
+        except ImportError as exc:
+            _logger.warning("Warm start could not import %s: %s", name, exc)
+            continue
+        timings[name] = time.perf_counter() - start
+    return timings
+
+
+def preload(year, event, session_type):
+    """Load a session into the session store as the pages would, and prefetch around it."""
+    from metadata_index import get_metadata_index
+    from prefetch import prefetch_after_select
+    from session_store import get_session
+
+    get_metadata_index().schedule(year)
+    session = get_session(year, event, session_type)
+    prefetch_after_select(year, event, session_type)
+    return session
+
+
+def warm(session=DEFAULT_SESSION, modules=HEAVY_MODULES):
+    """Pre-import ``modules`` and preload ``session`` (a "year,event,session" string)."""
+    start = time.perf_counter()
+    timings = preimport(modules)
+    _logger.info("Warm start imported %d modules in %.2f s", len(timings), sum(timings.values()))
+
+    target = parse_session(session)
+    if target is not None:
+        try:
+            preload(*target)
+        except Exception as exc:
+            _logger.warning("Warm start could not load %s: %s", session, exc)
+        else:
+            _logger.info("Warm start loaded %s", session)
+    return time.perf_counter() - start
+
+
+def start(session=DEFAULT_SESSION, modules=HEAVY_MODULES):
+    """Warm the process in a daemon thread, returns the thread."""
+    thread = threading.Thread(target=warm, args=(session, modules), name="warm-start", daemon=True)
+    thread.start()
+    return thread
+
+
+def main():
+    if len(sys.argv) < 2:
+        sys.exit("usage: python warm_start.py <page.py> [streamlit run options]")
+    logging.basicConfig(level=logging.INFO)
+    if ENABLED:
+        start()
+
+    from streamlit.web import cli
+    sys.argv = ['streamlit', 'run', *sys.argv[1:]]
+    sys.exit(cli.main())
+
+
+if __name__ == '__main__':
+    main()